@@ -0,0 +1,303 @@
+"""
+Persistent, searchable archive of group chat messages.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    room TEXT NOT NULL,
+    nick TEXT NOT NULL,
+    stamp REAL NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5(body, content='');
+CREATE TABLE IF NOT EXISTS seen (
+    room TEXT NOT NULL,
+    nick TEXT NOT NULL,
+    stamp REAL NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (room, nick)
+);
+"""
+
+SEGMENT_SUFFIX = '.log'
+
+
+class Segment:
+    """The segment file of a room that new messages are appended to."""
+
+    def __init__(self, path, number):
+        """Open a segment for appending."""
+        self.number = number
+        self.handle = open(path, 'ab')
+        self.size = self.handle.tell()
+
+
+class MessageArchive:
+    """
+    Stores group chat messages and answers !search and !seen.
+
+    Each room has its own directory of append-only segment files holding one
+    JSON line per message; a segment is closed and a new one started once it
+    reaches segment_size bytes. Alongside them an SQLite database keeps a
+    full-text (FTS5) index that maps words to message ids, the segment and
+    offset of each message, and the last message of every nick per room.
+
+    Messages are buffered in memory and written in one batch per
+    flush_interval by a worker thread, so the event loop never waits on disk.
+    Queries run in worker threads too, on a separate read connection.
+    """
+
+    def __init__(self, bot):
+        """Initialize the archive with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        config = self.bot.config
+        self.enabled = config.getboolean('archive', 'enabled', fallback=False)
+        self.path = config.get('archive', 'path', fallback='archive')
+        self.segment_size = config.getint('archive', 'segment_size', fallback=16 * 2**20)
+        self.flush_interval = config.getfloat('archive', 'flush_interval', fallback=1.0)
+        self.batch_size = config.getint('archive', 'batch_size', fallback=5000)
+        self.max_results = config.getint('archive', 'max_results', fallback=5)
+        rooms = config.get('archive', 'rooms', fallback='')
+        self.rooms = {room.strip().lower() for room in rooms.split(',') if room.strip()}
+
+        # Messages waiting to be written: (room, nick, stamp, body)
+        self._pending = []
+        self._writing = []  # batch handed to the writer thread
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._segments = {}  # room -> Segment being appended to
+        self._conn = None
+        self._reader = None
+        self._next_id = 1
+        self.stats = {'archived': 0, 'batches': 0, 'searches': 0}
+
+        if self.enabled:
+            self._open()
+
+    def _open(self):
+        """Create the archive directory and open the index database."""
+        os.makedirs(self.path, exist_ok=True)
+        db_path = os.path.join(self.path, 'index.db')
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._reader = sqlite3.connect(db_path, check_same_thread=False)
+        self._next_id = (self._conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0) + 1
+
+    def archives(self, room_jid):
+        """Check whether messages of a room are archived."""
+        if not self.enabled:
+            return False
+        setting = self.bot.conference_manager.get_room_setting(room_jid, 'archive')
+        if setting is not None:
+            return bool(setting)
+        return not self.rooms or room_jid.lower() in self.rooms
+
+    def start(self):
+        """Start the background writer."""
+        if not self.enabled or (self._task and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._flush_loop())
+        self.logger.info("Message archive started in %s", self.path)
+
+    async def stop(self):
+        """Stop the background writer after writing out buffered messages."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+
+    def append(self, room_jid, nick, body, stamp=None):
+        """Buffer a message for the archive."""
+        if not body or not self.archives(room_jid):
+            return
+        self._pending.append((room_jid, nick, time.time() if stamp is None else stamp, body))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        """Write buffered messages every flush_interval, or sooner when a batch fills up."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                # The batch is taken here, on the loop, so append() never races the writer
+                batch, self._pending = self._pending, []
+                self._writing = batch
+                try:
+                    await loop.run_in_executor(None, self._write, batch)
+                except Exception as e:
+                    self.logger.error(f"Failed to write message archive: {e}", exc_info=True)
+                finally:
+                    self._writing = []
+
+    def _segment(self, room_jid):
+        """Get the segment to append to for a room, starting a new one when full."""
+        segment = self._segments.get(room_jid)
+        if segment is not None and segment.size < self.segment_size:
+            return segment
+        room_dir = os.path.join(self.path, room_jid.replace(os.sep, '_'))
+        if segment is None:
+            os.makedirs(room_dir, exist_ok=True)
+            numbers = [int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(room_dir)
+                       if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()]
+            number = max(numbers, default=1)
+        else:
+            segment.handle.close()
+            number = segment.number + 1
+        segment = Segment(os.path.join(room_dir, f'{number:06d}{SEGMENT_SUFFIX}'), number)
+        if segment.size >= self.segment_size:
+            segment.handle.close()
+            segment = Segment(os.path.join(room_dir, f'{number + 1:06d}{SEGMENT_SUFFIX}'), number + 1)
+        self._segments[room_jid] = segment
+        return segment
+
+    def flush(self):
+        """Write all buffered messages now, in the calling thread."""
+        batch, self._pending = self._pending, []
+        return self._write(batch)
+
+    def _write(self, pending):
+        """Append messages to their segments and index them in one transaction."""
+        if not pending:
+            return 0
+        with self._write_lock:
+            rows = []
+            bodies = []
+            seen = {}
+            touched = set()
+            for room, nick, stamp, body in pending:
+                segment = self._segment(room)
+                line = json.dumps({'nick': nick, 'stamp': stamp, 'body': body},
+                                  ensure_ascii=False).encode('utf-8') + b'\n'
+                offset = segment.size
+                segment.handle.write(line)
+                segment.size += len(line)
+                touched.add(room)
+                rows.append((self._next_id, room, nick, stamp, segment.number, offset))
+                bodies.append((self._next_id, body))
+                seen[room, nick] = (room, nick, stamp, body[:200])
+                self._next_id += 1
+            # The log is written before the index, so indexed offsets always exist
+            for room in touched:
+                self._segments[room].handle.flush()
+            with self._conn:
+                self._conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._conn.executemany(
+                    "INSERT INTO message_index (rowid, body) VALUES (?, ?)", bodies)
+                self._conn.executemany(
+                    "INSERT INTO seen VALUES (?, ?, ?, ?) ON CONFLICT (room, nick) DO UPDATE "
+                    "SET stamp = excluded.stamp, body = excluded.body WHERE excluded.stamp >= stamp",
+                    seen.values()
+                )
+        self.stats['archived'] += len(rows)
+        self.stats['batches'] += 1
+        self.logger.debug("Archived %d messages", len(rows))
+        return len(rows)
+
+    @staticmethod
+    def _match_query(terms):
+        """Build an FTS5 query that matches all terms; a trailing * makes a prefix match."""
+        parts = []
+        for term in terms:
+            prefix = term.endswith('*')
+            term = term.rstrip('*').replace('"', '""')
+            if term:
+                parts.append(f'"{term}"*' if prefix else f'"{term}"')
+        return ' '.join(parts)
+
+    def _read(self, room_jid, segment, offset):
+        """Read one message back from its segment."""
+        path = os.path.join(self.path, room_jid.replace(os.sep, '_'),
+                            f'{segment:06d}{SEGMENT_SUFFIX}')
+        with open(path, 'rb') as handle:
+            handle.seek(offset)
+            return json.loads(handle.readline())
+
+    def _search(self, room_jid, query, limit):
+        """Find the newest messages in a room matching an FTS5 query."""
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT m.room, m.segment, m.offset FROM message_index AS f "
+                "JOIN messages AS m ON m.id = f.rowid "
+                "WHERE message_index MATCH ? AND m.room = ? ORDER BY f.rowid DESC LIMIT ?",
+                (query, room_jid, limit)
+            ).fetchall()
+        results = []
+        for room, segment, offset in rows:
+            try:
+                results.append(self._read(room, segment, offset))
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Could not read archived message in {room}: {e}")
+        return results
+
+    async def search(self, room_jid, terms, limit=None):
+        """Search a room's archive; returns message dicts, newest first."""
+        query = self._match_query(terms)
+        if not query:
+            return []
+        self.stats['searches'] += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._search, room_jid, query, limit or self.max_results
+        )
+
+    def _last_seen(self, room_jid, nick):
+        """Look up the last message of a nick in a room."""
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT nick, stamp, body FROM seen WHERE room = ? AND nick = ? COLLATE NOCASE "
+                "ORDER BY stamp DESC LIMIT 1",
+                (room_jid, nick)
+            ).fetchone()
+        return None if row is None else {'nick': row[0], 'stamp': row[1], 'body': row[2]}
+
+    async def last_seen(self, room_jid, nick):
+        """Get the last message of a nick in a room, or None if it never spoke."""
+        # Messages not yet written are the newest ones
+        folded = nick.casefold()
+        for room, pending_nick, stamp, body in reversed(self._writing + self._pending):
+            if room == room_jid and pending_nick.casefold() == folded:
+                return {'nick': pending_nick, 'stamp': stamp, 'body': body[:200]}
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._last_seen, room_jid, nick
+        )
+
+    def close(self):
+        """Write buffered messages and close segments and the database."""
+        if not self.enabled or self._conn is None:
+            return
+        self.flush()
+        with self._write_lock:
+            for segment in self._segments.values():
+                segment.handle.close()
+            self._segments.clear()
+            self._conn.close()
+        with self._read_lock:
+            self._reader.close()
+        self._conn = self._reader = None
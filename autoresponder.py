@@ -0,0 +1,355 @@
+"""
+Per-room keyword and regex triggers that reply to or react on messages.
+"""
+
+import logging
+import re
+import time
+from collections import deque
+
+from slixmpp.plugins.xep_0444.stanza import is_emoji
+
+from outbound import PRIORITY_REPLY
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton matching many literal strings in one pass.
+
+    Patterns are added with a value, then build() computes failure links;
+    after that, search() walks the text once whatever the number of patterns.
+    """
+
+    def __init__(self):
+        """Create an empty automaton."""
+        self.goto = [{}]     # state -> {char: state}
+        self.fail = [0]      # state -> failure state
+        self.output = [()]   # state -> ((pattern length, value), ...) ending here
+
+    def add(self, pattern, value):
+        """Add a pattern; build() must be called before searching."""
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        self.output[state] += ((len(pattern), value),)
+
+    def build(self):
+        """Compute failure links breadth first and merge outputs along them."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] += self.output[self.fail[child]]
+
+    def search(self, text):
+        """Yield (start, end, value) for every pattern occurrence, by end position."""
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                end = index + 1
+                for length, value in output[state]:
+                    yield end - length, end, value
+
+
+def _is_word_char(char):
+    """Check whether a character is part of a word for whole-word matching."""
+    return char.isalnum() or char == '_'
+
+
+# Characters that end a run of literal characters in a regular expression
+_REGEX_SPECIAL = set('.^$*+?{}[]()|\\')
+_QUANTIFIERS = set('*?{')
+
+
+def required_literal(pattern, min_length=3):
+    """
+    Find a literal substring every match of a regex must contain, or None.
+
+    Only top-level literal runs are considered, so the answer is
+    conservative: groups, classes and escapes other than escaped punctuation
+    end a run, a character made optional by a quantifier is dropped, and a
+    top-level alternation means there is no such substring at all.
+    """
+    runs = []
+    run = []
+    depth = 0
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            escaped = pattern[index + 1:index + 2]
+            if escaped and escaped in 'xuUN0123456789':
+                # Escapes that take arguments; not worth decoding here
+                return None
+            index += 2
+            if depth == 0 and escaped and not escaped.isalnum():
+                run.append(escaped)
+                continue
+            runs.append(''.join(run))
+            run = []
+            continue
+        if char == '[':
+            # Skip the whole class, including escaped and leading ']'
+            index += 2 if pattern[index + 1:index + 2] == ']' else 1
+            while index < len(pattern) and pattern[index] != ']':
+                index += 2 if pattern[index] == '\\' else 1
+            index += 1
+            runs.append(''.join(run))
+            run = []
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return None
+        if char in _REGEX_SPECIAL or depth:
+            if char in _QUANTIFIERS and run:
+                run.pop()
+            runs.append(''.join(run))
+            run = []
+            if char == '{' and not depth:
+                # Skip the repeat count
+                index = pattern.find('}', index)
+                if index < 0:
+                    return None
+        else:
+            run.append(char)
+        index += 1
+    runs.append(''.join(run))
+    longest = max(runs, key=len)
+    return longest if len(longest) >= min_length else None
+
+
+def _regex_body(trigger):
+    """Get a regex trigger's pattern with its case flag scoped to it."""
+    return trigger['pattern'] if trigger['case'] else f"(?i:{trigger['pattern']})"
+
+
+class RoomMatcher:
+    """
+    All triggers of one room compiled into one automaton and a combined regex.
+
+    The automaton holds the literal triggers and, for each regex trigger, a
+    literal that any match must contain. One pass over the message finds the
+    literal triggers and tells which regexes can match at all; only those
+    are run. Regexes without such a literal are combined into one pattern.
+    """
+
+    def __init__(self, triggers):
+        """Compile a list of validated triggers."""
+        self.triggers = triggers
+        self.automaton = AhoCorasick()
+        self.scan = False
+        self.regexes = {}  # trigger index -> compiled regex, for prefiltered regexes
+        unfiltered = []
+        for index, trigger in enumerate(triggers):
+            # Case-sensitive patterns are found in the lowered text too, then checked exactly
+            if not trigger['regex']:
+                self.automaton.add(trigger['pattern'].lower(), index)
+                self.scan = True
+                continue
+            anchor = required_literal(trigger['pattern'])
+            if anchor:
+                self.automaton.add(anchor.lower(), index)
+                self.regexes[index] = re.compile(_regex_body(trigger))
+                self.scan = True
+            else:
+                unfiltered.append(f"(?P<t{index}>{_regex_body(trigger)})")
+        self.automaton.build()
+        self.regex = re.compile('|'.join(unfiltered)) if unfiltered else None
+
+    def match(self, text):
+        """Get the first trigger matching a text and the matched part, or (None, None)."""
+        candidates = []
+        if self.scan:
+            lowered = text.lower()
+            if len(lowered) != len(text):
+                # A few characters lower to several; keep positions aligned with the text
+                lowered = ''.join(char if len(char.lower()) != 1 else char.lower() for char in text)
+            for start, end, index in self.automaton.search(lowered):
+                trigger = self.triggers[index]
+                if trigger['regex']:
+                    candidates.append(index)
+                    continue
+                haystack = text if trigger['case'] else lowered
+                if trigger['case'] and haystack[start:end] != trigger['pattern']:
+                    continue
+                if trigger['word'] and (
+                        (start > 0 and _is_word_char(haystack[start - 1]))
+                        or (end < len(haystack) and _is_word_char(haystack[end]))):
+                    continue
+                # Literal triggers win over regex triggers
+                return trigger, text[start:end]
+
+        # Of the regexes that can match, the leftmost match wins, then the first trigger
+        best = None
+        for index in sorted(set(candidates)):
+            found = self.regexes[index].search(text)
+            if found and (best is None or found.start() < best[1].start()):
+                best = (index, found)
+        if self.regex is not None:
+            found = self.regex.search(text)
+            if found and (best is None or found.start() < best[1].start()):
+                best = (int(found.lastgroup[1:]), found)
+        if best is None:
+            return None, None
+        index, found = best
+        return self.triggers[index], found.group(0)
+
+
+class AutoResponder:
+    """
+    Answers group chat messages that match a room's triggers.
+
+    Triggers are set per room with configure_room(room, triggers=[...]). Each
+    trigger is a dict with a 'pattern' and a 'reply' and/or 'react' (an emoji
+    sent as an XEP-0444 reaction). A pattern is a literal by default, matched
+    case-insensitively as a whole word; 'regex': True makes it a regular
+    expression, 'case': True makes it case-sensitive and 'word': False lets a
+    literal match inside words. Replies may use {nick}, {room} and {match}.
+
+    A room's triggers are compiled into one RoomMatcher, so a message is
+    scanned once however many triggers the room has. Changing a room's
+    triggers only marks that room; it is recompiled on its next message.
+    """
+
+    def __init__(self, bot):
+        """Initialize the responder with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        config = self.bot.config
+        self.enabled = config.getboolean('autoresponder', 'enabled', fallback=True)
+        self.cooldown = config.getfloat('autoresponder', 'cooldown', fallback=60.0)
+        self.max_triggers = config.getint('autoresponder', 'max_triggers_per_room', fallback=5000)
+        self.max_scan = config.getint('autoresponder', 'max_scan', fallback=2000)
+
+        self.matchers = {}  # room -> RoomMatcher, None when the room has no triggers
+        self._last_fired = {}  # (room, pattern) -> monotonic time of the last response
+        self.stats = {'scanned': 0, 'matched': 0, 'cooling_down': 0, 'rebuilds': 0}
+
+        if self.enabled:
+            self.bot.register_plugin('xep_0359')  # Stanza IDs, to react to room messages
+            self.bot.register_plugin('xep_0444')  # Message Reactions
+
+    def room_changed(self, room_jid):
+        """Mark a room's triggers for recompilation on its next message."""
+        self.matchers.pop(room_jid, None)
+
+    def forget(self, room_jid):
+        """Drop all state of a room the bot left."""
+        self.matchers.pop(room_jid, None)
+        for key in [key for key in self._last_fired if key[0] == room_jid]:
+            del self._last_fired[key]
+
+    def _validate(self, room_jid, raw):
+        """Normalize one trigger from the room settings, or return None if it is invalid."""
+        if not isinstance(raw, dict) or not raw.get('pattern'):
+            self.logger.warning("Ignoring trigger without a pattern in %s: %r", room_jid, raw)
+            return None
+        if not raw.get('reply') and not raw.get('react'):
+            self.logger.warning("Ignoring trigger %r in %s: no reply or react", raw['pattern'], room_jid)
+            return None
+        trigger = {
+            'pattern': str(raw['pattern']),
+            'regex': bool(raw.get('regex', False)),
+            'case': bool(raw.get('case', False)),
+            'word': bool(raw.get('word', True)),
+            'reply': raw.get('reply'),
+            'react': raw.get('react'),
+        }
+        # Checked here rather than on every match; set_reactions refuses non-emoji
+        if trigger['react'] and not (isinstance(trigger['react'], str) and is_emoji(trigger['react'])):
+            self.logger.warning("Ignoring trigger %r in %s: react %r is not an emoji",
+                                trigger['pattern'], room_jid, trigger['react'])
+            return None
+        if trigger['regex']:
+            # Numbered backreferences would point at the wrong group once combined
+            if re.search(r'\\[1-9]', trigger['pattern']):
+                self.logger.warning("Ignoring regex trigger %r in %s: numbered backreferences "
+                                    "are not supported", trigger['pattern'], room_jid)
+                return None
+            try:
+                # Compiled the way RoomMatcher combines it, so global inline flags fail here
+                compiled = re.compile(f"(?P<t0>{_regex_body(trigger)})")
+            except re.error as e:
+                self.logger.warning("Ignoring invalid regex trigger %r in %s: %s",
+                                    trigger['pattern'], room_jid, e)
+                return None
+            # Names and conditional references would clash with other triggers once combined
+            if set(compiled.groupindex) != {'t0'} or '(?(' in trigger['pattern']:
+                self.logger.warning("Ignoring regex trigger %r in %s: named groups and conditionals "
+                                    "are not supported", trigger['pattern'], room_jid)
+                return None
+        return trigger
+
+    def matcher(self, room_jid):
+        """Get the compiled matcher of a room, compiling it if its triggers changed."""
+        if room_jid in self.matchers:
+            return self.matchers[room_jid]
+        raw = self.bot.conference_manager.get_room_setting(room_jid, 'triggers') or []
+        triggers = [trigger for trigger in (self._validate(room_jid, item) for item in raw) if trigger]
+        if len(triggers) > self.max_triggers:
+            self.logger.warning("Room %s has %d triggers, only the first %d are used",
+                                room_jid, len(triggers), self.max_triggers)
+            triggers = triggers[:self.max_triggers]
+        matcher = RoomMatcher(triggers) if triggers else None
+        self.matchers[room_jid] = matcher
+        self.stats['rebuilds'] += 1
+        return matcher
+
+    def handle(self, msg):
+        """Respond to a group chat message if it matches one of the room's triggers."""
+        room = msg['from'].bare
+        matcher = self.matcher(room)
+        if matcher is None:
+            return False
+        self.stats['scanned'] += 1
+        trigger, matched = matcher.match(msg['body'][:self.max_scan])
+        if trigger is None:
+            return False
+
+        now = time.monotonic()
+        key = (room, trigger['pattern'])
+        if now - self._last_fired.get(key, -self.cooldown) < self.cooldown:
+            self.stats['cooling_down'] += 1
+            return False
+        self._last_fired[key] = now
+        self.stats['matched'] += 1
+
+        nick = msg['mucnick']
+        if trigger['reply']:
+            try:
+                reply = trigger['reply'].format(nick=nick, room=room, match=matched)
+            except (KeyError, IndexError, ValueError):
+                reply = trigger['reply']
+            self.bot.outbound.enqueue(room, reply, priority=PRIORITY_REPLY)
+        if trigger['react']:
+            # Rooms identify their messages by stanza-id; fall back to the client's id
+            target = msg['stanza_id']['id'] if msg['stanza_id']['by'] == room else msg['id']
+            if target:
+                reaction = self.bot.make_message(mto=room, mtype='groupchat')
+                self.bot.plugin['xep_0444'].set_reactions(reaction, target, [trigger['react']])
+                self.bot.outbound.enqueue_stanza(reaction, priority=PRIORITY_REPLY)
+        self.logger.debug("Trigger %r matched in %s for %s", trigger['pattern'], room, nick)
+        return True
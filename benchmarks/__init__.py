@@ -0,0 +1,5 @@
+"""
+Benchmarks for the Jabber bot.
+
+Run from the repository root, e.g. ``python -m benchmarks.bench_scheduler``.
+"""
@@ -0,0 +1,138 @@
+"""
+Benchmark the TaskScheduler timer heap at a large number of jobs.
+
+Usage: python -m benchmarks.bench_scheduler [--jobs 100000] [--span 2.0]
+"""
+
+import argparse
+import asyncio
+import configparser
+import json
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import pytz
+
+from occupants import OccupantStore
+from scheduler import TaskScheduler
+
+
+def make_bot():
+    """Build the minimal bot object the scheduler needs."""
+    config = configparser.ConfigParser()
+    config.read_dict({'scheduler': {'hourly_announcements': 'false'}})
+    return SimpleNamespace(config=config, timezone=pytz.utc, occupants=OccupantStore())
+
+
+def measure_heap_memory(job_count):
+    """Measure the memory held by job_count scheduled jobs."""
+    scheduler = TaskScheduler(make_bot())
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for i in range(job_count):
+        scheduler.schedule_once(lambda: None, 3600 + i)
+    memory = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return memory
+
+
+async def bench_heap(job_count, span):
+    """Schedule job_count one-shot jobs over span seconds and run them all."""
+    scheduler = TaskScheduler(make_bot())
+    fired = 0
+    lateness = 0.0
+    done = asyncio.Event()
+
+    def job(due):
+        nonlocal fired, lateness
+        fired += 1
+        lateness += time.time() - due
+        if fired == job_count:
+            done.set()
+
+    # Start the jobs after scheduling is done so scheduling cost is not counted as lateness
+    started = time.perf_counter()
+    first = time.time() + 1.0
+    for i in range(job_count):
+        due = first + span * i / job_count
+        scheduler.schedule_at(job, due, due)
+    schedule_time = time.perf_counter() - started
+
+    await scheduler.start()
+    await asyncio.wait_for(done.wait(), timeout=span + 60)
+    await scheduler.stop()
+    wakeups = scheduler.stats['wakeups']
+
+    # Cancellation of recurring jobs
+    interval_jobs = max(1, job_count // 10)
+    for _ in range(interval_jobs):
+        scheduler.schedule_interval(lambda: None, span / 4)
+    started = time.perf_counter()
+    for job_id in list(scheduler.jobs):
+        scheduler.cancel(job_id)
+    cancel_time = time.perf_counter() - started
+
+    memory = measure_heap_memory(job_count)
+    return {
+        'jobs': job_count,
+        'schedule_seconds': round(schedule_time, 4),
+        'schedule_us_per_job': round(schedule_time / job_count * 1e6, 3),
+        'memory_bytes': memory,
+        'memory_bytes_per_job': round(memory / job_count, 1),
+        'wakeups': wakeups,
+        'jobs_per_wakeup': round(job_count / max(wakeups, 1), 1),
+        'mean_lateness_ms': round(lateness / job_count * 1000, 3),
+        'cancel_us_per_job': round(cancel_time / interval_jobs * 1e6, 3),
+    }
+
+
+async def bench_sleeping_tasks(job_count, span):
+    """Measure the old one-sleeping-task-per-job approach for comparison."""
+    async def delayed(delay):
+        await asyncio.sleep(delay)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.create_task(delayed(span + 1)) for _ in range(job_count)]
+    await asyncio.sleep(0)
+    memory = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        'jobs': job_count,
+        'memory_bytes': memory,
+        'memory_bytes_per_job': round(memory / job_count, 1),
+    }
+
+
+async def run(args):
+    """Run both benchmarks and collect the results."""
+    return {
+        'timer_heap': await bench_heap(args.jobs, args.span),
+        'sleeping_tasks': await bench_sleeping_tasks(args.jobs, args.span),
+    }
+
+
+def main():
+    """Parse arguments, run the benchmark and print JSON results."""
+    parser = argparse.ArgumentParser(description='TaskScheduler benchmark')
+    parser.add_argument('--jobs', type=int, default=100000, help='Number of jobs (default: 100000)')
+    parser.add_argument('--span', type=float, default=2.0,
+                        help='Seconds over which the jobs come due (default: 2.0)')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+"""
+A minimal in-process XMPP server with MUC support, for load testing the bot.
+
+It speaks just enough of the client protocol for slixmpp to log in over
+plain TCP (no TLS, SASL PLAIN accepted without checking the password),
+supports XEP-0198 stream resumption after a dropped connection, and
+implements MUC join/leave/groupchat semantics. Room occupants other than real
+client sessions are simulated: the load harness adds, removes and speaks as
+them through the server API, and the server delivers the resulting stanzas to
+the connected bot exactly as a real MUC service would.
+
+With client_kinds set, simulated occupants advertise XEP-0115 entity
+capabilities drawn from that many simulated client programs, and the server
+answers disco#info queries for them, counting each one in disco_queries.
+"""
+
+import asyncio
+import base64
+import hashlib
+import itertools
+import logging
+import xml.etree.ElementTree as ET
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+
+STREAM_NS = 'http://etherx.jabber.org/streams'
+CLIENT_NS = 'jabber:client'
+SASL_NS = 'urn:ietf:params:xml:ns:xmpp-sasl'
+BIND_NS = 'urn:ietf:params:xml:ns:xmpp-bind'
+ROSTER_NS = 'jabber:iq:roster'
+SM_NS = 'urn:xmpp:sm:3'
+MUC_NS = 'http://jabber.org/protocol/muc'
+MUC_USER_NS = 'http://jabber.org/protocol/muc#user'
+CAPS_NS = 'http://jabber.org/protocol/caps'
+DISCO_INFO_NS = 'http://jabber.org/protocol/disco#info'
+CAPS_NODE = 'https://example.com/simclient'
+
+
+def client_profile(index):
+    """Get a simulated client's name, features and caps verification string."""
+    name = f'SimClient {index}'
+    features = sorted({DISCO_INFO_NS, CAPS_NS, MUC_NS, f'urn:example:simclient:{index}'})
+    text = f'client/pc//{name}<' + ''.join(f'{feature}<' for feature in features)
+    ver = base64.b64encode(hashlib.sha1(text.encode('utf-8')).digest()).decode('ascii')
+    return name, features, ver
+
+
+def _bare(jid):
+    """Strip the resource from a JID string."""
+    return jid.split('/', 1)[0]
+
+
+def _split(jid):
+    """Split a JID string into (bare, resource)."""
+    bare, _, resource = jid.partition('/')
+    return bare, resource
+
+
+class Room:
+    """A simulated MUC room."""
+
+    def __init__(self, jid, subject=''):
+        self.jid = jid
+        self.subject = subject
+        # nick -> ClientSession for real clients, or the simulated real JID
+        self.occupants = {}
+        # Real client sessions present, kept apart so fan-out does not scan every occupant
+        self.clients = set()
+
+
+class ClientSession(asyncio.Protocol):
+    """One client connection to the fake server."""
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.jid = None
+        self.authenticated = False
+        self.nicks = {}  # room JID -> our nick there
+        self.sm_id = None
+        self.handled = 0
+        self.ended = False
+        self.ids = itertools.count()
+        self._reset_parser()
+
+    def _reset_parser(self):
+        """Start parsing a new stream, as after SASL success."""
+        self.parser = ET.XMLPullParser(('start', 'end'))
+        self.depth = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.sessions.add(self)
+
+    def connection_lost(self, exc):
+        self.server.sessions.discard(self)
+        if self.sm_id and not self.ended:
+            # Keep the rooms for a while so the client can resume
+            self.server.session_detached(self)
+        else:
+            self.server.session_closed(self)
+
+    def data_received(self, data):
+        self.parser.feed(data)
+        try:
+            for event, element in self.parser.read_events():
+                if event == 'start':
+                    self.depth += 1
+                    if self.depth == 1:
+                        self._stream_opened(element)
+                elif event == 'end':
+                    self.depth -= 1
+                    if self.depth == 1:
+                        self._handle(element)
+                    elif self.depth == 0:
+                        self.ended = True
+                        self.send('</stream:stream>')
+                        self.transport.close()
+                        return
+        except ET.ParseError:
+            logging.getLogger(__name__).exception("Malformed XML from client")
+            self.transport.close()
+
+    def send(self, data, stanza=False):
+        """Write raw XML to the client."""
+        if self.transport and not self.transport.is_closing():
+            if stanza:
+                self.server.stanzas_out += 1
+            self.transport.write(data.encode('utf-8'))
+
+    def _stream_opened(self, element):
+        """Answer a stream header with our own header and the stream features."""
+        self.send(
+            "<?xml version='1.0'?>"
+            f"<stream:stream xmlns='{CLIENT_NS}' xmlns:stream='{STREAM_NS}' "
+            f"from={quoteattr(self.server.domain)} id='s{next(self.ids)}' version='1.0'>"
+        )
+        if not self.authenticated:
+            features = (f"<mechanisms xmlns='{SASL_NS}'>"
+                        "<mechanism>PLAIN</mechanism></mechanisms>")
+        else:
+            features = f"<bind xmlns='{BIND_NS}'/><sm xmlns='{SM_NS}'/>"
+        self.send(f"<stream:features>{features}</stream:features>")
+
+    def _handle(self, element):
+        """Dispatch one top-level element."""
+        tag = element.tag
+        if tag == f'{{{SASL_NS}}}auth':
+            self.authenticated = True
+            self.send(f"<success xmlns='{SASL_NS}'/>")
+            self._reset_parser()
+        elif tag.startswith(f'{{{SM_NS}}}'):
+            self._handle_sm(tag[len(SM_NS) + 2:], element)
+        elif tag in (f'{{{CLIENT_NS}}}iq', f'{{{CLIENT_NS}}}presence', f'{{{CLIENT_NS}}}message'):
+            self.server.stanzas_in += 1
+            self.handled += 1
+            if tag.endswith('iq'):
+                self._handle_iq(element)
+            elif tag.endswith('presence'):
+                self.server.route_presence(self, element)
+            else:
+                self.server.route_message(self, element)
+
+    def _handle_sm(self, name, element):
+        """Handle stream management: enable, ack requests and resumption."""
+        if name == 'enable':
+            self.sm_id = f'sm{next(self.server.sm_ids)}'
+            self.handled = 0
+            self.send(f"<enabled xmlns='{SM_NS}' id='{self.sm_id}' resume='true'/>")
+        elif name == 'r':
+            self.send(f"<a xmlns='{SM_NS}' h='{self.handled}'/>")
+        elif name == 'resume':
+            previd = element.get('previd')
+            old = self.server.resume(self, previd)
+            if old is None:
+                self.send(f"<failed xmlns='{SM_NS}'>"
+                          "<item-not-found xmlns='urn:ietf:params:xml:ns:xmpp-stanzas'/></failed>")
+            else:
+                self.send(f"<resumed xmlns='{SM_NS}' previd={quoteattr(previd)} h='{self.handled}'/>")
+
+    def _handle_iq(self, element):
+        """Answer bind, roster and any other IQ addressed to the server."""
+        iq_id = quoteattr(element.get('id', ''))
+        iq_type = element.get('type')
+        bind = element.find(f'{{{BIND_NS}}}bind')
+        if bind is not None and iq_type == 'set':
+            resource = bind.findtext(f'{{{BIND_NS}}}resource') or f'r{next(self.ids)}'
+            self.jid = f'{self.server.user}@{self.server.domain}/{resource}'
+            self.server.session_bound(self)
+            self.send(f"<iq type='result' id={iq_id}><bind xmlns='{BIND_NS}'>"
+                      f"<jid>{escape(self.jid)}</jid></bind></iq>", stanza=True)
+        elif element.find(f'{{{ROSTER_NS}}}query') is not None:
+            self.send(f"<iq type='result' id={iq_id} to={quoteattr(self.jid or '')}>"
+                      f"<query xmlns='{ROSTER_NS}'/></iq>", stanza=True)
+        elif (element.find(f'{{{DISCO_INFO_NS}}}query') is not None and iq_type == 'get'
+              and self.server.client_kinds):
+            self._handle_disco_info(element, iq_id)
+        elif iq_type in ('get', 'set'):
+            # Pings, disco and everything else get an empty result
+            to = element.get('to') or self.server.domain
+            self.send(f"<iq type='result' id={iq_id} from={quoteattr(to)} "
+                      f"to={quoteattr(self.jid or '')}/>", stanza=True)
+
+
+    def _handle_disco_info(self, element, iq_id):
+        """Answer disco#info for an occupant with its simulated client's features."""
+        self.server.disco_queries += 1
+        to = element.get('to') or self.server.domain
+        node = element.find(f'{{{DISCO_INFO_NS}}}query').get('node')
+        node_attr = f' node={quoteattr(node)}' if node else ''
+        if '/' in to:
+            name, features, _ = client_profile(self.server.client_kind(_split(to)[1]))
+            payload = (f"<identity category='client' type='pc' name={quoteattr(name)}/>"
+                       + ''.join(f"<feature var={quoteattr(feature)}/>" for feature in features))
+        else:
+            payload = ''
+        self.send(f"<iq type='result' id={iq_id} from={quoteattr(to)} to={quoteattr(self.jid or '')}>"
+                  f"<query xmlns='{DISCO_INFO_NS}'{node_attr}>{payload}</query></iq>", stanza=True)
+
+
+class FakeXMPPServer:
+    """
+    The server: accepts client sessions and hosts simulated MUC rooms.
+
+    Callbacks set by the harness:
+      on_groupchat(room, nick, body) - a real client spoke in a room
+      on_private(frm, to, body)      - a real client sent a private message
+      on_join(room, nick)            - a real client finished joining a room
+    """
+
+    def __init__(self, domain='localhost', muc_domain='conference.localhost', user='bot'):
+        self.domain = domain
+        self.muc_domain = muc_domain
+        self.user = user
+        self.logger = logging.getLogger(__name__)
+        self.sessions = set()
+        self.rooms = {}
+        self.stanzas_in = 0
+        self.stanzas_out = 0
+        self.on_groupchat = None
+        self.on_private = None
+        self.on_join = None
+        self.client_kinds = 0
+        self.disco_queries = 0
+        self.resume_timeout = 60.0
+        self.sm_ids = itertools.count()
+        self.detached = {}  # SM id -> (session, cleanup timer)
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening; returns the bound port."""
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: ClientSession(self), host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Close all sessions and stop listening."""
+        for _, timer in self.detached.values():
+            timer.cancel()
+        self.detached.clear()
+        for session in list(self.sessions):
+            session.transport.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def session_bound(self, session):
+        """Hook called when a session has bound a resource."""
+        self.logger.debug("Session bound as %s", session.jid)
+
+    def drop(self):
+        """Cut every client connection without closing the streams, like a network blip."""
+        for session in list(self.sessions):
+            session.transport.abort()
+
+    def session_detached(self, session):
+        """Keep a dropped session's rooms until it resumes or times out; stanzas meanwhile are lost."""
+        timer = asyncio.get_running_loop().call_later(
+            self.resume_timeout, self._expire_detached, session.sm_id)
+        self.detached[session.sm_id] = (session, timer)
+
+    def _expire_detached(self, sm_id):
+        """Close a detached session that was not resumed in time."""
+        session, _ = self.detached.pop(sm_id, (None, None))
+        if session:
+            self.session_closed(session)
+
+    def resume(self, session, sm_id):
+        """Move a detached session's state to a new connection, or return None."""
+        old, timer = self.detached.pop(sm_id, (None, None))
+        if old is None:
+            return None
+        timer.cancel()
+        session.jid = old.jid
+        session.sm_id = old.sm_id
+        session.handled = old.handled
+        session.nicks = old.nicks
+        for room_jid, nick in session.nicks.items():
+            room = self.rooms[room_jid]
+            room.occupants[nick] = session
+            room.clients.discard(old)
+            room.clients.add(session)
+        return old
+
+    def session_closed(self, session):
+        """Remove a closed session from every room it was in."""
+        for room_jid, nick in session.nicks.items():
+            room = self.rooms[room_jid]
+            del room.occupants[nick]
+            room.clients.discard(session)
+            self._broadcast_presence(room, nick, None, unavailable=True)
+        session.nicks.clear()
+
+    # Room management
+
+    def room(self, room_jid, subject=''):
+        """Get or create a room."""
+        room = self.rooms.get(room_jid)
+        if room is None:
+            room = self.rooms[room_jid] = Room(room_jid, subject)
+        return room
+
+    def client_kind(self, nick):
+        """Get which simulated client program a nick uses."""
+        return zlib.crc32(nick.encode('utf-8')) % self.client_kinds
+
+    def _caps_xml(self, nick):
+        """Build the caps element a simulated occupant sends, if caps are enabled."""
+        if not self.client_kinds:
+            return ''
+        _, _, ver = client_profile(self.client_kind(nick))
+        return f"<c xmlns='{CAPS_NS}' hash='sha-1' node='{CAPS_NODE}' ver={quoteattr(ver)}/>"
+
+    def _presence_xml(self, room, nick, to, real_jid, unavailable=False, self_presence=False,
+                      caps=''):
+        """Build an occupant presence as sent by a MUC service."""
+        kind = " type='unavailable'" if unavailable else ''
+        role = 'none' if unavailable else 'participant'
+        jid_attr = f' jid={quoteattr(real_jid)}' if real_jid else ''
+        status = "<status code='110'/>" if self_presence else ''
+        return (f"<presence from={quoteattr(room.jid + '/' + nick)} to={quoteattr(to)}{kind}>"
+                f"<x xmlns='{MUC_USER_NS}'><item affiliation='none' role='{role}'{jid_attr}/>"
+                f"{status}</x>{caps}</presence>")
+
+    def _real_jid(self, occupant):
+        """Get the real JID of an occupant."""
+        return occupant.jid if isinstance(occupant, ClientSession) else occupant
+
+    def _broadcast_presence(self, room, nick, real_jid, unavailable=False, exclude=None, caps=''):
+        """Send an occupant's presence to every real session in the room."""
+        for session in room.clients:
+            if session is not exclude:
+                session.send(self._presence_xml(room, nick, session.jid, real_jid, unavailable,
+                                                caps=caps), stanza=True)
+
+    def _broadcast_message(self, room, nick, body):
+        """Send a groupchat message to every real session in the room."""
+        frm = quoteattr(room.jid + '/' + nick)
+        body = escape(body)
+        for session in room.clients:
+            session.send(f"<message type='groupchat' from={frm} to={quoteattr(session.jid)}>"
+                         f"<body>{body}</body></message>", stanza=True)
+
+    # Simulated occupants
+
+    def occupant_join(self, room_jid, nick, real_jid=None):
+        """Make a simulated user join a room."""
+        room = self.room(room_jid)
+        if nick in room.occupants:
+            return False
+        real_jid = real_jid or f'{nick.lower()}@{self.domain}/sim'
+        room.occupants[nick] = real_jid
+        self._broadcast_presence(room, nick, real_jid, caps=self._caps_xml(nick))
+        return True
+
+    def occupant_leave(self, room_jid, nick):
+        """Make a simulated user leave a room."""
+        room = self.rooms.get(room_jid)
+        if room is None or isinstance(room.occupants.get(nick, ''), ClientSession):
+            return False
+        if room.occupants.pop(nick, None) is None:
+            return False
+        self._broadcast_presence(room, nick, None, unavailable=True)
+        return True
+
+    def occupant_say(self, room_jid, nick, body):
+        """Make a simulated user speak in a room."""
+        room = self.rooms.get(room_jid)
+        if room is None or nick not in room.occupants:
+            return False
+        self._broadcast_message(room, nick, body)
+        return True
+
+    def config_changed(self, room_jid, code=104):
+        """Announce a room configuration change to the real sessions in it."""
+        room = self.rooms.get(room_jid)
+        if room is None:
+            return False
+        for session in room.clients:
+            session.send(f"<message type='groupchat' from={quoteattr(room.jid)} "
+                         f"to={quoteattr(session.jid)}><x xmlns='{MUC_USER_NS}'>"
+                         f"<status code='{code}'/></x></message>", stanza=True)
+        return True
+
+    # Routing of stanzas from real clients
+
+    def route_presence(self, session, element):
+        """Handle MUC joins and leaves; other presences are accepted silently."""
+        to = element.get('to')
+        if not to or _bare(to).split('@', 1)[-1] != self.muc_domain:
+            return
+        room_jid, nick = _split(to)
+        room = self.room(room_jid)
+
+        if element.get('type') == 'unavailable':
+            if room.occupants.get(nick) is session:
+                del room.occupants[nick]
+                session.nicks.pop(room.jid, None)
+                room.clients.discard(session)
+                session.send(self._presence_xml(room, nick, session.jid, session.jid,
+                                                unavailable=True, self_presence=True), stanza=True)
+                self._broadcast_presence(room, nick, session.jid, unavailable=True)
+            return
+
+        if room.occupants.get(nick) is session:
+            # Presence update of a joined occupant
+            self._broadcast_presence(room, nick, session.jid, exclude=session)
+            return
+
+        if nick in room.occupants:
+            session.send(f"<presence from={quoteattr(to)} to={quoteattr(session.jid)} type='error'>"
+                         f"<x xmlns='{MUC_NS}'/><error type='cancel'>"
+                         "<conflict xmlns='urn:ietf:params:xml:ns:xmpp-stanzas'/></error></presence>",
+                         stanza=True)
+            return
+
+        # Existing occupants, then our own presence, then the subject
+        for other, occupant in room.occupants.items():
+            caps = '' if isinstance(occupant, ClientSession) else self._caps_xml(other)
+            session.send(self._presence_xml(room, other, session.jid, self._real_jid(occupant),
+                                            caps=caps), stanza=True)
+        room.occupants[nick] = session
+        session.nicks[room.jid] = nick
+        room.clients.add(session)
+        session.send(self._presence_xml(room, nick, session.jid, session.jid, self_presence=True),
+                     stanza=True)
+        self._broadcast_presence(room, nick, session.jid, exclude=session)
+        session.send(f"<message type='groupchat' from={quoteattr(room.jid)} to={quoteattr(session.jid)}>"
+                     f"<subject>{escape(room.subject)}</subject></message>", stanza=True)
+        if self.on_join:
+            self.on_join(room.jid, nick)
+
+    def route_message(self, session, element):
+        """Relay groupchat messages and report private messages to the harness."""
+        to = element.get('to') or ''
+        body = element.findtext(f'{{{CLIENT_NS}}}body')
+        if body is None:
+            return
+        room = self.rooms.get(_bare(to))
+        if room is None:
+            if self.on_private:
+                self.on_private(session.jid, to, body)
+            return
+
+        nick = session.nicks.get(room.jid)
+        if nick is None:
+            return
+        if element.get('type') == 'groupchat':
+            self._broadcast_message(room, nick, body)
+            if self.on_groupchat:
+                self.on_groupchat(room.jid, nick, body)
+        elif self.on_private:
+            self.on_private(room.jid + '/' + nick, to, body)
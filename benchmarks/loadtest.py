@@ -0,0 +1,341 @@
+"""
+End-to-end load test of the real bot against the in-process fake XMPP server.
+
+Simulates N rooms with M occupants each, plus occupant churn, a command mix
+and timed probe commands, and reports stanza throughput, command round-trip
+latency, greeting fan-out time and process memory.
+
+Usage: python -m benchmarks.loadtest [--rooms 100] [--occupants 50] [--duration 30]
+                                     [--churn 20] [--command-rate 10] [--probe-rate 2]
+                                     [--client-kinds 20] [--caps-cache caps.json]
+                                     [--config config.ini] [-o results.json]
+
+The bot and the fake server share one process and one event loop, so the
+reported RSS covers both. The bot's own outbound and rate-limit settings
+apply unless overridden with the flags below.
+"""
+
+import argparse
+import asyncio
+import configparser
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+
+from jabberbot import JabberBot
+from benchmarks.fakeserver import FakeXMPPServer
+
+
+COMMAND_MIX = ('ping', 'time', 'users', 'status', 'rooms', 'help')
+
+
+def percentile(values, pct):
+    """Get the nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def current_rss():
+    """Get the resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_rss():
+    """Get the peak resident set size of this process in bytes."""
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, current_rss())
+
+
+def write_config(args, rooms):
+    """Write the bot configuration for the run to a temporary file."""
+    config = configparser.ConfigParser()
+    if args.config:
+        config.read(args.config)
+    overrides = {
+        'bot': {
+            'jid': 'bot@localhost',
+            'password': 'loadtest',
+            'nickname': 'LoadBot',
+            'auto_join_rooms': ','.join(rooms),
+        },
+        'messages': {
+            'greeting': 'Hello {nick}!',
+            'greeting_multiple': 'Hello {nicks}!',
+            'greeting_window': str(args.greeting_window),
+        },
+        'scheduler': {'hourly_announcements': 'false', 'jobstore': ''},
+        'metrics': {'enabled': 'false'},
+        'caps': {'cache_file': args.caps_cache or ''},
+    }
+    if args.global_rate:
+        overrides['outbound'] = {'global_rate': str(args.global_rate),
+                                 'global_burst': str(args.global_rate * 2)}
+    if args.room_rate:
+        overrides.setdefault('outbound', {}).update(
+            {'room_rate': str(args.room_rate), 'room_burst': str(args.room_rate * 5)})
+    if args.no_rate_limit:
+        overrides['ratelimit'] = {'user_limit': '1000000', 'room_limit': '1000000'}
+    for section, values in overrides.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, value)
+
+    fd, path = tempfile.mkstemp(prefix='loadtest-', suffix='.ini')
+    with os.fdopen(fd, 'w') as handle:
+        config.write(handle)
+    return path
+
+
+async def paced(rate, duration, action):
+    """Call action() rate times per second for duration seconds."""
+    if rate <= 0:
+        return 0
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    done = 0
+    while True:
+        elapsed = loop.time() - started
+        if elapsed >= duration:
+            return done
+        due = int(elapsed * rate)
+        while done < due:
+            action()
+            done += 1
+        await asyncio.sleep(0.01)
+
+
+async def run(args):
+    """Run one load test and return the results."""
+    server = FakeXMPPServer()
+    server.client_kinds = args.client_kinds
+    port = await server.start()
+
+    rooms = [f'load{i}@{server.muc_domain}' for i in range(args.rooms)]
+    for room_jid in rooms:
+        server.room(room_jid, subject='Load test room')
+        for j in range(args.occupants):
+            server.occupant_join(room_jid, f'u{j}')
+
+    config_path = write_config(args, rooms)
+    try:
+        bot = JabberBot(config_path)
+    finally:
+        os.unlink(config_path)
+    # Plain TCP without TLS; the fake server only offers SASL PLAIN
+    bot.enable_direct_tls = False
+    bot.enable_starttls = False
+    bot.enable_plaintext = True
+    bot.plugin['feature_mechanisms'].unencrypted_plain = True
+
+    loop = asyncio.get_running_loop()
+    joined = set()
+    all_joined = asyncio.Event()
+    probes = {}
+    rtts = []
+    greeted = {}
+    burst_at = None
+    replies = 0
+
+    def on_join(room, nick):
+        joined.add(room)
+        if len(joined) == len(rooms):
+            all_joined.set()
+
+    def on_groupchat(room, nick, body):
+        nonlocal replies
+        if body.startswith('Unknown command: probe'):
+            probe_id = body.split()[2].rstrip('.')[len('probe'):]
+            sent = probes.pop(probe_id, None)
+            if sent is not None:
+                rtts.append(loop.time() - sent)
+        elif body.startswith('Hello '):
+            if burst_at is not None and room not in greeted:
+                greeted[room] = loop.time() - burst_at
+        else:
+            replies += 1
+
+    server.on_join = on_join
+    server.on_groupchat = on_groupchat
+
+    rss_before = current_rss()
+    connect_started = loop.time()
+    bot.connect('127.0.0.1', port)
+    await asyncio.wait_for(all_joined.wait(), timeout=args.join_timeout)
+    join_seconds = loop.time() - connect_started
+    # Let the tail of the join (subjects, scheduler start) settle
+    await asyncio.sleep(1.0)
+
+    # Simulated users, per room, that are currently present
+    present = {room: [f'u{j}' for j in range(args.occupants)] for room in rooms}
+    nick_ids = itertools.count()
+    probe_ids = itertools.count()
+    commands_sent = 0
+
+    def churn():
+        room = random.choice(rooms)
+        nicks = present[room]
+        if nicks and random.random() < 0.5:
+            nick = nicks.pop(random.randrange(len(nicks)))
+            server.occupant_leave(room, nick)
+        else:
+            nick = f'c{next(nick_ids)}'
+            nicks.append(nick)
+            server.occupant_join(room, nick)
+
+    def speaker(room):
+        nicks = present[room]
+        return random.choice(nicks) if nicks else None
+
+    def command():
+        nonlocal commands_sent
+        room = random.choice(rooms)
+        nick = speaker(room)
+        if nick:
+            server.occupant_say(room, nick, '!' + random.choice(COMMAND_MIX))
+            commands_sent += 1
+
+    def probe():
+        room = random.choice(rooms)
+        nick = speaker(room)
+        if nick:
+            probe_id = str(next(probe_ids))
+            probes[probe_id] = loop.time()
+            server.occupant_say(room, nick, f'!probe{probe_id}')
+
+    in_before, out_before = server.stanzas_in, server.stanzas_out
+    started = loop.time()
+
+    # A burst of joins in every room measures greeting fan-out
+    burst_at = loop.time()
+    for room in rooms:
+        for k in range(args.burst):
+            nick = f'g{k}'
+            present[room].append(nick)
+            server.occupant_join(room, nick)
+
+    await asyncio.gather(
+        paced(args.churn, args.duration, churn),
+        paced(args.command_rate, args.duration, command),
+        paced(args.probe_rate, args.duration, probe),
+    )
+    probes_sent = next(probe_ids)
+
+    # Give outstanding probes a chance to come back
+    drain_until = loop.time() + args.drain
+    while probes and loop.time() < drain_until:
+        await asyncio.sleep(0.05)
+    elapsed = loop.time() - started
+
+    stanzas_to_bot = server.stanzas_out - out_before
+    stanzas_from_bot = server.stanzas_in - in_before
+    simulated = sum(len(room.occupants) - len(room.clients) for room in server.rooms.values())
+    greet_times = list(greeted.values())
+
+    results = {
+        'rooms': args.rooms,
+        'occupants_per_room': args.occupants,
+        'duration': round(elapsed, 2),
+        'join': {
+            'seconds': round(join_seconds, 3),
+            'rooms_per_sec': round(len(rooms) / join_seconds, 1),
+        },
+        'stanzas': {
+            'to_bot': stanzas_to_bot,
+            'from_bot': stanzas_from_bot,
+            'to_bot_per_sec': round(stanzas_to_bot / elapsed, 1),
+            'from_bot_per_sec': round(stanzas_from_bot / elapsed, 1),
+        },
+        'commands': {
+            'sent': commands_sent,
+            'replies': replies,
+            'probes_sent': probes_sent,
+            'probes_answered': len(rtts),
+            'rtt_p50_ms': round(percentile(rtts, 50) * 1000, 2),
+            'rtt_p99_ms': round(percentile(rtts, 99) * 1000, 2),
+            'rtt_max_ms': round(max(rtts, default=0.0) * 1000, 2),
+        },
+        'greetings': {
+            'burst_per_room': args.burst,
+            'window': args.greeting_window,
+            'rooms_greeted': len(greeted),
+            'fanout_p50_ms': round(percentile(greet_times, 50) * 1000, 1),
+            'fanout_p99_ms': round(percentile(greet_times, 99) * 1000, 1),
+            'fanout_last_ms': round(max(greet_times, default=0.0) * 1000, 1),
+        },
+        'occupants': {
+            'simulated': simulated,
+            'tracked_by_bot': bot.occupants.count(),
+        },
+        'caps': {
+            'client_kinds': args.client_kinds,
+            'disco_queries': server.disco_queries,
+            'cached': len(bot.caps.store),
+        },
+        'outbound': dict(bot.outbound.counters),
+        'memory': {
+            'rss_before_connect_mb': round(rss_before / 2**20, 1),
+            'rss_mb': round(current_rss() / 2**20, 1),
+            'peak_rss_mb': round(peak_rss() / 2**20, 1),
+        },
+    }
+
+    await bot.scheduler.stop()
+    await bot.dispatcher.stop()
+    await bot.outbound.stop()
+    await bot.archive.stop()
+    bot.close()
+    await asyncio.sleep(0.1)
+    await server.stop()
+    return results
+
+
+def main():
+    """Parse arguments and run the load test."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--occupants', type=int, default=50, help='Simulated occupants per room')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of traffic')
+    parser.add_argument('--churn', type=float, default=20.0, help='Joins/leaves per second')
+    parser.add_argument('--command-rate', type=float, default=10.0, help='Commands per second')
+    parser.add_argument('--probe-rate', type=float, default=2.0,
+                        help='Timed probe commands per second')
+    parser.add_argument('--burst', type=int, default=5,
+                        help='Users joining every room at once at the start')
+    parser.add_argument('--greeting-window', type=float, default=0.5)
+    parser.add_argument('--global-rate', type=float, help='Override [outbound] global_rate')
+    parser.add_argument('--room-rate', type=float, help='Override [outbound] room_rate')
+    parser.add_argument('--no-rate-limit', action='store_true',
+                        help='Lift the per-user and per-room command limits')
+    parser.add_argument('--client-kinds', type=int, default=0,
+                        help='Simulated client programs advertising entity capabilities')
+    parser.add_argument('--caps-cache', help='Capabilities cache file, kept between runs')
+    parser.add_argument('--join-timeout', type=float, default=120.0)
+    parser.add_argument('--drain', type=float, default=10.0,
+                        help='Seconds to wait for outstanding probes')
+    parser.add_argument('--config', help='Base bot configuration to start from')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""
+Micro-benchmarks for the bot's hot functions, driven by fake stanzas.
+
+Covers command parsing and dispatch, MUC join/leave bookkeeping,
+create_room_report and get_user_rooms at 10k+ occupants, and the hourly
+announcement fan-out across 1k rooms, and auto-responder matching against
+a room with thousands of triggers. Results are written as JSON with
+sorted keys so runs from different commits can be diffed, or compared
+directly with --compare.
+
+Usage: python -m benchmarks.microbench [--occupants 20000] [--rooms 1000]
+                                       [--triggers 2000] [--repeat 5] [-o micro.json]
+                                       [--compare previous.json]
+"""
+
+import argparse
+import asyncio
+import configparser
+import json
+import logging
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import tempfile
+import time
+
+from slixmpp import JID
+
+from autoresponder import RoomMatcher
+from jabberbot import JabberBot
+from outbound import OutboundQueue
+
+
+MUC_DOMAIN = 'conference.example.com'
+
+
+class FakeMessage(dict):
+    """A message stanza stand-in supporting item access and reply()."""
+
+    def reply(self, body):
+        """Build the reply the bot would send."""
+        to = JID(self['from'].bare) if self['type'] == 'groupchat' else self['from']
+        return FakeMessage(to=to, body=body, type=self['type'])
+
+
+class FakePresence(dict):
+    """A MUC presence stand-in with a muc#user item."""
+
+
+def groupchat(room, nick, body):
+    """Build a fake groupchat message from an occupant."""
+    return FakeMessage({'from': JID(f'{room}/{nick}'), 'mucnick': nick,
+                        'body': body, 'type': 'groupchat'})
+
+
+def occupant_presence(room, nick, unavailable=False):
+    """Build a fake occupant presence."""
+    return FakePresence({
+        'from': JID(f'{room}/{nick}'),
+        'type': 'unavailable' if unavailable else '',
+        'muc': {'jid': JID(f'{nick}@example.com/client'), 'role': 'participant',
+                'affiliation': 'none'},
+    })
+
+
+def room_name(index):
+    """Get the JID of the index-th benchmark room."""
+    return f'room{index}@{MUC_DOMAIN}'
+
+
+def make_bot():
+    """Create a bot that is configured but never connects."""
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'bot': {'jid': 'bench@example.com', 'nickname': 'BenchBot'},
+        'scheduler': {'hourly_announcements': 'false', 'jobstore': ''},
+        'ratelimit': {'user_limit': '1000000000', 'room_limit': '1000000000'},
+        'outbound': {'max_pending_per_room': '1000000000'},
+    })
+    fd, path = tempfile.mkstemp(prefix='microbench-', suffix='.ini')
+    with os.fdopen(fd, 'w') as handle:
+        config.write(handle)
+    try:
+        return JabberBot(path)
+    finally:
+        os.unlink(path)
+
+
+def populate(bot, rooms, occupants):
+    """Fill the occupant store with occupants spread evenly over rooms."""
+    bot.occupants.clear()
+    for i in range(occupants):
+        room = room_name(i % rooms)
+        nick = f'user{i // rooms}'
+        bot.occupants.add(room, nick, f'{nick}@example.com', 'participant', 'none')
+
+
+def reset_outbound(bot):
+    """Replace the outbound queue so queued stanzas from earlier runs are freed."""
+    bot.outbound = OutboundQueue(bot)
+
+
+def make_triggers(count, regex_count=50):
+    """Build count literal keyword triggers plus some regex triggers."""
+    rng = random.Random(42)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    triggers = []
+    for i in range(count):
+        word = ''.join(rng.choice(letters) for _ in range(rng.randint(5, 10)))
+        triggers.append({'pattern': f'{word}{i}', 'regex': False, 'case': False, 'word': True,
+                         'reply': 'Matched {match}', 'react': None})
+    for i in range(regex_count):
+        triggers.append({'pattern': rf'\bticket{i}-\d+\b', 'regex': True, 'case': False,
+                         'word': True, 'reply': 'See {match}', 'react': None})
+    return triggers
+
+
+def chat_lines(triggers, count, hit_ratio=0.05):
+    """Build typical chat lines of about 100 characters, a few containing a trigger."""
+    rng = random.Random(7)
+    words = ['the', 'deploy', 'is', 'done', 'can', 'someone', 'check', 'logs', 'for',
+             'server', 'please', 'thanks', 'error', 'again', 'later', 'meeting', 'today']
+    lines = []
+    for _ in range(count):
+        line = ' '.join(rng.choice(words) for _ in range(18))
+        if rng.random() < hit_ratio:
+            line += ' ' + rng.choice(triggers)['pattern'].replace('\\b', '').replace('\\d+', '7')
+        lines.append(line)
+    return lines
+
+
+def naive_match(triggers, text):
+    """Check every trigger in turn, the way a plain loop would."""
+    lowered = text.lower()
+    for trigger in triggers:
+        if trigger['regex']:
+            if re.search(trigger['pattern'], text, re.IGNORECASE):
+                return trigger
+        elif re.search(rf'\b{re.escape(trigger["pattern"])}\b', lowered):
+            return trigger
+    return None
+
+
+async def measure(func, ops, repeat, setup=None, is_async=False):
+    """Time func() over ops calls, repeat times; func gets the call index."""
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        if is_async:
+            for i in range(ops):
+                await func(i)
+        else:
+            for i in range(ops):
+                func(i)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    return {
+        'ops': ops,
+        'best_us_per_op': round(best / ops * 1e6, 3),
+        'median_us_per_op': round(statistics.median(timings) / ops * 1e6, 3),
+        'ops_per_sec': round(ops / best, 1),
+    }
+
+
+async def run(args):
+    """Run every benchmark and return the results keyed by name."""
+    bot = make_bot()
+    # Greeting timers would fire during later benchmarks; keep them out of the way
+    bot.greeter.window = 3600
+    handler = bot.command_handler
+    results = {}
+    rooms = args.rooms
+    occupants = args.occupants
+
+    # Command parsing alone
+    bodies = ['!ping', '!users room1@x', '!  status  ', 'hello there', '!HELP me please']
+    results['parse_command'] = await measure(
+        lambda i: handler.parse_command(bodies[i % len(bodies)]), 100000, args.repeat)
+
+    # Full handle_command: rate limiting, cache lookup, command and reply queueing
+    populate(bot, min(rooms, 100), 10000)
+    # !status walks the occupant store for its memory estimate, so it gets fewer calls
+    for name, body, ops in (('ping', '!ping', 10000), ('users_cached', '!users', 10000),
+                            ('status', '!status', 200), ('unknown', '!nosuchcommand', 10000)):
+        messages = [groupchat(room_name(i % 100), f'user{i}', body) for i in range(1000)]
+        if name == 'status':
+            # Defeat the response cache so the command itself runs each time
+            async def call(i, messages=messages):
+                handler.invalidate_room_users(messages[i % 1000]['from'].bare)
+                await handler.handle_command(messages[i % 1000])
+        else:
+            async def call(i, messages=messages):
+                await handler.handle_command(messages[i % 1000])
+        results[f'handle_command_{name}'] = await measure(
+            call, ops, args.repeat, setup=lambda: reset_outbound(bot), is_async=True)
+
+    # MUC join and leave bookkeeping at 10k+ occupants
+    joins = [occupant_presence(room_name(i % rooms), f'user{i // rooms}')
+             for i in range(occupants)]
+    leaves = [occupant_presence(room_name(i % rooms), f'user{i // rooms}', unavailable=True)
+              for i in range(occupants)]
+
+    def clear_rooms():
+        bot.occupants.clear()
+        for room in list(bot.greeter.timers):
+            bot.greeter.room_left(room)
+
+    async def join(i):
+        await bot._muc_user_joined(joins[i])
+
+    async def leave(i):
+        await bot._muc_user_left(leaves[i])
+
+    results['muc_user_joined'] = await measure(
+        join, occupants, args.repeat, setup=clear_rooms, is_async=True)
+
+    def refill():
+        clear_rooms()
+        populate(bot, rooms, occupants)
+
+    results['muc_user_left'] = await measure(
+        leave, occupants, args.repeat, setup=refill, is_async=True)
+
+    # Reports and lookups over a populated store
+    populate(bot, rooms, occupants)
+    manager = bot.conference_manager
+    results['create_room_report'] = await measure(
+        lambda i: manager.create_room_report(), 10, args.repeat)
+    results['get_user_rooms'] = await measure(
+        lambda i: manager.get_user_rooms(f'user{i % (occupants // rooms)}'), 10000, args.repeat)
+
+    # Hourly announcement fan-out across all rooms
+    results['hourly_announcement_fanout'] = await measure(
+        lambda i: bot.scheduler._send_hourly_announcement(), 1, max(args.repeat, 10),
+        setup=lambda: reset_outbound(bot))
+    results['hourly_announcement_fanout']['rooms'] = bot.occupants.room_count()
+
+    # Auto-responder matching of one message against all of a room's triggers
+    triggers = make_triggers(args.triggers)
+    lines = chat_lines(triggers, 1000)
+    matcher = RoomMatcher(triggers)
+    results['autoresponder_match'] = await measure(
+        lambda i: matcher.match(lines[i % 1000]), 10000, args.repeat)
+    results['autoresponder_match']['triggers'] = len(triggers)
+    results['autoresponder_naive_scan'] = await measure(
+        lambda i: naive_match(triggers, lines[i % 1000]), 100, args.repeat)
+    results['autoresponder_rebuild'] = await measure(
+        lambda i: RoomMatcher(triggers), 5, args.repeat)
+
+    clear_rooms()
+    return results
+
+
+def git_revision():
+    """Get the current commit, if the tree is a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Print the change in best time per op for each benchmark."""
+    print(f"Comparing {current['commit']} against {previous['commit']}")
+    if previous['params'] != current['params']:
+        print(f"Warning: parameters differ: {previous['params']} vs {current['params']}")
+    for name, result in sorted(current['benchmarks'].items()):
+        old = previous['benchmarks'].get(name)
+        if not old:
+            print(f"{name:32} {result['best_us_per_op']:>12.3f} us/op  (new)")
+            continue
+        ratio = result['best_us_per_op'] / old['best_us_per_op'] if old['best_us_per_op'] else 0
+        print(f"{name:32} {old['best_us_per_op']:>12.3f} -> {result['best_us_per_op']:>12.3f} "
+              f"us/op  ({(ratio - 1) * 100:+.1f}%)")
+
+
+def main():
+    """Parse arguments and run the suite."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--occupants', type=int, default=20000)
+    parser.add_argument('--rooms', type=int, default=1000)
+    parser.add_argument('--triggers', type=int, default=2000, help='Auto-responder triggers per room')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    # Command and presence handlers log at INFO; keep that out of the timings
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {
+        'commit': git_revision(),
+        'python': platform.python_version(),
+        'params': {'occupants': args.occupants, 'rooms': args.rooms, 'triggers': args.triggers,
+                   'repeat': args.repeat},
+        'benchmarks': asyncio.run(run(args)),
+    }
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(json.load(handle), results)
+    else:
+        print(text)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Persistent XEP-0115 entity capabilities cache.
+"""
+
+import json
+import logging
+import os
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+from slixmpp import JID
+from slixmpp.exceptions import IqError, IqTimeout
+from slixmpp.plugins.xep_0030.stanza import DiscoInfo
+from slixmpp.util.cache import Cache
+
+
+class CapsStore(Cache):
+    """
+    disco#info results keyed by caps verification string, with LRU eviction.
+
+    A verification string is a hash of the disco#info it describes, so an
+    entry never goes stale and can be kept across restarts. Entries are held
+    in memory, least recently used first, and saved to a JSON file by save().
+    """
+
+    def __init__(self, path, max_entries, on_lookup=None):
+        """Initialize the store and load saved entries from path, if any."""
+        self.path = path
+        self.max_entries = max_entries
+        self.on_lookup = on_lookup
+        self.logger = logging.getLogger(__name__)
+        self.entries = OrderedDict()  # verification string -> DiscoInfo
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        """Load saved entries, oldest first."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as handle:
+                saved = json.load(handle)
+            for ver, xml in saved.items():
+                self.entries[ver] = DiscoInfo(xml=ET.fromstring(xml))
+        except (OSError, ValueError, ET.ParseError) as e:
+            self.logger.error(f"Could not load capabilities cache from {self.path}: {e}")
+            return
+        self._evict()
+        self.logger.info("Loaded %d cached capabilities from %s", len(self.entries), self.path)
+
+    def _evict(self):
+        """Drop least recently used entries beyond max_entries."""
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self._dirty = True
+
+    def retrieve(self, key):
+        """Get the disco#info for a verification string, or None."""
+        info = self.entries.get(key)
+        if info is not None:
+            # Recency alone does not mark the cache dirty; it is saved with the next change
+            self.entries.move_to_end(key)
+        if self.on_lookup:
+            self.on_lookup(info is not None)
+        return info
+
+    def store(self, key, value):
+        """Cache the disco#info for a verification string."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self._dirty = True
+        self._evict()
+        return True
+
+    def remove(self, key):
+        """Drop a verification string from the cache."""
+        if self.entries.pop(key, None) is not None:
+            self._dirty = True
+        return True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def save(self):
+        """Write the cache to the file if it changed."""
+        if not self.path or not self._dirty:
+            return
+        data = OrderedDict((ver, str(info)) for ver, info in self.entries.items())
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as handle:
+                json.dump(data, handle)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            self.logger.error(f"Could not save capabilities cache to {self.path}: {e}")
+
+
+class EntityCaps:
+    """
+    XEP-0115 entity capabilities backed by a persistent CapsStore.
+
+    Occupants advertise a verification string in their presence. The first
+    time a string is seen its disco#info is fetched once and cached; every
+    later occupant with the same client, including after a restart, is
+    resolved from the cache without sending a stanza. The JID to
+    verification string map only covers occupants currently present.
+    """
+
+    def __init__(self, bot):
+        """Initialize capabilities handling with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        config = self.bot.config
+        self.enabled = config.getboolean('caps', 'enabled', fallback=True)
+        self.path = config.get('caps', 'cache_file', fallback='caps_cache.json')
+        self.max_entries = config.getint('caps', 'max_entries', fallback=5000)
+        self.flush_interval = config.getfloat('caps', 'flush_interval', fallback=300.0)
+
+        self.jid_vers = {}  # full JID -> verification string
+        self.flush_job = None
+        self.store = CapsStore(self.path, self.max_entries, self._count_lookup)
+
+        if self.enabled:
+            # The plugin may already be loaded as a dependency of another plugin
+            self.bot.register_plugin('xep_0115')
+            plugin = self.bot.plugin['xep_0115']
+            plugin.cache = self.store
+            api = plugin.api
+            api.register(self._assign_verstring, 'assign_verstring')
+            api.register(self._get_verstring, 'get_verstring')
+            self.bot.add_event_handler('session_end', self._session_end)
+
+    def _count_lookup(self, hit):
+        """Record a verification string lookup in the metrics."""
+        self.bot.metrics.caps_lookups.inc('hit' if hit else 'miss')
+
+    def _assign_verstring(self, jid, node, ifrom, data):
+        """API handler storing the verification string of a JID."""
+        self.jid_vers[jid.full] = data.get('verstring')
+
+    def _get_verstring(self, jid, node, ifrom, data):
+        """API handler returning the verification string of a JID."""
+        return self.jid_vers.get(jid.full)
+
+    def _session_end(self, event):
+        """Forget other entities' strings; they are re-announced on the next session."""
+        own = self.bot.boundjid.bare
+        self.jid_vers = {jid: ver for jid, ver in self.jid_vers.items()
+                         if JID(jid).bare == own}
+
+    def start(self):
+        """Schedule periodic saving of the cache."""
+        if self.enabled and self.path and self.flush_job is None:
+            self.flush_job = self.bot.scheduler.schedule_interval(
+                self.flush, self.flush_interval, name='caps_flush'
+            )
+
+    def forget(self, jid):
+        """Drop the verification string of an entity that went offline."""
+        self.jid_vers.pop(str(jid), None)
+
+    async def get_info(self, jid):
+        """
+        Get the disco#info of an entity, from its caps if possible.
+
+        Returns None if the entity cannot be queried.
+        """
+        if self.enabled:
+            info = await self.bot.plugin['xep_0115'].get_caps(jid)
+            if info is not None:
+                return info
+        self.bot.metrics.caps_lookups.inc('query')
+        try:
+            iq = await self.bot.plugin['xep_0030'].get_info(jid=jid, cached=True)
+        except (IqError, IqTimeout) as e:
+            self.logger.debug(f"disco#info query to {jid} failed: {e}")
+            return None
+        return iq['disco_info']
+
+    async def supports(self, jid, feature):
+        """Check whether an entity supports a feature."""
+        info = await self.get_info(jid)
+        return info is not None and feature in info['features']
+
+    def flush(self):
+        """Save the cache to its file if it changed."""
+        self.store.save()
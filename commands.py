@@ -3,10 +3,158 @@ Command handling module for the Jabber bot.
 """
 
 import logging
+import math
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
 import platform
 import sys
 
+from ratelimit import SlidingWindowLimiter
+
+
+# Default cache lifetimes in seconds; None caches until invalidated
+DEFAULT_CACHE_TTLS = {
+    'help': None,
+    'about': None,
+    'status': 30.0,
+    'rooms': 300.0,
+    'users': 300.0,
+}
+
+
+def split_message(text, max_bytes):
+    """
+    Split text into parts of at most max_bytes of UTF-8.
+
+    Parts break between lines where possible; a single line that is too
+    long is cut at a character boundary.
+    """
+    if len(text.encode('utf-8')) <= max_bytes:
+        return [text]
+    parts = []
+    current = []
+    size = 0
+    for line in text.split('\n'):
+        encoded = line.encode('utf-8')
+        if len(encoded) > max_bytes:
+            if current:
+                parts.append('\n'.join(current))
+                current, size = [], 0
+            while len(encoded) > max_bytes:
+                # Back up to the start of a UTF-8 sequence
+                cut = max_bytes
+                while cut > 1 and (encoded[cut] & 0xC0) == 0x80:
+                    cut -= 1
+                parts.append(encoded[:cut].decode('utf-8'))
+                encoded = encoded[cut:]
+            if not encoded:
+                continue
+        line = encoded.decode('utf-8')
+        added = len(encoded) + (1 if current else 0)
+        if current and size + added > max_bytes:
+            parts.append('\n'.join(current))
+            current, size, added = [], 0, len(encoded)
+        current.append(line)
+        size += added
+    if current:
+        parts.append('\n'.join(current))
+    return parts
+
+
+def parse_listing_args(args):
+    """
+    Split listing arguments into (positional args, prefix, page).
+
+    'page N' selects a page and a word ending in '*' is a prefix filter.
+    """
+    positional = []
+    prefix = None
+    page = 1
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg.lower() == 'page' and index + 1 < len(args) and args[index + 1].isdigit():
+            page = max(1, int(args[index + 1]))
+            index += 2
+            continue
+        if arg.endswith('*') and len(arg) > 1:
+            prefix = arg.rstrip('*')
+        else:
+            positional.append(arg)
+        index += 1
+    return positional, prefix, page
+
+
+class ResponseCache:
+    """
+    Caches command responses per command and scope with per-command TTLs.
+    
+    At most max_entries responses are kept. When the cache is full, expired
+    entries are swept first, then the least recently used ones are dropped.
+    """
+    
+    def __init__(self, ttls, max_entries=1000):
+        """Initialize the cache with a dict of command -> TTL."""
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (command, scope) -> (expires, response), least recently used first
+        self.scopes = {}  # command -> scopes cached for it
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, command, scope, now=None):
+        """Get a cached response, or None if missing or expired."""
+        key = (command, scope)
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, response = entry
+            if expires is None or expires > (now if now is not None else time.monotonic()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return response
+            self._drop(key)
+        self.misses += 1
+        return None
+    
+    def put(self, command, scope, response, now=None):
+        """Store a response if the command is cacheable."""
+        if command not in self.ttls:
+            return
+        ttl = self.ttls[command]
+        if ttl is not None and ttl <= 0:
+            return
+        now = now if now is not None else time.monotonic()
+        key = (command, scope)
+        self.entries[key] = (None if ttl is None else now + ttl, response)
+        self.entries.move_to_end(key)
+        self.scopes.setdefault(command, set()).add(scope)
+        if len(self.entries) > self.max_entries:
+            self._evict(now)
+    
+    def _drop(self, key):
+        """Remove one entry."""
+        self.entries.pop(key, None)
+        scopes = self.scopes.get(key[0])
+        if scopes is not None:
+            scopes.discard(key[1])
+    
+    def _evict(self, now):
+        """Sweep expired entries, then drop the least recently used beyond max_entries."""
+        for key, (expires, _) in list(self.entries.items()):
+            if expires is not None and expires <= now:
+                self._drop(key)
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+    
+    def invalidate(self, command, scope=None):
+        """Drop cached responses for a command, or for one scope of it."""
+        if scope is None:
+            for scope in self.scopes.pop(command, ()):
+                self.entries.pop((command, scope), None)
+        else:
+            self._drop((command, scope))
+
 
 class CommandHandler:
     """Handles bot commands and responses."""
@@ -25,38 +173,194 @@ class CommandHandler:
             'rooms': self._cmd_rooms,
             'users': self._cmd_users,
             'about': self._cmd_about,
+            'search': self._cmd_search,
+            'seen': self._cmd_seen,
+            'report': self._cmd_report,
+            'more': self._cmd_more,
+            'debug': self._cmd_debug,
         }
+        
+        # Flood protection
+        config = self.bot.config
+        self.user_window = config.getfloat('ratelimit', 'user_window', fallback=10.0)
+        max_keys = config.getint('ratelimit', 'max_tracked', fallback=100000)
+        self.user_limiter = SlidingWindowLimiter(
+            config.getint('ratelimit', 'user_limit', fallback=5), self.user_window, max_keys
+        )
+        self.room_limiter = SlidingWindowLimiter(
+            config.getint('ratelimit', 'room_limit', fallback=20),
+            config.getfloat('ratelimit', 'room_window', fallback=10.0),
+            max_keys
+        )
+        self.command_limiters = {}
+        self.notify_limited = config.getboolean('ratelimit', 'notify', fallback=True)
+        self.slow_down_message = config.get(
+            'ratelimit', 'message', fallback="Slow down please, you are sending commands too fast."
+        )
+        
+        # Cached responses for static and slow-changing commands
+        ttls = {}
+        for command, ttl in DEFAULT_CACHE_TTLS.items():
+            value = config.get('cache', f'{command}_ttl', fallback='')
+            ttls[command] = float(value) if value else ttl
+        self.response_cache = ResponseCache(ttls, config.getint('cache', 'max_entries', fallback=1000))
+        # The occupant index size walks every occupant, so !status reuses it for a while
+        self.memory_interval = config.getfloat('cache', 'memory_interval', fallback=300.0)
+        self._index_bytes = None
+        self._index_measured = 0.0
+        
+        # Listings and long replies
+        self.page_size = config.getint('commands', 'page_size', fallback=50)
+        # At least 200 bytes, so a split groupchat reply keeps room for the !more note
+        self.max_message_size = max(200, config.getint('commands', 'max_message_size', fallback=4000))
+        self.groupchat_max_parts = config.getint('commands', 'groupchat_max_parts', fallback=2)
+        self.continuation_ttl = config.getfloat('commands', 'continuation_ttl', fallback=600.0)
+        self.max_continuations = config.getint('commands', 'max_continuations', fallback=1000)
+        self.continuations = OrderedDict()  # occupant JID -> (expires, deque of parts)
+    
+    def parse_command(self, body):
+        """Split a message body into a command name and arguments."""
+        body = body.strip()
+        if not body.startswith('!'):
+            return None, []
+        
+        parts = body[1:].split()
+        if not parts:
+            return None, []
+        
+        return parts[0].lower(), parts[1:]
     
     async def handle_command(self, msg):
         """Handle incoming command messages."""
         try:
             # Parse command and arguments
-            body = msg['body'].strip()
-            if not body.startswith('!'):
+            command, args = self.parse_command(msg['body'])
+            if command is None:
                 return
             
-            parts = body[1:].split()
-            if not parts:
+            if not self._check_rate_limit(msg, command):
                 return
-                
-            command = parts[0].lower()
-            args = parts[1:] if len(parts) > 1 else []
             
-            self.logger.info(f"Processing command: {command} with args: {args}")
+            self.logger.info("Processing command: %s with args: %s", command, args)
             
             # Execute command if it exists
             if command in self.commands:
-                response = await self.commands[command](msg, args)
+                with self.bot.metrics.command_latency.time(command):
+                    scope = self._cache_scope(command, msg, args)
+                    response = None if scope is None else self.response_cache.get(command, scope)
+                    if response is None:
+                        response = await self.commands[command](msg, args)
+                        if response and scope is not None:
+                            self.response_cache.put(command, scope, response)
                 if response:
-                    msg.reply(response).send()
+                    self.send_response(msg, response)
             else:
                 response = f"Unknown command: {command}. Type !help for available commands."
-                msg.reply(response).send()
+                self.bot.outbound.enqueue_stanza(msg.reply(response))
                 
         except Exception as e:
             self.logger.error(f"Error handling command: {e}", exc_info=True)
             error_msg = "Sorry, there was an error processing your command."
-            msg.reply(error_msg).send()
+            self.bot.outbound.enqueue_stanza(msg.reply(error_msg))
+    
+    def _cache_scope(self, command, msg, args):
+        """Get the part of a request that a cached response depends on, or None to not cache it."""
+        if command in ('help', 'about', 'status'):
+            # These ignore their arguments, so each has a single entry
+            return ''
+        if command not in ('rooms', 'users') or msg['type'] != 'groupchat':
+            return None
+        # Only first pages are cached, so a room's entry can be dropped by its name
+        positional, prefix, page = parse_listing_args(args)
+        if prefix or page != 1:
+            return None
+        if command == 'rooms':
+            return ''
+        room = positional[0] if positional else msg['from'].bare
+        # Made-up room names would otherwise each get an entry
+        return room if self.bot.occupants.has_room(room) else None
+    
+    def send_response(self, msg, response):
+        """
+        Reply to a command, split into messages under max_message_size.
+        
+        In a group chat at most groupchat_max_parts messages go to the room;
+        the rest is kept for the sender to fetch with !more in private.
+        """
+        parts = split_message(response, self.max_message_size)
+        if msg['type'] == 'groupchat' and len(parts) > self.groupchat_max_parts:
+            # Leave room for the note pointing at !more
+            parts = split_message(response, self.max_message_size - 100)
+            shown = max(1, self.groupchat_max_parts)
+            rest = parts[shown:]
+            parts = parts[:shown]
+            self._offer_continuation(msg['from'].full, rest)
+            parts[-1] += (f"\n… {len(rest)} more message{'s' if len(rest) > 1 else ''}: "
+                          f"send me !more in private to read on")
+        for part in parts:
+            self.bot.outbound.enqueue_stanza(msg.reply(part))
+    
+    def _offer_continuation(self, jid, parts):
+        """Keep the rest of a long reply for an occupant."""
+        self.continuations.pop(jid, None)
+        self.continuations[jid] = (time.monotonic() + self.continuation_ttl, deque(parts))
+        while len(self.continuations) > self.max_continuations:
+            self.continuations.popitem(last=False)
+    
+    def invalidate_room_users(self, room_jid):
+        """Drop cached responses that depend on the occupants of a room."""
+        self.response_cache.invalidate('users', room_jid)
+        self.response_cache.invalidate('status')
+    
+    def invalidate_rooms(self):
+        """Drop cached responses that depend on the set of joined rooms."""
+        self.response_cache.invalidate('rooms')
+        self.response_cache.invalidate('users')
+        self.response_cache.invalidate('status')
+    
+    def _sender_key(self, msg):
+        """Get the key identifying who sent a message, preferring the real JID."""
+        room = msg['from'].bare
+        # A private message from a room occupant comes from room@service/nick
+        private = msg['type'] != 'groupchat' and msg['from'].resource and self.bot.occupants.has_room(room)
+        if msg['type'] == 'groupchat' or private:
+            nick = msg['from'].resource if private else msg['mucnick']
+            real_jid = self.bot.plugin['xep_0045'].get_jid_property(room, nick, 'jid')
+            if real_jid:
+                return real_jid.bare
+            return msg['from'].full
+        return msg['from'].bare
+    
+    def _command_limiter(self, command):
+        """Get the limiter for a command with its own limit configured, if any."""
+        if command not in self.command_limiters:
+            limit = self.bot.config.getint('ratelimit', f'{command}_limit', fallback=None)
+            if limit is None:
+                self.command_limiters[command] = None
+            else:
+                self.command_limiters[command] = SlidingWindowLimiter(
+                    limit, self.user_window, self.user_limiter.max_keys
+                )
+        return self.command_limiters[command]
+    
+    def _check_rate_limit(self, msg, command):
+        """Check the flood limits for a command, returning False if it should be dropped."""
+        sender = self._sender_key(msg)
+        checks = [(self.user_limiter, sender)]
+        
+        limiter = self._command_limiter(command)
+        if limiter is not None:
+            checks.append((limiter, sender))
+        if msg['type'] == 'groupchat':
+            checks.append((self.room_limiter, msg['from'].bare))
+        
+        for limiter, key in checks:
+            if not limiter.hit(key):
+                self.logger.info("Rate limited command %s from %s", command, sender)
+                if self.notify_limited and limiter.should_notify(key):
+                    self.bot.outbound.enqueue_stanza(msg.reply(self.slow_down_message))
+                return False
+        return True
     
     async def _cmd_help(self, msg, args):
         """Show available commands."""
@@ -65,8 +369,13 @@ class CommandHandler:
 !ping - Check if bot is responsive
 !time - Show current time
 !status - Show bot status
-!rooms - List connected rooms (group chat only)
-!users <room> - List users in a room (group chat only)
+!rooms [prefix*] [page N] - List connected rooms (group chat only)
+!users [room] [prefix*] [page N] - List users in a room (group chat only)
+!report [prefix*] [page N] - Show rooms with their users (group chat only)
+!more - Continue a long reply, in a private message
+!debug [seconds] - Profile the bot and report the results (admins only)
+!search <terms> - Search this room's message archive (group chat only)
+!seen <nick> - Show when a user last spoke in this room (group chat only)
 !about - Show bot information"""
         
         return help_text
@@ -83,48 +392,205 @@ class CommandHandler:
     
     async def _cmd_status(self, msg, args):
         """Show bot status information."""
+        if self.bot.shard:
+            return await self._cluster_status()
+        
         connected_rooms = len(self.bot.get_connected_rooms())
-        total_users = sum(len(users) for users in self.bot.room_users.values())
+        total_users = self.bot.occupants.count()
+        index_kb = self._index_size() // 1024
         
         status = f"""Bot Status:
 • Connected: ✅ Yes
 • Nickname: {self.bot.nick}
 • Joined rooms: {connected_rooms}
 • Total tracked users: {total_users}
+• Occupant index: {index_kb} KB
 • Timezone: {self.bot.timezone}
 • Python version: {sys.version.split()[0]}"""
         
         return status
     
+    def _index_size(self):
+        """Get the occupant index size in bytes, measured at most every memory_interval seconds."""
+        now = time.monotonic()
+        if self._index_bytes is None or now - self._index_measured >= self.memory_interval:
+            self._index_bytes = self.bot.occupants.memory_usage()['bytes']
+            self._index_measured = now
+        return self._index_bytes
+    
+    async def _cluster_status(self):
+        """Show status summed over all shards."""
+        shards = await self.bot.shard.cluster_stats()
+        total_rooms = sum(len(shard['rooms']) for shard in shards)
+        total_users = sum(shard['users'] for shard in shards)
+        shard_lines = "\n".join(
+            f"  – shard {shard['shard']}: {len(shard['rooms'])} rooms, {shard['users']} users"
+            for shard in shards
+        )
+        
+        return f"""Bot Status:
+• Connected: ✅ Yes
+• Nickname: {self.bot.nick}
+• Shards: {len(shards)}
+{shard_lines}
+• Joined rooms: {total_rooms}
+• Total tracked users: {total_users}
+• Timezone: {self.bot.timezone}
+• Python version: {sys.version.split()[0]}"""
+    
     async def _cmd_rooms(self, msg, args):
         """List connected rooms (group chat only)."""
         if msg['type'] != 'groupchat':
             return "This command is only available in group chats."
         
-        rooms = self.bot.get_connected_rooms()
-        if not rooms:
+        _, prefix, page = parse_listing_args(args)
+        offset = (page - 1) * self.page_size
+        if self.bot.shard:
+            shards = await self.bot.shard.cluster_stats()
+            rooms = sorted((room for shard in shards for room in shard['rooms']), key=str.casefold)
+            if prefix:
+                folded = prefix.casefold()
+                rooms = [room for room in rooms if room.casefold().startswith(folded)]
+            total, rooms = len(rooms), rooms[offset:offset + self.page_size]
+        else:
+            total, rooms = self.bot.occupants.room_page(offset, self.page_size, prefix)
+        if not total:
+            if prefix:
+                return f"No connected rooms starting with {prefix}."
             return "No rooms currently connected."
+        if not rooms:
+            return f"There are only {self._page_count(total)} pages."
         
         room_list = "\n".join(f"• {room}" for room in rooms)
-        return f"Connected rooms:\n{room_list}"
+        header = "Connected rooms" + (f" starting with {prefix}" if prefix else "")
+        footer = self._page_footer('rooms', [f'{prefix}*'] if prefix else [], page, total)
+        return f"{header}{self._page_range(offset, len(rooms), total)}:\n{room_list}{footer}"
     
     async def _cmd_users(self, msg, args):
-        """List users in a room."""
+        """List users in a room, a page at a time."""
         if msg['type'] != 'groupchat':
             return "This command is only available in group chats."
         
         # If no room specified, use current room
-        if not args:
-            room = msg['from'].bare
-        else:
-            room = args[0]
+        positional, prefix, page = parse_listing_args(args)
+        room = positional[0] if positional else msg['from'].bare
         
-        users = self.bot.get_room_users(room)
-        if not users:
+        offset = (page - 1) * self.page_size
+        total, users = self.bot.occupants.nick_page(room, offset, self.page_size, prefix)
+        if not total:
+            if prefix:
+                return f"No users starting with {prefix} in room: {room}"
             return f"No users found in room: {room}"
+        if not users:
+            return f"There are only {self._page_count(total)} pages."
+        
+        user_list = "\n".join(f"• {user}" for user in users)
+        header = f"Users in {room}" + (f" starting with {prefix}" if prefix else "")
+        footer = self._page_footer('users', [room] + ([f'{prefix}*'] if prefix else []), page, total)
+        return f"{header}{self._page_range(offset, len(users), total)}:\n{user_list}{footer}"
+    
+    async def _cmd_report(self, msg, args):
+        """Show rooms with their users, a page of rooms at a time."""
+        if msg['type'] != 'groupchat':
+            return "This command is only available in group chats."
+        
+        _, prefix, page = parse_listing_args(args)
+        report = self.bot.conference_manager.create_room_report(page, self.page_size, prefix)
+        total, _ = self.bot.occupants.room_page(0, 0, prefix)
+        return report + self._page_footer('report', [f'{prefix}*'] if prefix else [], page, total)
+    
+    async def _cmd_more(self, msg, args):
+        """Send the rest of a long group chat reply in private."""
+        if msg['type'] == 'groupchat':
+            return "Send !more to me in a private message."
+        entry = self.continuations.pop(msg['from'].full, None)
+        if entry is None or entry[0] < time.monotonic():
+            return "Nothing more to show."
+        for part in entry[1]:
+            self.bot.outbound.enqueue_stanza(msg.reply(part))
+        return None
+    
+    async def _cmd_debug(self, msg, args):
+        """Profile the bot for a while and report the results (admins only)."""
+        if not self.bot.profiler.is_admin(self._sender_key(msg)):
+            return "Sorry, only bot admins can use !debug."
+        try:
+            duration = float(args[0]) if args else None
+        except ValueError:
+            return "Usage: !debug [seconds]"
+        if duration is not None and not (math.isfinite(duration) and duration > 0):
+            return "Usage: !debug [seconds]"
+        
+        # The profile outlives the command timeout; its summary is sent when it ends
+        duration = self.bot.profiler.trigger(
+            duration, on_done=lambda summary: self.send_response(msg, summary)
+        )
+        if duration is None:
+            return "A profile is already running."
+        return f"Profiling for {duration:.0f}s, I will report back when done."
+    
+    def _page_count(self, total):
+        """Get the number of pages a listing of total entries takes."""
+        return max(1, -(-total // self.page_size))
+    
+    def _page_range(self, offset, shown, total):
+        """Describe which entries of a listing a page shows."""
+        if total <= self.page_size:
+            return f" ({total})"
+        return f" ({offset + 1}-{offset + shown} of {total})"
+    
+    def _page_footer(self, command, args, page, total):
+        """Tell how to get the next page of a listing, if there is one."""
+        pages = self._page_count(total)
+        if page >= pages:
+            return ""
+        return f"\nPage {page}/{pages}, next: !{command} {' '.join(args + ['page', str(page + 1)])}"
+    
+    def _format_stamp(self, stamp):
+        """Format a unix time in the bot's timezone."""
+        return datetime.fromtimestamp(stamp, self.bot.timezone).strftime("%Y-%m-%d %H:%M %Z")
+    
+    async def _cmd_search(self, msg, args):
+        """Search the archive of the current room."""
+        if msg['type'] != 'groupchat':
+            return "This command is only available in group chats."
+        if not self.bot.archive.enabled:
+            return "The message archive is disabled."
+        if not args:
+            return "Usage: !search <terms>"
+        
+        room = msg['from'].bare
+        results = await self.bot.archive.search(room, args)
+        if not results:
+            return f"No messages found for: {' '.join(args)}"
+        
+        lines = "\n".join(
+            f"• [{self._format_stamp(result['stamp'])}] <{result['nick']}> {result['body']}"
+            for result in results
+        )
+        return f"Latest messages matching {' '.join(args)}:\n{lines}"
+    
+    async def _cmd_seen(self, msg, args):
+        """Show when a nick last spoke in the current room."""
+        if msg['type'] != 'groupchat':
+            return "This command is only available in group chats."
+        if not self.bot.archive.enabled:
+            return "The message archive is disabled."
+        if not args:
+            return "Usage: !seen <nick>"
+        
+        room = msg['from'].bare
+        nick = ' '.join(args)
+        last = await self.bot.archive.last_seen(room, nick)
+        here = self.bot.occupants.contains(room, nick)
+        if last is None:
+            if here:
+                return f"{nick} is here right now but has not said anything yet."
+            return f"I have not seen {nick} say anything here."
         
-        user_list = "\n".join(f"• {user}" for user in sorted(users))
-        return f"Users in {room}:\n{user_list}"
+        when = self._format_stamp(last['stamp'])
+        status = " (here right now)" if here else ""
+        return f"{last['nick']} last spoke on {when}{status}: {last['body']}"
     
     async def _cmd_about(self, msg, args):
         """Show bot information."""
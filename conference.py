@@ -2,9 +2,26 @@
 Conference/MUC (Multi-User Chat) management for the Jabber bot.
 """
 
+import asyncio
 import logging
+import random
+import time
 from datetime import datetime
 
+from slixmpp.exceptions import PresenceError
+
+from outbound import PRIORITY_ANNOUNCEMENT
+from roominfo import RoomInfoCache
+
+
+def _percentile(values, pct):
+    """Get the nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
 
 class ConferenceManager:
     """Manages conference room operations and user interactions."""
@@ -17,40 +34,112 @@ class ConferenceManager:
         # Store room-specific settings
         self.room_settings = {}
         
+        # Join configuration
+        self.join_concurrency = self.bot.config.getint('bot', 'join_concurrency', fallback=10)
+        self.join_timeout = self.bot.config.getfloat('bot', 'join_timeout', fallback=30.0)
+        self.join_retries = self.bot.config.getint('bot', 'join_retries', fallback=3)
+        self.join_retry_delay = self.bot.config.getfloat('bot', 'join_retry_delay', fallback=2.0)
+        
+        # Latency of the last successful join per room, in seconds
+        self.join_latencies = {}
+        
+        # Room configuration, subject and disco#info
+        self.info_cache = RoomInfoCache(bot)
+        
     def configure_room(self, room_jid, **settings):
         """Configure settings for a specific room."""
         if room_jid not in self.room_settings:
             self.room_settings[room_jid] = {}
         
         self.room_settings[room_jid].update(settings)
-        self.logger.info(f"Updated settings for room {room_jid}: {settings}")
+        self.bot.snapshot.room_changed(room_jid)
+        if 'triggers' in settings:
+            self.bot.responder.room_changed(room_jid)
+        self.logger.info("Updated settings for room %s: %s", room_jid, settings)
     
     def get_room_setting(self, room_jid, setting, default=None):
         """Get a setting for a specific room."""
         return self.room_settings.get(room_jid, {}).get(setting, default)
     
-    async def join_room(self, room_jid, nick=None, password=None):
-        """Join a conference room."""
+    async def join_room(self, room_jid, nick=None, password=None, timeout=None):
+        """Join a conference room and wait for the server to confirm it."""
         if nick is None:
             nick = self.bot.nick
+        if timeout is None:
+            timeout = self.join_timeout
             
+        started = time.monotonic()
         try:
-            self.bot.plugin['xep_0045'].join_muc(
+            self.bot.register_room_handlers(room_jid)
+            self.bot.greeter.room_joining(room_jid)
+            await self.bot.plugin['xep_0045'].join_muc_wait(
                 room_jid, 
                 nick, 
-                password=password
+                password=password,
+                timeout=timeout,
+                **self.bot.history.join_args(room_jid)
             )
             
             # Initialize room tracking
-            if room_jid not in self.bot.room_users:
-                self.bot.room_users[room_jid] = set()
+            self.bot.occupants.add_room(room_jid)
+            self.bot.command_handler.invalidate_rooms()
             
-            self.logger.info(f"Successfully joined room: {room_jid}")
+            self.join_latencies[room_jid] = time.monotonic() - started
+            self.bot.metrics.join_latency.observe(self.join_latencies[room_jid])
+            self.logger.info("Successfully joined room: %s", room_jid)
             return True
             
+        except asyncio.TimeoutError:
+            self.logger.warning("Timed out after %.0fs joining room %s", timeout, room_jid)
+        except PresenceError as e:
+            self.logger.error("Server refused join to %s: %s", room_jid, e.condition)
         except Exception as e:
-            self.logger.error(f"Failed to join room {room_jid}: {e}")
+            self.logger.error("Failed to join room %s: %s", room_jid, e)
+        
+        self.bot.greeter.room_joined(room_jid)
+        return False
+    
+    async def join_rooms(self, rooms):
+        """
+        Join several rooms concurrently.
+        
+        At most join_concurrency joins are in flight at once, and failed joins
+        are retried with exponential backoff. Returns a dict of room -> success.
+        """
+        semaphore = asyncio.Semaphore(self.join_concurrency)
+        
+        async def join_with_retry(room_jid):
+            delay = self.join_retry_delay
+            for attempt in range(1, self.join_retries + 1):
+                async with semaphore:
+                    if await self.join_room(room_jid):
+                        return True
+                if attempt < self.join_retries:
+                    wait = delay * random.uniform(0.5, 1.5)
+                    self.logger.info("Retrying join to %s in %.1fs (attempt %d/%d)",
+                                     room_jid, wait, attempt + 1, self.join_retries)
+                    await asyncio.sleep(wait)
+                    delay *= 2
             return False
+        
+        started = time.monotonic()
+        outcomes = await asyncio.gather(*(join_with_retry(room) for room in rooms))
+        elapsed = time.monotonic() - started
+        results = dict(zip(rooms, outcomes))
+        
+        joined = [room for room, ok in results.items() if ok]
+        latencies = [self.join_latencies[room] for room in joined]
+        rate = len(joined) / elapsed if elapsed > 0 else 0.0
+        self.logger.info(
+            "Joined %d/%d rooms in %.2fs (%.1f rooms/sec, p50 %.0fms, p99 %.0fms)",
+            len(joined), len(rooms), elapsed, rate,
+            _percentile(latencies, 50) * 1000, _percentile(latencies, 99) * 1000
+        )
+        failed = [room for room, ok in results.items() if not ok]
+        if failed:
+            self.logger.warning("Failed to join rooms: %s", ', '.join(failed))
+        
+        return results
     
     async def leave_room(self, room_jid, reason="Goodbye!"):
         """Leave a conference room."""
@@ -58,27 +147,47 @@ class ConferenceManager:
             self.bot.plugin['xep_0045'].leave_muc(room_jid, self.bot.nick, reason)
             
             # Clean up room tracking
-            if room_jid in self.bot.room_users:
-                del self.bot.room_users[room_jid]
+            self.bot.occupants.remove_room(room_jid)
             
             if room_jid in self.room_settings:
                 del self.room_settings[room_jid]
+                self.bot.snapshot.room_changed(room_jid)
+            self.info_cache.forget(room_jid)
+            self.bot.responder.forget(room_jid)
             
-            self.logger.info(f"Left room: {room_jid}")
+            self.bot.greeter.room_left(room_jid)
+            self.bot.command_handler.invalidate_rooms()
+            
+            self.logger.info("Left room: %s", room_jid)
             return True
             
         except Exception as e:
-            self.logger.error(f"Failed to leave room {room_jid}: {e}")
+            self.logger.error("Failed to leave room %s: %s", room_jid, e)
             return False
     
-    def send_room_message(self, room_jid, message):
-        """Send a message to a conference room."""
+    def send_room_message(self, room_jid, message, priority=PRIORITY_ANNOUNCEMENT, reroute=True):
+        """
+        Queue a message for a conference room.
+
+        On a shard, a message for a room this shard is not in goes to the
+        coordinator; reroute=False is used for messages the coordinator
+        routed here, which are dropped instead so they cannot bounce back.
+        """
         try:
-            self.bot.send_message(mto=room_jid, mbody=message, mtype='groupchat')
-            self.logger.debug(f"Sent message to {room_jid}: {message}")
+            if self.bot.shard and not self.bot.occupants.has_room(room_jid):
+                if not reroute:
+                    self.logger.warning("Not in room %s, dropped message routed to this shard", room_jid)
+                    return False
+                # Another shard is in this room
+                self.bot.shard.route(room_jid, message)
+                return True
+            if not self.bot.outbound.enqueue(room_jid, message, priority=priority):
+                self.logger.warning("Outbound queue full, dropped message to %s", room_jid)
+                return False
+            self.logger.debug("Queued message to %s: %s", room_jid, message)
             return True
         except Exception as e:
-            self.logger.error(f"Failed to send message to {room_jid}: {e}")
+            self.logger.error("Failed to send message to %s: %s", room_jid, e)
             return False
     
     def broadcast_message(self, message, exclude_rooms=None):
@@ -87,69 +196,101 @@ class ConferenceManager:
             exclude_rooms = []
         
         sent_count = 0
-        for room_jid in self.bot.room_users.keys():
-            if room_jid not in exclude_rooms:
-                if self.send_room_message(room_jid, message):
-                    sent_count += 1
+        with self.bot.metrics.announcement_fanout.time():
+            for room_jid in self.bot.occupants.rooms():
+                if room_jid not in exclude_rooms:
+                    if self.send_room_message(room_jid, message):
+                        sent_count += 1
         
-        self.logger.info(f"Broadcast message sent to {sent_count} rooms")
+        self.logger.info("Broadcast message sent to %d rooms", sent_count)
         return sent_count
     
-    def get_room_info(self, room_jid):
-        """Get information about a room."""
+    async def get_room_info(self, room_jid, refresh=False):
+        """Get information about a room; configuration and disco#info come from the cache."""
         try:
-            # Get room configuration
-            config_form = self.bot.plugin['xep_0045'].get_room_config(room_jid)
+            config, disco = await asyncio.gather(
+                self.info_cache.get(room_jid, 'config', refresh),
+                self.info_cache.get(room_jid, 'disco', refresh),
+            )
             
             info = {
                 'jid': room_jid,
-                'users': list(self.bot.room_users.get(room_jid, [])),
-                'user_count': len(self.bot.room_users.get(room_jid, [])),
+                'users': self.bot.occupants.nicks(room_jid),
+                'user_count': self.bot.occupants.count(room_jid),
                 'settings': self.room_settings.get(room_jid, {}),
-                'bot_nick': self.bot.nick
+                'bot_nick': self.bot.nick,
+                'subject': self.info_cache.subject(room_jid),
+                'config': config,
+                'disco': disco,
             }
             
             return info
             
         except Exception as e:
-            self.logger.error(f"Failed to get room info for {room_jid}: {e}")
+            self.logger.error("Failed to get room info for %s: %s", room_jid, e)
             return None
     
     def is_user_in_room(self, room_jid, nick):
         """Check if a user is in a specific room."""
-        return nick in self.bot.room_users.get(room_jid, set())
+        return self.bot.occupants.contains(room_jid, nick)
     
     def get_user_rooms(self, nick):
         """Get all rooms where a specific user is present."""
-        user_rooms = []
-        for room_jid, users in self.bot.room_users.items():
-            if nick in users:
-                user_rooms.append(room_jid)
-        return user_rooms
+        return list(self.bot.occupants.rooms_for_nick(nick))
     
-    def create_room_report(self):
-        """Create a summary report of all rooms and users."""
+    def get_jid_rooms(self, jid):
+        """Get all rooms where a user with a real bare JID is present."""
+        return list(self.bot.occupants.rooms_for_jid(jid))
+    
+    def create_room_report(self, page=None, page_size=50, prefix=None):
+        """
+        Create a summary report of rooms and users.
+        
+        Covers all rooms, or one page of page_size rooms; a prefix limits it
+        to rooms starting with it. Rooms and members come from the occupant
+        store's sorted indexes, so only the shown part of each room is read.
+        """
         report_lines = ["📊 Conference Room Report", "=" * 30]
         
-        if not self.bot.room_users:
+        occupants = self.bot.occupants
+        if not occupants.room_count():
             report_lines.append("No rooms currently connected.")
             return "\n".join(report_lines)
         
-        total_users = 0
-        for room_jid, users in self.bot.room_users.items():
-            user_count = len(users)
-            total_users += user_count
-            
+        total_rooms, _ = occupants.room_page(0, 0, prefix)
+        if page is None:
+            _, rooms = occupants.room_page(0, total_rooms, prefix)
+        else:
+            _, rooms = occupants.room_page((page - 1) * page_size, page_size, prefix)
+        if not rooms:
+            report_lines.append(f"No rooms starting with {prefix}." if prefix else "No rooms on this page.")
+            return "\n".join(report_lines)
+        
+        for room_jid in rooms:
+            user_count = occupants.count(room_jid)
             report_lines.append(f"\n🏠 Room: {room_jid}")
             report_lines.append(f"   Users: {user_count}")
             
-            if users:
-                user_list = ", ".join(sorted(users))
-                if len(user_list) > 80:
+            if user_count:
+                # Take names only until the line is full
+                names = []
+                length = -2
+                for nick in occupants.sorted_nicks(room_jid):
+                    names.append(nick)
+                    length += len(nick) + 2
+                    if length > 80:
+                        break
+                user_list = ", ".join(names)
+                if length > 80:
                     user_list = user_list[:77] + "..."
                 report_lines.append(f"   Members: {user_list}")
         
-        report_lines.append(f"\n📈 Total: {len(self.bot.room_users)} rooms, {total_users} users")
+        if prefix:
+            _, matching = occupants.room_page(0, total_rooms, prefix)
+            total_users = sum(occupants.count(room_jid) for room_jid in matching)
+        else:
+            total_users = occupants.count()
+        report_lines.append(f"\n📈 Total: {total_rooms} rooms, {total_users} users")
         report_lines.append(f"⏰ Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         
         return "\n".join(report_lines)
@@ -0,0 +1,432 @@
+"""
+Connection setup: server settings, cached address resolution and timing.
+"""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import socket
+import ssl
+import time
+
+
+PHASES = ('dns', 'tcp', 'tls', 'sasl', 'bind', 'resume')
+
+
+class SessionCachingContext(ssl.SSLContext):
+    """
+    Client TLS context that offers the last session of a server for resumption.
+
+    asyncio creates its TLS objects through wrap_bio() and has no way to pass
+    a session, so the session is supplied here, keyed by server name.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create the context; the protocol is taken by SSLContext.__new__."""
+        super().__init__()
+        self.sessions = {}  # server name -> ssl.SSLSession
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        """Wrap BIOs for a TLS connection, resuming the server's last session if known."""
+        if session is None and not server_side:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                server_hostname=server_hostname, session=session)
+
+
+def _interleave(addresses):
+    """Order addresses alternating between IPv6 and IPv4, keeping the first family first."""
+    first, second = [], []
+    for address in addresses:
+        (first if ':' in address else second).append(address)
+    if addresses and ':' not in addresses[0]:
+        first, second = second, first
+    ordered = []
+    for index in range(max(len(first), len(second))):
+        ordered.extend(family[index] for family in (first, second) if index < len(family))
+    return ordered
+
+
+def _is_ip(host):
+    """Check whether a host is an IP address literal."""
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+    except ValueError:
+        return False
+    return True
+
+
+class ConnectionManager:
+    """
+    Connects the bot using the [server] settings, as fast as it can.
+
+    SRV and address lookups are cached for cache_ttl seconds and saved to
+    cache_file, so a reconnect or restart usually skips DNS; if every cached
+    address of a server fails, it is looked up again at once.
+    When a lookup fails, an expired entry is used rather than nothing. The
+    addresses of a server are tried in parallel, a new attempt starting every
+    attempt_delay seconds, and the first to connect wins. The TLS session of
+    the last connection is offered on the next handshake so the server can
+    resume it.
+
+    Each connection's setup time is split into phases (dns, tcp, tls, sasl,
+    and bind or resume), logged once the session is up and recorded in the
+    connect_phase_seconds metric.
+    """
+
+    def __init__(self, bot):
+        """Initialize connection handling with bot instance and apply [server]."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        config = self.bot.config
+        self.host = config.get('server', 'host', fallback='').strip()
+        self.use_tls = config.getboolean('server', 'use_tls', fallback=True)
+        self.use_ssl = config.getboolean('server', 'use_ssl', fallback=False)
+        self.port = config.getint('server', 'port', fallback=5223 if self.use_ssl else 5222)
+        self.cache_file = config.get('server', 'cache_file', fallback='dns_cache.json')
+        self.cache_ttl = config.getfloat('server', 'cache_ttl', fallback=3600.0)
+        self.connect_timeout = config.getfloat('server', 'connect_timeout', fallback=10.0)
+        self.attempt_delay = config.getfloat('server', 'attempt_delay', fallback=0.25)
+        self.tls_session_reuse = config.getboolean('server', 'tls_session_reuse', fallback=True)
+
+        # Without a [server] section slixmpp's defaults stay: direct TLS or STARTTLS
+        if config.has_option('server', 'use_tls') or config.has_option('server', 'use_ssl'):
+            bot.enable_direct_tls = self.use_ssl
+            bot.enable_starttls = self.use_tls
+            bot.enable_plaintext = not (self.use_ssl or self.use_tls)
+            if bot.enable_plaintext:
+                self.logger.warning("use_tls and use_ssl are both off; connecting without encryption")
+        bot.default_port = self.port
+        if self.tls_session_reuse:
+            context = SessionCachingContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.load_default_certs()
+            bot.ssl_context = context
+
+        self.entries = {}    # cache key -> {'expires': wall time, 'records': [...]}
+        self.addresses = {}  # (host, port) -> addresses of the current resolution
+        self._cached = set() # (host, port) whose addresses came from the cache
+        self._load()
+
+        self.phases = {}
+        self.dns_source = None
+        self.tls_resumed = None
+        self._started = None
+        self._mark = None
+        self._tcp_done = None
+        self._direct_tls = False
+
+        bot.add_event_handler('connecting', self._connecting)
+        bot.add_event_handler('connected', self._connected)
+        bot.add_event_handler('tls_success', self._tls_success)
+        bot.add_event_handler('auth_success', self._auth_success)
+        bot.add_event_handler('session_bind', self._session_bind)
+        bot.add_event_handler('session_resumed', self._session_resumed)
+
+    def address(self):
+        """Get the (host, port) to pass to connect(); (None, None) resolves the JID's domain."""
+        if self.host:
+            return self.host, self.port
+        return None, None
+
+    # Address cache
+
+    def _load(self):
+        """Load saved lookups; expired ones are kept as a fallback."""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, encoding='utf-8') as handle:
+                self.entries = json.load(handle)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Could not load address cache from {self.cache_file}: {e}")
+            return
+        self.logger.info("Loaded %d cached server lookups from %s", len(self.entries), self.cache_file)
+
+    def _save(self):
+        """Write the lookups to the cache file."""
+        if not self.cache_file:
+            return
+        tmp_path = f'{self.cache_file}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as handle:
+                json.dump(self.entries, handle)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            self.logger.error(f"Could not save address cache to {self.cache_file}: {e}")
+
+    def _get(self, key, stale=False):
+        """Get the cached records of a lookup, or None if there are none or they expired."""
+        entry = self.entries.get(key)
+        if entry is None or (not stale and entry['expires'] < time.time()):
+            return None
+        return entry['records']
+
+    def _store(self, key, records):
+        """Cache the records of a lookup."""
+        self.entries[key] = {'expires': time.time() + self.cache_ttl, 'records': records}
+        self._save()
+
+    def _forget(self, host, port):
+        """Drop every cached lookup that led to a server whose cached addresses all failed."""
+        self.addresses.pop((host, port), None)
+        self._cached.discard((host, port))
+        stale = [key for key, entry in self.entries.items()
+                 if key == f'addr:{host}:{port}'
+                 or any(record[1] == host for record in entry['records'] if isinstance(record, list))]
+        for key in stale:
+            del self.entries[key]
+        if stale:
+            self.logger.info("Dropped cached addresses of %s:%d", host, port)
+            self._save()
+
+    async def resolve(self, domain, port, lookup):
+        """
+        Get the SRV targets of a domain, one record per target and service.
+
+        lookup is slixmpp's own resolution, returning one record per address;
+        the addresses are kept aside and raced when the target is connected to.
+        """
+        started = time.perf_counter()
+        key = f'srv:{domain}'
+        records = self._get(key)
+        source = 'cache'
+        if records is None:
+            records = [list(record) for record in await lookup(domain, port)]
+            if records:
+                self._store(key, records)
+                source = 'dns'
+            else:
+                records = self._get(key, stale=True) or []
+                source = 'stale'
+        self._add_phase('dns', time.perf_counter() - started)
+        self._dns_looked_up(source)
+
+        self.addresses = {}
+        self._cached = set()
+        targets = []
+        for service, host, address, record_port in records:
+            addresses = self.addresses.setdefault((host, record_port), [])
+            if address not in addresses:
+                addresses.append(address)
+            if source != 'dns':
+                self._cached.add((host, record_port))
+            target = (service, host, host, record_port)
+            if target not in targets:
+                targets.append(target)
+        return targets
+
+    async def _lookup(self, host, port):
+        """Get the addresses of a configured host, from the cache when fresh."""
+        if _is_ip(host):
+            return [host.strip('[]')]
+        started = time.perf_counter()
+        key = f'addr:{host}:{port}'
+        addresses = self._get(key)
+        source = 'cache'
+        if addresses is None:
+            family = socket.AF_UNSPEC if self.bot.use_ipv6 else socket.AF_INET
+            try:
+                infos = await self.bot.loop.getaddrinfo(host, port, family=family, type=socket.SOCK_STREAM)
+            except socket.gaierror:
+                addresses = self._get(key, stale=True)
+                if not addresses:
+                    raise
+                source = 'stale'
+            else:
+                addresses = list(dict.fromkeys(info[4][0] for info in infos))
+                self._store(key, addresses)
+                source = 'dns'
+        if source != 'dns':
+            self._cached.add((host, port))
+        self.addresses[(host, port)] = addresses
+        self._add_phase('dns', time.perf_counter() - started)
+        self._dns_looked_up(source)
+        return addresses
+
+    def _dns_looked_up(self, source):
+        """Note where the last lookup was answered from."""
+        self.dns_source = source
+        self.bot.metrics.dns_lookups.inc(source)
+
+    # Connecting
+
+    async def attempt(self, host, port, tls, server_hostname):
+        """
+        Connect to one server, racing its addresses; used as the bot's _attempt_connection.
+
+        Mirrors slixmpp's own attempt, whose retry bookkeeping it keeps; the
+        slixmpp versions these internals are known for are pinned in pyproject.toml.
+        """
+        bot = self.bot
+        bot.event_when_connected = 'connected'
+        bot._connect_loop_wait += 1
+        ssl_context = bot.get_ssl_context() if tls else None
+        if bot._current_connection_attempt is None:
+            return False
+        try:
+            addresses = self.addresses.get((host, port)) or await self._lookup(host, port)
+            try:
+                sock = await self._connect(addresses, port)
+            except OSError:
+                if (host, port) not in self._cached:
+                    raise
+                # The cached addresses may be out of date; look the server up again right away
+                self._forget(host, port)
+                sock = await self._connect(await self._lookup(host, port), port)
+            self._direct_tls = tls
+            try:
+                await bot.loop.create_connection(lambda: bot, sock=sock, ssl=ssl_context,
+                                                 server_hostname=server_hostname,
+                                                 ssl_handshake_timeout=self.connect_timeout if tls else None)
+            except BaseException:
+                sock.close()
+                raise
+            bot._connect_loop_wait = 0
+            return True
+        except socket.gaierror:
+            bot.event('connection_failed', f'No DNS record available for {host}')
+            return False
+        except OSError as e:
+            self.logger.debug("Connection to %s:%d failed: %s", host, port, e)
+            bot.event('connection_failed', e)
+            return False
+
+    async def _connect(self, addresses, port):
+        """Open a TCP connection to one of a server's addresses, timing it."""
+        started = time.perf_counter()
+        try:
+            return await self._race(_interleave(addresses), port)
+        finally:
+            self._tcp_done = time.perf_counter()
+            self._add_phase('tcp', self._tcp_done - started)
+
+    async def _race(self, addresses, port):
+        """Connect to the first address that answers, starting another every attempt_delay."""
+        queue = list(addresses)
+        pending = set()
+        errors = []
+        winner = None
+        try:
+            while winner is None and (queue or pending):
+                if queue:
+                    pending.add(asyncio.ensure_future(self._open(queue.pop(0), port)))
+                # A failed attempt ends the wait early, so the next one starts right away
+                done, pending = await asyncio.wait(pending, timeout=self.attempt_delay if queue else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        task.result().close()
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_close_unused)
+        if winner is None:
+            raise errors[-1] if errors else OSError(f'No addresses to connect to on port {port}')
+        return winner
+
+    async def _open(self, address, port):
+        """Open a TCP connection to one address."""
+        sock = socket.socket(socket.AF_INET6 if ':' in address else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(self.bot.loop.sock_connect(sock, (address, port)), self.connect_timeout)
+        except asyncio.TimeoutError:
+            sock.close()
+            raise OSError(f'Timed out connecting to {address}:{port}') from None
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    # Phase timing
+
+    def _add_phase(self, phase, elapsed):
+        """Add time to a phase; failed attempts add to the phases they reached."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+
+    def _connecting(self, event):
+        """Start timing a connection."""
+        self._started = time.perf_counter()
+        # A configured host is looked up again, from the cache while it is fresh
+        self.addresses = {}
+        self.phases = {}
+        self.dns_source = None
+        self.tls_resumed = None
+
+    def _connected(self, event):
+        """The stream is connected; with direct TLS the handshake is done too."""
+        now = time.perf_counter()
+        if self._direct_tls and self._tcp_done is not None:
+            self._add_phase('tls', now - self._tcp_done)
+        self._mark = now
+
+    def _tls_success(self, event):
+        """Time STARTTLS, from the stream opening to the end of the handshake."""
+        now = time.perf_counter()
+        if not self._direct_tls and self._mark is not None:
+            self._add_phase('tls', now - self._mark)
+        self._mark = now
+        ssl_object = self.bot.transport.get_extra_info('ssl_object') if self.bot.transport else None
+        if ssl_object is not None:
+            self.tls_resumed = ssl_object.session_reused
+            self.bot.metrics.tls_handshakes.inc('resumed' if self.tls_resumed else 'full')
+
+    def _auth_success(self, event):
+        """Time SASL and keep the TLS session for the next connection."""
+        now = time.perf_counter()
+        if self._mark is not None:
+            self._add_phase('sasl', now - self._mark)
+        self._mark = now
+        # TLS 1.3 tickets arrive after the handshake; by now the server has sent them
+        context = self.bot.ssl_context
+        ssl_object = self.bot.transport.get_extra_info('ssl_object') if self.bot.transport else None
+        if isinstance(context, SessionCachingContext) and ssl_object is not None:
+            session = ssl_object.session
+            if session is not None:
+                context.sessions[self.bot.default_domain] = session
+
+    def _session_bind(self, event):
+        """Time resource binding and report the connection."""
+        self._finish('bind')
+
+    def _session_resumed(self, event):
+        """Time stream resumption and report the connection."""
+        self._finish('resume')
+
+    def _finish(self, phase):
+        """Log and record the phases of a connection that is now usable."""
+        if self._started is None:
+            return
+        now = time.perf_counter()
+        if self._mark is not None:
+            self._add_phase(phase, now - self._mark)
+        total = now - self._started
+        self._started = self._mark = None
+
+        histogram = self.bot.metrics.connect_phases
+        parts = []
+        for name in PHASES:
+            if name not in self.phases:
+                continue
+            histogram.observe(self.phases[name], name)
+            part = f"{name} {self.phases[name] * 1000:.0f}"
+            if name == 'dns' and self.dns_source != 'dns':
+                part += f" ({self.dns_source})"
+            if name == 'tls' and self.tls_resumed is not None:
+                part += " (resumed)" if self.tls_resumed else " (full)"
+            parts.append(part)
+        histogram.observe(total, 'total')
+        self.logger.info("Connected in %.0f ms: %s", total * 1000, ", ".join(parts))
+
+
+def _close_unused(task):
+    """Close the socket of a connection attempt that finished after the race was decided."""
+    if not task.cancelled() and task.exception() is None:
+        task.result().close()
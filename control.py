@@ -0,0 +1,386 @@
+"""
+Local JSON-RPC control socket for scripts and tooling.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import stat
+from datetime import datetime
+
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+SCHEDULE_KINDS = ('delay', 'at', 'interval', 'daily', 'cron')
+
+
+class RpcError(Exception):
+    """An error to answer a request with."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class ControlServer:
+    """
+    JSON-RPC 2.0 over a Unix domain socket.
+
+    Requests and responses are single JSON lines; a line holding an array is
+    a batch, whose requests run concurrently and are answered with one array.
+    A result that is a list longer than stream_threshold is not sent in one
+    line: it arrives as 'result.chunk' notifications of chunk_size items
+    carrying the request id, followed by the response with the item count.
+
+    With a bot, every method acts on that connection. With a shard
+    coordinator, only the methods the coordinator can route are offered.
+    """
+
+    def __init__(self, config, bot=None, coordinator=None):
+        """Initialize the server for a bot or a shard coordinator."""
+        self.bot = bot
+        self.coordinator = coordinator
+        self.logger = logging.getLogger(__name__)
+
+        self.path = config.get('control', 'socket', fallback='jabberbot.sock')
+        self.mode = int(config.get('control', 'mode', fallback='600'), 8)
+        self.stream_threshold = config.getint('control', 'stream_threshold', fallback=500)
+        self.chunk_size = config.getint('control', 'chunk_size', fallback=200)
+        self.max_request = config.getint('control', 'max_request', fallback=2**20)
+
+        self._server = None
+        self._clients = set()
+        self.stats = {'connections': 0, 'requests': 0, 'errors': 0}
+
+        if coordinator is not None:
+            self.methods = {
+                'status': self._cluster_status,
+                'rooms': self._cluster_rooms,
+                'broadcast': self._cluster_broadcast,
+                'send': self._cluster_send,
+                'join_room': self._cluster_join,
+                'leave_room': self._cluster_leave,
+            }
+        else:
+            self.methods = {
+                'status': self._status,
+                'rooms': self._rooms,
+                'broadcast': self._broadcast,
+                'send': self._send,
+                'join_room': self._join,
+                'leave_room': self._leave,
+                'room_report': self._room_report,
+                'room_info': self._room_info,
+                'occupants': self._occupants,
+                'user_rooms': self._user_rooms,
+                'jobs.list': self._jobs_list,
+                'jobs.get': self._jobs_get,
+                'jobs.types': self._jobs_types,
+                'jobs.schedule': self._jobs_schedule,
+                'jobs.cancel': self._jobs_cancel,
+            }
+        self.methods['methods'] = self._list_methods
+
+    async def start(self):
+        """Start listening on the socket."""
+        # A stale socket from an unclean exit is replaced
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Bind under a umask giving the final mode, so the socket is never more open than that
+        old_umask = os.umask(0o777 & ~self.mode)
+        try:
+            sock.bind(self.path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(old_umask)
+        self._server = await asyncio.start_unix_server(
+            self._handle, sock=sock, limit=self.max_request
+        )
+        self.logger.info("Control socket listening on %s", self.path)
+
+    async def stop(self):
+        """Stop listening, close client connections and remove the socket."""
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._clients):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    async def _handle(self, reader, writer):
+        """Serve one client until it disconnects."""
+        self._clients.add(writer)
+        self.stats['connections'] += 1
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than max_request; the rest of the stream cannot be framed
+                    await self._write(writer, self._error(None, INVALID_REQUEST, "Request too large"))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # Requests are answered as they finish, so a slow one does not hold up the next
+                task = asyncio.create_task(self._process(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _process(self, line, writer):
+        """Parse one line and write its response, if any."""
+        try:
+            message = json.loads(line)
+        except ValueError:
+            await self._write(writer, self._error(None, PARSE_ERROR, "Parse error"))
+            return
+        if isinstance(message, list):
+            if not message:
+                await self._write(writer, self._error(None, INVALID_REQUEST, "Empty batch"))
+                return
+            responses = await asyncio.gather(*(self._call(request, writer) for request in message))
+            responses = [response for response in responses if response is not None]
+            if responses:
+                await self._write(writer, responses)
+        else:
+            response = await self._call(message, writer)
+            if response is not None:
+                await self._write(writer, response)
+
+    async def _write(self, writer, message):
+        """Send one JSON line."""
+        try:
+            writer.write(json.dumps(message, default=str).encode('utf-8') + b'\n')
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    def _error(request_id, code, message):
+        """Build an error response."""
+        return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+    async def _call(self, request, writer):
+        """Run one request; returns its response, or None for a notification."""
+        self.stats['requests'] += 1
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' \
+                or not isinstance(request.get('method'), str):
+            self.stats['errors'] += 1
+            return self._error(None, INVALID_REQUEST, "Invalid request")
+        request_id = request.get('id')
+        notification = 'id' not in request
+        try:
+            method = self.methods.get(request['method'])
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f"Method not found: {request['method']}")
+            params = request.get('params', {})
+            if isinstance(params, list):
+                result = await method(*params)
+            elif isinstance(params, dict):
+                result = await method(**params)
+            else:
+                raise RpcError(INVALID_PARAMS, "params must be an array or an object")
+        except RpcError as e:
+            self.stats['errors'] += 1
+            return None if notification else self._error(request_id, e.code, e.message)
+        except (TypeError, ValueError) as e:
+            self.stats['errors'] += 1
+            return None if notification else self._error(request_id, INVALID_PARAMS, str(e))
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.logger.error(f"Control request {request['method']} failed: {e}", exc_info=True)
+            return None if notification else self._error(request_id, INTERNAL_ERROR, str(e))
+
+        if notification:
+            return None
+        if isinstance(result, list) and len(result) > self.stream_threshold:
+            for start in range(0, len(result), self.chunk_size):
+                await self._write(writer, {
+                    'jsonrpc': '2.0',
+                    'method': 'result.chunk',
+                    'params': {'id': request_id, 'items': result[start:start + self.chunk_size]},
+                })
+            result = {'streamed': len(result)}
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    async def _list_methods(self):
+        """Names of the methods this server offers."""
+        return sorted(self.methods)
+
+    # Single connection
+
+    async def _status(self):
+        """Connection, room, user, queue and job counts."""
+        bot = self.bot
+        return {
+            'jid': str(bot.boundjid),
+            'connected': bot.is_connected(),
+            'rooms': bot.occupants.room_count(),
+            'users': bot.occupants.count(),
+            'outbound_depth': bot.outbound.depth(),
+            'jobs': len(bot.scheduler.jobs),
+        }
+
+    async def _rooms(self):
+        """Joined rooms with their user counts."""
+        occupants = self.bot.occupants
+        _, rooms = occupants.room_page(0, occupants.room_count())
+        return [{'room': room, 'users': occupants.count(room)} for room in rooms]
+
+    async def _broadcast(self, message, exclude_rooms=None):
+        """Send a message to every joined room."""
+        return {'sent': self.bot.conference_manager.broadcast_message(message, exclude_rooms)}
+
+    async def _send(self, room, message):
+        """Send a message to one room."""
+        return self.bot.conference_manager.send_room_message(room, message)
+
+    async def _join(self, room, nick=None, password=None):
+        """Join a room and wait for the server to confirm it."""
+        return await self.bot.conference_manager.join_room(room, nick, password)
+
+    async def _leave(self, room, reason="Goodbye!"):
+        """Leave a room."""
+        return await self.bot.conference_manager.leave_room(room, reason)
+
+    async def _room_report(self):
+        """The room report, one list item per line."""
+        return self.bot.conference_manager.create_room_report().split('\n')
+
+    async def _room_info(self, room, refresh=False):
+        """Cached configuration, subject and disco#info of a room."""
+        return await self.bot.conference_manager.get_room_info(room, refresh)
+
+    async def _occupants(self, room):
+        """Occupants of a room with their JIDs, roles and affiliations."""
+        occupants = self.bot.occupants
+        if not occupants.has_room(room):
+            raise RpcError(INVALID_PARAMS, f"Not in room {room}")
+        result = []
+        for nick in occupants.sorted_nicks(room):
+            occupant = occupants.get(room, nick)
+            result.append({'nick': nick, 'jid': occupant.jid, 'role': occupant.role,
+                           'affiliation': occupant.affiliation})
+        return result
+
+    async def _user_rooms(self, nick=None, jid=None):
+        """Rooms where a nick or a real bare JID is present."""
+        if (nick is None) == (jid is None):
+            raise RpcError(INVALID_PARAMS, "Give exactly one of nick or jid")
+        conference = self.bot.conference_manager
+        rooms = conference.get_user_rooms(nick) if nick else conference.get_jid_rooms(jid)
+        return sorted(rooms)
+
+    async def _jobs_list(self):
+        """Scheduled jobs ordered by next run."""
+        return self.bot.scheduler.list_jobs()
+
+    async def _jobs_get(self, job_id):
+        """One scheduled job."""
+        job = self.bot.scheduler.get_job(job_id)
+        if job is None:
+            raise RpcError(INVALID_PARAMS, f"No job {job_id}")
+        return job
+
+    async def _jobs_types(self):
+        """Job types that jobs.schedule accepts."""
+        return sorted(self.bot.scheduler.job_types)
+
+    async def _jobs_schedule(self, job_type, args=(), persist=False, misfire=None, name=None, **when):
+        """
+        Schedule a registered job type; exactly one of delay (seconds), at (ISO
+        time or timestamp), interval (seconds), daily ("HH:MM") or cron.
+        """
+        # Only named job types: arbitrary callables cannot cross the socket
+        if job_type not in self.bot.scheduler.job_types:
+            raise RpcError(INVALID_PARAMS, f"Unknown job type: {job_type!r}")
+        unknown = set(when) - set(SCHEDULE_KINDS)
+        if unknown or len(when) != 1:
+            raise RpcError(INVALID_PARAMS, f"Give exactly one of {', '.join(SCHEDULE_KINDS)}")
+        (kind, value), = when.items()
+        scheduler = self.bot.scheduler
+        options = {'name': name, 'persist': persist, 'misfire': misfire}
+        if kind == 'delay':
+            job_id = scheduler.schedule_once(job_type, float(value), *args, **options)
+        elif kind == 'at':
+            at = datetime.fromisoformat(value) if isinstance(value, str) else float(value)
+            if isinstance(at, datetime) and at.tzinfo is None:
+                at = self.bot.timezone.localize(at)
+            job_id = scheduler.schedule_at(job_type, at, *args, **options)
+        elif kind == 'interval':
+            job_id = scheduler.schedule_interval(job_type, float(value), *args, **options)
+        elif kind == 'daily':
+            hour, _, minute = str(value).partition(':')
+            job_id = scheduler.schedule_daily(job_type, int(hour), int(minute or 0), *args, **options)
+        else:
+            job_id = scheduler.schedule_cron(job_type, value, *args, **options)
+        return scheduler.get_job(job_id)
+
+    async def _jobs_cancel(self, job_id):
+        """Cancel a job; false if it does not exist."""
+        return self.bot.scheduler.cancel(job_id)
+
+    # Shard coordinator
+
+    async def _cluster_status(self):
+        """Room, user and queue counts over all shards."""
+        stats = await self.coordinator.cluster_stats()
+        return {
+            'shards': len(stats),
+            'rooms': sum(len(shard['rooms']) for shard in stats),
+            'users': sum(shard['users'] for shard in stats),
+            'outbound_depth': sum(shard['outbound_depth'] for shard in stats),
+            'per_shard': [{key: value for key, value in shard.items() if key != 'rooms'}
+                          for shard in stats],
+        }
+
+    async def _cluster_rooms(self):
+        """Rooms of all shards with the shard that owns each."""
+        stats = await self.coordinator.cluster_stats()
+        return sorted(({'room': room, 'shard': shard['shard']}
+                       for shard in stats for room in shard['rooms']),
+                      key=lambda entry: entry['room'])
+
+    async def _cluster_broadcast(self, message):
+        """Broadcast a message through every live shard."""
+        return {'shards': self.coordinator.broadcast(message)}
+
+    async def _cluster_send(self, room, message):
+        """Send a message through the shard that owns a room."""
+        return self.coordinator.send_room_message(room, message)
+
+    async def _cluster_join(self, room):
+        """Join a room through the shard it hashes to."""
+        return self.coordinator.join_room(room)
+
+    async def _cluster_leave(self, room):
+        """Leave a room."""
+        return self.coordinator.leave_room(room)
@@ -0,0 +1,116 @@
+"""
+Concurrent command dispatch for the Jabber bot.
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+
+class CommandDispatcher:
+    """
+    Runs commands as tasks so a slow command does not hold up other stanzas.
+
+    Commands from the same conversation (room and sender, or full JID for
+    private chats) run one at a time in arrival order, while different
+    conversations run concurrently up to a global limit.
+    """
+
+    def __init__(self, bot):
+        """Initialize command dispatcher with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        # Configuration
+        self.max_concurrent = self.bot.config.getint('commands', 'max_concurrent', fallback=20)
+        self.default_timeout = self.bot.config.getfloat('commands', 'timeout', fallback=10.0)
+        self.max_backlog = self.bot.config.getint('commands', 'max_backlog', fallback=500)
+        self.busy_message = self.bot.config.get(
+            'commands', 'busy_message', fallback="I'm busy right now, please try again in a moment."
+        )
+        self.timeout_message = self.bot.config.get(
+            'commands', 'timeout_message', fallback="Sorry, that command took too long."
+        )
+
+        # Dispatch state
+        self.queues = {}  # conversation key -> deque of pending messages
+        self.workers = {}  # conversation key -> worker task
+        self.backlog = 0
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        # Counters
+        self.counters = {'dispatched': 0, 'completed': 0, 'timed_out': 0, 'shed': 0}
+
+    def get_timeout(self, command):
+        """Get the timeout for a command, falling back to the default."""
+        return self.bot.config.getfloat('commands', f'{command}_timeout', fallback=self.default_timeout)
+
+    def submit(self, msg):
+        """Queue a command message, returning False if it was shed."""
+        if self.backlog >= self.max_backlog:
+            self.counters['shed'] += 1
+            self.logger.warning("Command backlog full (%d), shedding command from %s",
+                                self.backlog, msg['from'])
+            self.bot.outbound.enqueue_stanza(msg.reply(self.busy_message))
+            return False
+
+        key = msg['from'].full
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+        queue.append(msg)
+        self.backlog += 1
+        self.counters['dispatched'] += 1
+
+        if key not in self.workers:
+            self.workers[key] = asyncio.create_task(self._run_conversation(key))
+        return True
+
+    async def _run_conversation(self, key):
+        """Run queued commands for one conversation in order."""
+        queue = self.queues[key]
+        try:
+            while queue:
+                msg = queue.popleft()
+                try:
+                    async with self._semaphore:
+                        await self._run_command(msg)
+                finally:
+                    self.backlog -= 1
+        finally:
+            del self.workers[key]
+            if queue:
+                # Cancelled with commands still queued; drop them
+                self.backlog -= len(queue)
+            del self.queues[key]
+
+    async def _run_command(self, msg):
+        """Run a single command under its timeout."""
+        command, _ = self.bot.command_handler.parse_command(msg['body'])
+        timeout = self.get_timeout(command) if command else self.default_timeout
+        try:
+            await asyncio.wait_for(self.bot.command_handler.handle_command(msg), timeout)
+            self.counters['completed'] += 1
+        except asyncio.TimeoutError:
+            self.counters['timed_out'] += 1
+            self.logger.warning("Command %s from %s timed out after %.1fs",
+                                command, msg['from'], timeout)
+            self.bot.outbound.enqueue_stanza(msg.reply(self.timeout_message))
+
+    async def stop(self):
+        """Cancel all running and queued commands."""
+        workers = list(self.workers.values())
+        for task in workers:
+            task.cancel()
+        for task in workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def get_stats(self):
+        """Get dispatcher counters and current backlog."""
+        stats = dict(self.counters)
+        stats['backlog'] = self.backlog
+        stats['conversations'] = len(self.workers)
+        return stats
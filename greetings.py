@@ -0,0 +1,109 @@
+"""
+Greeting coalescing for the Jabber bot.
+"""
+
+import asyncio
+import logging
+
+from outbound import PRIORITY_GREETING
+
+
+class GreetingCoalescer:
+    """
+    Batches greetings for users joining a room in quick succession.
+
+    Nicks seen within the coalescing window are greeted with a single message,
+    and the occupant list received while the bot itself is joining a room is
+    not greeted at all. After a restart with a saved snapshot of the room,
+    only the nicks in that list that were not there before are greeted.
+    """
+
+    def __init__(self, bot):
+        """Initialize greeting coalescer with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        # Configuration
+        self.greeting = self.bot.config.get(
+            'messages', 'greeting', fallback='Hello {nick}! Welcome to the conference!'
+        )
+        self.greeting_multiple = self.bot.config.get(
+            'messages', 'greeting_multiple', fallback='Hello {nicks}! Welcome to the conference!'
+        )
+        self.window = self.bot.config.getfloat('messages', 'greeting_window', fallback=3.0)
+        self.max_names = self.bot.config.getint('messages', 'greeting_max_names', fallback=5)
+        self.greet_initial_occupants = self.bot.config.getboolean(
+            'messages', 'greet_initial_occupants', fallback=False
+        )
+
+        # Rooms whose initial occupant list is still arriving
+        self.joining = set()
+
+        # Nicks waiting to be greeted and the timers that will flush them
+        self.pending = {}
+        self.timers = {}
+
+    def room_joining(self, room):
+        """Mark a room as joining so its initial occupants are not greeted."""
+        if not self.greet_initial_occupants:
+            self.joining.add(room)
+
+    def room_joined(self, room):
+        """Mark the end of the initial occupant list for a room."""
+        self.joining.discard(room)
+
+    def room_left(self, room):
+        """Forget pending greetings for a room the bot has left."""
+        self.joining.discard(room)
+        self.pending.pop(room, None)
+        timer = self.timers.pop(room, None)
+        if timer:
+            timer.cancel()
+
+    def add(self, room, nick):
+        """Queue a greeting for a newly seen nick."""
+        # After a restart, the saved occupant list tells who is genuinely new
+        known = self.bot.snapshot.was_present(room, nick)
+        if known:
+            self.logger.debug("Not greeting %s in %s, present before the restart", nick, room)
+            return
+        if room in self.joining and known is None:
+            self.logger.debug("Not greeting initial occupant %s in %s", nick, room)
+            return
+
+        nicks = self.pending.setdefault(room, [])
+        nicks.append(nick)
+
+        if room not in self.timers:
+            loop = asyncio.get_running_loop()
+            self.timers[room] = loop.call_later(self.window, self.flush, room)
+
+    def discard(self, room, nick):
+        """Drop a pending greeting for a user who already left."""
+        nicks = self.pending.get(room)
+        if nicks and nick in nicks:
+            nicks.remove(nick)
+
+    def flush(self, room):
+        """Send the coalesced greeting for a room."""
+        self.timers.pop(room, None)
+        nicks = self.pending.pop(room, None)
+        if not nicks:
+            return
+
+        with self.bot.metrics.greeting_fanout.time():
+            greeting = self.format_greeting(room, nicks)
+            self.bot.outbound.enqueue(room, greeting, priority=PRIORITY_GREETING)
+        self.logger.info("Queued greeting for %d users in %s", len(nicks), room)
+
+    def format_greeting(self, room, nicks):
+        """Build a greeting message for one or more nicks."""
+        if len(nicks) == 1:
+            return self.greeting.format(nick=nicks[0], room=room)
+
+        if len(nicks) > self.max_names:
+            shown = ", ".join(nicks[:self.max_names])
+            names = f"{shown} and {len(nicks) - self.max_names} others"
+        else:
+            names = ", ".join(nicks[:-1]) + f" and {nicks[-1]}"
+        return self.greeting_multiple.format(nicks=names, room=room, count=len(nicks))
@@ -0,0 +1,124 @@
+"""
+Room history policy for MUC joins.
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+
+POLICIES = ('none', 'maxstanzas', 'since')
+
+
+class JoinHistory:
+    """
+    Decides how much room history to request when joining a room.
+
+    The policy is 'none' (no history at all), 'maxstanzas' (the last N
+    messages) or 'since' (only what was sent after the bot last saw the room).
+    It can be set globally, per room in the [history] section, or at runtime
+    with configure_room(room, history=...). For 'since', the time the bot last
+    saw each room is kept in memory and periodically written to a JSON file so
+    it survives restarts.
+    """
+
+    def __init__(self, bot):
+        """Initialize join history handling with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        config = self.bot.config
+        self.default_policy = self._parse(config.get('history', 'policy', fallback='none'))
+        self.default_maxstanzas = config.getint('history', 'maxstanzas', fallback=20)
+        self.path = config.get('history', 'last_seen_file', fallback='')
+        self.flush_interval = config.getfloat('history', 'flush_interval', fallback=60.0)
+
+        # Per-room policies from the config file, keyed by room JID
+        self.room_policies = {}
+        if config.has_section('history'):
+            for key, value in config.items('history'):
+                if '@' in key:
+                    self.room_policies[key] = self._parse(value)
+
+        # room -> unix time the bot last saw the room
+        self.last_seen = self._load()
+        self._dirty = False
+        self.flush_job = None
+
+    def _parse(self, value):
+        """Parse 'none', 'since', 'maxstanzas' or 'maxstanzas:N' into (policy, count)."""
+        policy, _, count = value.strip().lower().partition(':')
+        if policy not in POLICIES:
+            self.logger.warning("Unknown history policy %r, using 'none'", value)
+            return 'none', None
+        return policy, int(count) if count else None
+
+    def _load(self):
+        """Load last-seen times from the file, if any."""
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as handle:
+                return {room: float(stamp) for room, stamp in json.load(handle).items()}
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Could not load last-seen times from {self.path}: {e}")
+            return {}
+
+    def start(self):
+        """Schedule periodic saving of last-seen times."""
+        if self.path and self.flush_job is None:
+            self.flush_job = self.bot.scheduler.schedule_interval(
+                self.flush, self.flush_interval, name='history_flush'
+            )
+
+    def policy(self, room_jid):
+        """Get the (policy, count) that applies to a room."""
+        setting = self.bot.conference_manager.get_room_setting(room_jid, 'history')
+        if setting:
+            return self._parse(setting)
+        return self.room_policies.get(room_jid.lower(), self.default_policy)
+
+    def join_args(self, room_jid):
+        """Get the history keyword arguments for join_muc_wait."""
+        policy, count = self.policy(room_jid)
+        if policy == 'maxstanzas':
+            return {'maxstanzas': self.default_maxstanzas if count is None else count}
+        if policy == 'since' and room_jid in self.last_seen:
+            since = datetime.fromtimestamp(self.last_seen[room_jid], timezone.utc)
+            return {'since': since}
+        # No history; for 'since' this is a room we have never seen
+        return {'maxchars': 0}
+
+    def seen(self, room_jid, stamp=None):
+        """Record that the bot saw a room's traffic up to stamp (default now)."""
+        stamp = time.time() if stamp is None else stamp
+        if stamp > self.last_seen.get(room_jid, 0):
+            self.last_seen[room_jid] = stamp
+            self._dirty = True
+
+    def is_replay(self, room_jid, stamp):
+        """Check whether a delayed message is one the bot has already seen."""
+        return stamp <= self.last_seen.get(room_jid, 0)
+
+    def mark_present(self):
+        """Record every joined room as seen now, since the bot is in them."""
+        now = time.time()
+        for room in self.bot.occupants.rooms():
+            self.seen(room, now)
+
+    def flush(self):
+        """Write last-seen times to the file if they changed."""
+        if self.bot.is_connected():
+            self.mark_present()
+        if not self.path or not self._dirty:
+            return
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as handle:
+                json.dump(self.last_seen, handle)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            self.logger.error(f"Could not save last-seen times to {self.path}: {e}")
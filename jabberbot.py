@@ -6,6 +6,7 @@ import logging
 import configparser
 import asyncio
 import os
+import random
 from datetime import datetime
 import pytz
 
@@ -15,6 +16,18 @@ from slixmpp.exceptions import IqError, IqTimeout
 from commands import CommandHandler
 from conference import ConferenceManager
 from scheduler import TaskScheduler
+from outbound import OutboundQueue, PRIORITY_ANNOUNCEMENT
+from greetings import GreetingCoalescer
+from dispatcher import CommandDispatcher
+from occupants import OccupantStore
+from metrics import BotMetrics
+from history import JoinHistory
+from archive import MessageArchive
+from capscache import EntityCaps
+from autoresponder import AutoResponder
+from snapshot import StateSnapshot
+from profiler import Profiler
+from connection import ConnectionManager
 
 
 class JabberBot(slixmpp.ClientXMPP):
@@ -37,29 +50,74 @@ class JabberBot(slixmpp.ClientXMPP):
         self.register_plugin('xep_0030')  # Service Discovery
         self.register_plugin('xep_0045')  # Multi-User Chat
         self.register_plugin('xep_0199')  # XMPP Ping
+        if self.config.getboolean('bot', 'stream_management', fallback=True):
+            self.register_plugin('xep_0198')  # Stream Management, for resuming after a drop
+        
+        # Metrics are created first since every component reports to them
+        self.metrics = BotMetrics(self)
+        self.add_filter('in', self.metrics.count_in)
+        self.add_filter('out', self.metrics.count_out)
+        
+        # Server address, TLS mode, address cache and connect timing from [server]
+        self.connection = ConnectionManager(self)
         
         # Initialize components
+        self.outbound = OutboundQueue(self)
+        self.greeter = GreetingCoalescer(self)
         self.command_handler = CommandHandler(self)
+        self.dispatcher = CommandDispatcher(self)
         self.conference_manager = ConferenceManager(self)
         self.scheduler = TaskScheduler(self)
+        self.scheduler.register_job_type('room_message', self.conference_manager.send_room_message)
+        self.history = JoinHistory(self)
+        self.history.start()
+        self.archive = MessageArchive(self)
+        self.caps = EntityCaps(self)
+        self.caps.start()
+        self.responder = AutoResponder(self)
         
         # Bot configuration
         self.nick = self.config.get('bot', 'nickname', fallback='JabberBot')
         self.timezone = pytz.timezone(self.config.get('bot', 'timezone', fallback='UTC'))
-        self.greeting_message = self.config.get('messages', 'greeting', 
-                                              fallback='Hello {nick}! Welcome to the conference!')
         
         # Conference rooms to join
         self.auto_join_rooms = self._parse_rooms()
         
+        # On-demand profiling; handlers report their wall time to it
+        self.profiler = Profiler(self)
+        
         # Set up event handlers
         self._setup_event_handlers()
         
         # Track connected users per room
-        self.room_users = {}
+        self.occupants = OccupantStore()
+        
+        # Rooms, occupants and room settings saved across restarts
+        self.snapshot = StateSnapshot(self)
+        self.snapshot.start()
+        
+        # Rooms whose MUC presence handlers are registered; every room shares the same wrappers
+        self._room_handlers = set()
+        self._timed_room_handlers = {
+            'joined': self.profiler.timed(self._muc_user_joined),
+            'left': self.profiler.timed(self._muc_user_left),
+            'presence': self.profiler.timed(self._muc_presence),
+            'self-presence': self.profiler.timed(self._muc_self_presence),
+        }
+        
+        # Link to the shard coordinator when running as one of several connections
+        self.shard = None
+        
+        # Reconnect backoff
+        self.reconnect_delay = self.config.getfloat('bot', 'reconnect_delay', fallback=1.0)
+        self.reconnect_max_delay = self.config.getfloat('bot', 'reconnect_max_delay', fallback=300.0)
+        self._reconnect_attempts = 0
+        self._closing = False
         
     def _load_config(self, config_file):
-        """Load configuration from file."""
+        """Load configuration from file, or use an already loaded configuration."""
+        if isinstance(config_file, configparser.ConfigParser):
+            return config_file
         config = configparser.ConfigParser()
         try:
             config.read(config_file)
@@ -83,61 +141,117 @@ class JabberBot(slixmpp.ClientXMPP):
     
     def _setup_event_handlers(self):
         """Set up XMPP event handlers."""
-        self.add_event_handler('session_start', self._session_start)
-        self.add_event_handler('message', self._message_received)
-        self.add_event_handler('groupchat_message', self._groupchat_message)
-        self.add_event_handler('muc::*::got_online', self._muc_user_joined)
-        self.add_event_handler('muc::*::got_offline', self._muc_user_left)
-        self.add_event_handler('disconnected', self._disconnected)
+        timed = self.profiler.timed
+        self.add_event_handler('session_start', timed(self._session_start))
+        self.add_event_handler('session_resumed', timed(self._session_resumed))
+        self.add_event_handler('message', timed(self._message_received))
+        self.add_event_handler('groupchat_message', timed(self._groupchat_message))
+        self.add_event_handler('disconnected', timed(self._disconnected))
+    
+    async def get_dns_records(self, domain, port=None):
+        """Resolve the server through the connection manager's address cache."""
+        return await self.connection.resolve(domain, port, super().get_dns_records)
+    
+    async def _attempt_connection(self, host, port, tls, server_hostname):
+        """Connect to one server, racing its addresses."""
+        return await self.connection.attempt(host, port, tls, server_hostname)
+    
+    def register_room_handlers(self, room_jid):
+        """Set up MUC presence handlers for a room, since MUC events are per room."""
+        if room_jid in self._room_handlers:
+            return
+        self._room_handlers.add(room_jid)
+        timed = self._timed_room_handlers
+        self.add_event_handler(f'muc::{room_jid}::got_online', timed['joined'])
+        self.add_event_handler(f'muc::{room_jid}::got_offline', timed['left'])
+        self.add_event_handler(f'muc::{room_jid}::presence', timed['presence'])
+        self.add_event_handler(f'muc::{room_jid}::self-presence', timed['self-presence'])
         
     async def _session_start(self, event):
-        """Handle session start event."""
+        """Handle the start of a new session, first or after a failed resume."""
         self.logger.info("Bot session started")
+        self._reconnect_attempts = 0
+        
+        # Rooms still tracked belong to a previous session the server has
+        # forgotten; rejoin them along with the configured ones
+        rooms = list(self.auto_join_rooms)
+        for room in self.snapshot.rejoin_rooms():
+            if room not in rooms:
+                rooms.append(room)
+        if self.occupants.room_count():
+            previous = self.occupants.rooms()
+            self.logger.info("New session, rejoining %d rooms from the previous one", len(previous))
+            for room in previous:
+                self.greeter.room_left(room)
+                if room not in rooms:
+                    rooms.append(room)
+            self.occupants.clear()
+            self.command_handler.invalidate_rooms()
         
         # Send initial presence
         self.send_presence()
         await self.get_roster()
         
-        # Join auto-join rooms
-        for room in self.auto_join_rooms:
-            await self._join_room(room)
-            
-        # Start the task scheduler
-        await self.scheduler.start()
+        # Join rooms before releasing queued messages, which may be addressed to them
+        await self.conference_manager.join_rooms(rooms)
+        self.outbound.start()
+        self.archive.start()
+        
+        # Start the task scheduler; it keeps running across reconnects
+        if not self.scheduler.running:
+            await self.scheduler.start()
+    
+    async def _session_resumed(self, event):
+        """Handle a resumed session; rooms and occupants are still valid."""
+        self.logger.info("Bot session resumed")
+        self._reconnect_attempts = 0
+        self.outbound.start()
         
     async def _join_room(self, room_jid):
         """Join a conference room."""
-        try:
-            self.plugin['xep_0045'].join_muc(room_jid, self.nick)
-            self.logger.info(f"Joined room: {room_jid}")
-            self.room_users[room_jid] = set()
-        except Exception as e:
-            self.logger.error(f"Failed to join room {room_jid}: {e}")
+        return await self.conference_manager.join_room(room_jid)
     
     async def _message_received(self, msg):
         """Handle private messages."""
         if msg['type'] in ('chat', 'normal'):
-            self.logger.info(f"Private message from {msg['from']}: {msg['body']}")
+            self.logger.info("Private message from %s: %s", msg['from'], msg['body'])
             
             # Handle commands in private messages
             if msg['body'].startswith('!'):
-                await self.command_handler.handle_command(msg)
+                self.dispatcher.submit(msg)
             else:
                 # Simple echo response for non-command messages
                 reply = f"You said: {msg['body']}"
-                msg.reply(reply).send()
+                self.outbound.enqueue_stanza(msg.reply(reply))
     
     async def _groupchat_message(self, msg):
         """Handle group chat messages."""
+        room = msg['from'].bare
+        
+        # Room history sent on join is only archived and advances the last-seen time
+        delay = msg.get_plugin('delay', check=True)
+        if delay is not None and delay['stamp']:
+            stamp = delay['stamp'].timestamp()
+            if not self.history.is_replay(room, stamp):
+                self.history.seen(room, stamp)
+                if msg['mucnick'] != self.nick:
+                    self.archive.append(room, msg['mucnick'], msg['body'], stamp)
+            return
+        self.history.seen(room)
+        
         # Ignore messages from the bot itself
         if msg['mucnick'] == self.nick:
             return
+        
+        self.archive.append(room, msg['mucnick'], msg['body'])
             
-        self.logger.debug(f"Group message in {msg['from'].bare}: <{msg['mucnick']}> {msg['body']}")
+        self.logger.debug("Group message in %s: <%s> %s", room, msg['mucnick'], msg['body'])
         
-        # Handle commands in group chat
+        # Handle commands in group chat; anything else may match a trigger
         if msg['body'].startswith('!'):
-            await self.command_handler.handle_command(msg)
+            self.dispatcher.submit(msg)
+        elif self.responder.enabled:
+            self.responder.handle(msg)
     
     async def _muc_user_joined(self, presence):
         """Handle user joining a conference room."""
@@ -148,20 +262,32 @@ class JabberBot(slixmpp.ClientXMPP):
         if nick == self.nick:
             return
             
-        self.logger.info(f"User {nick} joined room {room}")
+        self.logger.info("User %s joined room %s", nick, room)
         
-        # Track user in room
-        if room not in self.room_users:
-            self.room_users[room] = set()
-        
-        # Check if this is a new user (not just a presence update)
-        if nick not in self.room_users[room]:
-            self.room_users[room].add(nick)
+        # Track user in room; add() is False for a presence update of a known nick
+        item = presence['muc']
+        real_jid = item['jid'].bare if item['jid'] else None
+        if self.occupants.add(room, nick, real_jid, item['role'], item['affiliation']):
+            self.command_handler.invalidate_room_users(room)
             
-            # Send greeting message
-            greeting = self.greeting_message.format(nick=nick, room=room)
-            self.send_message(mto=room, mbody=greeting, mtype='groupchat')
-            self.logger.info(f"Sent greeting to {nick} in {room}")
+            # Greetings are batched per room by the coalescer
+            self.greeter.add(room, nick)
+    
+    async def _muc_presence(self, presence):
+        """Record role and affiliation changes of known occupants."""
+        if presence['type'] == 'unavailable':
+            return
+        item = presence['muc']
+        real_jid = item['jid'].bare if item['jid'] else None
+        self.occupants.update(presence['from'].bare, presence['from'].resource,
+                              real_jid, item['role'], item['affiliation'])
+    
+    async def _muc_self_presence(self, presence):
+        """Handle our own presence in a room, which ends the initial occupant list."""
+        room = presence['from'].bare
+        self.greeter.room_joined(room)
+        self.snapshot.room_joined(room)
+        self.logger.debug("Initial occupant list complete for %s", room)
     
     async def _muc_user_left(self, presence):
         """Handle user leaving a conference room."""
@@ -171,24 +297,45 @@ class JabberBot(slixmpp.ClientXMPP):
         if nick == self.nick:
             return
             
-        self.logger.info(f"User {nick} left room {room}")
+        self.logger.info("User %s left room %s", nick, room)
         
         # Remove user from tracking
-        if room in self.room_users and nick in self.room_users[room]:
-            self.room_users[room].remove(nick)
+        if self.occupants.remove(room, nick):
+            self.command_handler.invalidate_room_users(room)
+        self.greeter.discard(room, nick)
+        self.caps.forget(presence['from'])
     
     async def _disconnected(self, event):
-        """Handle disconnection event."""
-        self.logger.warning("Bot disconnected from server")
+        """Handle disconnection by reconnecting with exponential backoff."""
+        if self._closing:
+            return
+        self.logger.warning("Bot disconnected from server: %s", event)
         
-        # Stop scheduler
-        await self.scheduler.stop()
+        # Everything up to now was seen; a rejoin only needs history from here on
+        self.history.mark_present()
         
-        # Attempt to reconnect after a delay
-        await asyncio.sleep(5)
-        self.logger.info("Attempting to reconnect...")
-        if not self.connect():
-            self.logger.error("Failed to reconnect")
+        # Hold queued stanzas until the session is resumed or restarted
+        await self.outbound.stop()
+        
+        delay = min(self.reconnect_max_delay, self.reconnect_delay * 2 ** self._reconnect_attempts)
+        delay *= random.uniform(0.5, 1.5)
+        self._reconnect_attempts += 1
+        self.logger.info("Reconnecting in %.1fs (attempt %d)", delay, self._reconnect_attempts)
+        await asyncio.sleep(delay)
+        
+        if not self._closing:
+            host, port = self.custom_address or (None, None)
+            self.connect(host, port)
+    
+    def close(self):
+        """Disconnect for good, without reconnecting."""
+        self._closing = True
+        self.profiler.cancel()
+        self.history.flush()
+        self.caps.flush()
+        self.snapshot.close()
+        self.archive.close()
+        return self.disconnect()
     
     def send_hourly_announcement(self):
         """Send hourly time announcements to all joined rooms."""
@@ -196,17 +343,17 @@ class JabberBot(slixmpp.ClientXMPP):
         time_str = now.strftime("%H:%M %Z")
         message = f"🕐 Current time: {time_str}"
         
-        for room in self.room_users.keys():
-            try:
-                self.send_message(mto=room, mbody=message, mtype='groupchat')
-                self.logger.debug(f"Sent hourly announcement to {room}")
-            except Exception as e:
-                self.logger.error(f"Failed to send hourly announcement to {room}: {e}")
+        with self.metrics.announcement_fanout.time():
+            for room in self.occupants.rooms():
+                if self.outbound.enqueue(room, message, priority=PRIORITY_ANNOUNCEMENT):
+                    self.logger.debug("Queued hourly announcement to %s", room)
+                else:
+                    self.logger.error("Failed to queue hourly announcement to %s", room)
     
     def get_connected_rooms(self):
         """Get list of currently connected rooms."""
-        return list(self.room_users.keys())
+        return self.occupants.rooms()
     
     def get_room_users(self, room):
         """Get list of users in a specific room."""
-        return list(self.room_users.get(room, []))
+        return self.occupants.nicks(room)
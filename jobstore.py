@@ -0,0 +1,135 @@
+"""
+SQLite-backed persistent store for scheduled jobs.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    job_type TEXT NOT NULL,
+    args TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    next_run REAL NOT NULL,
+    interval REAL,
+    hour INTEGER,
+    minute INTEGER,
+    cron TEXT,
+    misfire TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_next_run ON jobs (next_run);
+"""
+
+COLUMNS = ('id', 'job_type', 'args', 'kind', 'next_run', 'interval',
+           'hour', 'minute', 'cron', 'misfire')
+
+
+class JobStore:
+    """
+    Persists scheduled jobs in SQLite.
+
+    Writes are buffered in memory and applied in one transaction by flush(),
+    which the scheduler runs periodically in a worker thread. Reads use the
+    next_run index so only jobs due within a horizon need to be loaded.
+    """
+
+    def __init__(self, path):
+        """Open (or create) the job database at path."""
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+        # Pending writes: job id -> row tuple, or None for a delete
+        self._pending = {}
+
+    def save(self, row):
+        """Buffer an insert or update of a job row (a dict with COLUMNS keys)."""
+        values = tuple(row[column] for column in COLUMNS)
+        values = values[:2] + (json.dumps(row['args']),) + values[3:]
+        with self._lock:
+            self._pending[row['id']] = values
+
+    def delete(self, job_id):
+        """Buffer the removal of a job."""
+        with self._lock:
+            self._pending[job_id] = None
+
+    def has_pending(self):
+        """Check whether there are buffered writes."""
+        return bool(self._pending)
+
+    def flush(self):
+        """Apply all buffered writes in a single transaction."""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            upserts = [values for values in pending.values() if values is not None]
+            deletes = [(job_id,) for job_id, values in pending.items() if values is None]
+            placeholders = ', '.join('?' for _ in COLUMNS)
+            with self._conn:
+                if deletes:
+                    self._conn.executemany("DELETE FROM jobs WHERE id = ?", deletes)
+                if upserts:
+                    self._conn.executemany(
+                        f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                        upserts
+                    )
+        self.logger.debug("Flushed %d job updates and %d deletes", len(upserts), len(deletes))
+        return len(pending)
+
+    def load_between(self, after, until):
+        """Load jobs with after < next_run <= until; after may be None for no lower bound."""
+        with self._lock:
+            if after is None:
+                cursor = self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE next_run <= ? ORDER BY next_run",
+                    (until,)
+                )
+            else:
+                cursor = self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE next_run > ? AND next_run <= ? "
+                    "ORDER BY next_run",
+                    (after, until)
+                )
+            rows = cursor.fetchall()
+
+        jobs = []
+        for values in rows:
+            row = dict(zip(COLUMNS, values))
+            row['args'] = json.loads(row['args'])
+            jobs.append(row)
+        return jobs
+
+    def exists(self, job_id):
+        """Check whether a job is stored, taking buffered writes into account."""
+        with self._lock:
+            if job_id in self._pending:
+                return self._pending[job_id] is not None
+            cursor = self._conn.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,))
+            return cursor.fetchone() is not None
+
+    def max_id(self):
+        """Get the highest stored job id, or 0 if there are none."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT MAX(id) FROM jobs")
+            value = cursor.fetchone()[0]
+        return value or 0
+
+    def count(self):
+        """Get the number of stored jobs."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self):
+        """Flush buffered writes and close the database."""
+        self.flush()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,108 @@
+"""
+Queue-based logging that keeps formatting and I/O off the event loop.
+"""
+
+import copy
+import logging
+import logging.handlers
+import queue
+
+
+_exception_formatter = logging.Formatter()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks the caller.
+
+    Records go into a bounded queue with only their message rendered; the
+    QueueListener thread applies the formatters and does the writing. When the queue is full the record is dropped
+    and counted, and a warning with the number of dropped records is queued
+    once there is room again.
+    """
+
+    def __init__(self, log_queue):
+        """Initialize the handler with a bounded queue."""
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record):
+        """
+        Render the message and traceback while the arguments still hold their values.
+
+        As in the standard handler, args and exc_info are cleared so the
+        listener thread never touches the caller's objects.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # The listener's formatters append exc_text as they would the traceback
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        """Put a record on the queue without blocking, dropping it if the queue is full."""
+        if self._unreported:
+            notice = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                "Dropped %d log records because the log queue was full",
+                (self._unreported,), None
+            )
+            try:
+                self.queue.put_nowait(notice)
+                self._unreported = 0
+            except queue.Full:
+                pass
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """Queue listener whose stop() waits for room in a full queue instead of failing."""
+
+    def enqueue_sentinel(self):
+        """Block until the stop sentinel fits, so every queued record is written."""
+        self.queue.put(self._sentinel)
+
+
+def build_file_handler(path, rotate='size', max_bytes=10 * 1024 * 1024,
+                       backup_count=5, when='midnight'):
+    """Create a file handler with size-based, time-based or no rotation."""
+    if rotate == 'size':
+        return logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+    if rotate == 'time':
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding='utf-8'
+        )
+    return logging.FileHandler(path, encoding='utf-8')
+
+
+def start_queue_logging(handlers, level, queue_size=10000):
+    """
+    Route root logger output through a bounded queue to the given handlers.
+
+    Returns the (queue handler, listener) pair; call listener.stop() on exit
+    to flush the remaining records.
+    """
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    listener = DrainingQueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener.start()
+    return queue_handler, listener
@@ -5,22 +5,52 @@ Main entry point for the Jabber/XMPP bot.
 
 import argparse
 import asyncio
+import configparser
 import logging
 import signal
 import sys
 from jabberbot import JabberBot
+from logqueue import build_file_handler, start_queue_logging
+from control import ControlServer
+from metrics import LoopLagMonitor, MetricsServer
+from sharding import ShardCoordinator
 
-def setup_logging(debug=False):
-    """Setup logging configuration."""
-    level = logging.DEBUG if debug else logging.INFO
-    logging.basicConfig(
-        level=level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('jabberbot.log'),
-            logging.StreamHandler(sys.stdout)
-        ]
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def setup_logging(debug=False, config=None):
+    """
+    Setup logging configuration.
+    
+    By default records are handed to a background thread through a bounded
+    queue, so log calls never block the event loop on disk or console I/O.
+    Returns the queue listener to stop on exit, or None in synchronous mode.
+    """
+    if config is None:
+        config = configparser.ConfigParser()
+    
+    level_name = config.get('logging', 'level', fallback='INFO').upper()
+    level = logging.DEBUG if debug else getattr(logging, level_name, logging.INFO)
+    
+    file_handler = build_file_handler(
+        config.get('logging', 'file', fallback='jabberbot.log'),
+        rotate=config.get('logging', 'rotate', fallback='size'),
+        max_bytes=config.getint('logging', 'max_bytes', fallback=10 * 1024 * 1024),
+        backup_count=config.getint('logging', 'backup_count', fallback=5),
+        when=config.get('logging', 'when', fallback='midnight'),
+    )
+    handlers = [file_handler, logging.StreamHandler(sys.stdout)]
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    if not config.getboolean('logging', 'queue', fallback=True):
+        logging.basicConfig(level=level, handlers=handlers)
+        return None
+    
+    _, listener = start_queue_logging(
+        handlers, level, config.getint('logging', 'queue_size', fallback=10000)
     )
+    return listener
 
 async def main_async():
     """Async main function to run the Jabber bot."""
@@ -29,31 +59,78 @@ async def main_async():
                        help='Configuration file path (default: config.ini)')
     parser.add_argument('-d', '--debug', action='store_true',
                        help='Enable debug logging')
+    parser.add_argument('-s', '--shards', type=int, default=None,
+                       help='Run N bot connections in worker processes (default: [sharding] shards or 1)')
     
     args = parser.parse_args()
     
     # Setup logging
-    setup_logging(args.debug)
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    log_listener = setup_logging(args.debug, config)
     logger = logging.getLogger(__name__)
     
+    shards = args.shards if args.shards is not None else config.getint('sharding', 'shards', fallback=1)
+    
     bot = None
+    coordinator = None
+    metrics_server = None
+    lag_monitor = None
+    control_server = None
     shutdown_event = asyncio.Event()
     
     def signal_handler():
         logger.info("Received shutdown signal")
         shutdown_event.set()
     
+    def profile_handler():
+        logger.info("Received SIGUSR1, starting a profile")
+        if coordinator:
+            coordinator.profile()
+        elif bot:
+            bot.profiler.trigger(on_done=logger.info)
+    
     # Setup signal handlers for graceful shutdown
     for sig in [signal.SIGTERM, signal.SIGINT]:
         asyncio.get_event_loop().add_signal_handler(sig, signal_handler)
+    asyncio.get_event_loop().add_signal_handler(signal.SIGUSR1, profile_handler)
     
     try:
+        if shards > 1:
+            # Each shard is a full bot in its own process; this process only coordinates
+            coordinator = ShardCoordinator(args.config, shards, args.debug)
+            logger.info("Starting Jabber bot with %d shards...", shards)
+            await coordinator.start()
+            if config.getboolean('control', 'enabled', fallback=False):
+                control_server = ControlServer(config, coordinator=coordinator)
+                await control_server.start()
+            await shutdown_event.wait()
+            return
+        
         # Create and run the bot
         bot = JabberBot(args.config)
         logger.info("Starting Jabber bot...")
         
+        # Optional Prometheus endpoint and event loop watchdog
+        if config.getboolean('metrics', 'enabled', fallback=False):
+            metrics_server = MetricsServer(
+                bot.metrics.registry,
+                config.get('metrics', 'host', fallback='127.0.0.1'),
+                config.getint('metrics', 'port', fallback=9100)
+            )
+            await metrics_server.start()
+            lag_monitor = LoopLagMonitor(
+                bot.metrics, config.getfloat('metrics', 'lag_interval', fallback=0.5)
+            )
+            lag_monitor.start()
+        
+        # Optional local JSON-RPC socket for scripts
+        if config.getboolean('control', 'enabled', fallback=False):
+            control_server = ControlServer(config, bot=bot)
+            await control_server.start()
+        
         # Connect and run the bot
-        bot.connect()
+        bot.connect(*bot.connection.address())
         
         # Keep the bot running until shutdown signal
         await shutdown_event.wait()
@@ -65,11 +142,28 @@ async def main_async():
         sys.exit(1)
     finally:
         # Cleanup when stopping
+        if control_server:
+            await control_server.stop()
+        if coordinator:
+            await coordinator.stop()
+            logger.info("All shards stopped")
         if bot:
             if hasattr(bot, 'scheduler') and bot.scheduler:
                 await bot.scheduler.stop()
-            bot.disconnect()
+            if hasattr(bot, 'dispatcher') and bot.dispatcher:
+                await bot.dispatcher.stop()
+            if hasattr(bot, 'outbound') and bot.outbound:
+                await bot.outbound.stop()
+            if hasattr(bot, 'archive') and bot.archive:
+                await bot.archive.stop()
+            bot.close()
             logger.info("Bot shutdown complete")
+        if lag_monitor:
+            await lag_monitor.stop()
+        if metrics_server:
+            await metrics_server.stop()
+        if log_listener:
+            log_listener.stop()
 
 def main():
     """Main function to run the Jabber bot."""
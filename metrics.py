@@ -0,0 +1,349 @@
+"""
+Metrics collection and Prometheus endpoint for the Jabber bot.
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+
+
+# Latency buckets in seconds, from 1ms to 30s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    """Render a Prometheus label set."""
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    """Render a sample value."""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        """Increase the counter for a label combination."""
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        """Get the current value for a label combination."""
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        """Yield (suffix, label string, value) tuples."""
+        for labels, value in self.values.items():
+            yield '_total', _format_labels(self.labelnames, labels), value
+
+
+class Gauge:
+    """A value that can go up and down, or is read from a callback."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.callback = callback
+
+    def set(self, value, *labels):
+        """Set the gauge for a label combination."""
+        self.values[labels] = value
+
+    def get(self, *labels):
+        """Get the current value for a label combination."""
+        if self.callback is not None:
+            return self.callback()
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        """Yield (suffix, label string, value) tuples."""
+        if self.callback is not None:
+            yield '', '', self.callback()
+            return
+        for labels, value in self.values.items():
+            yield '', _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """A histogram with fixed buckets and optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        """Record an observation for a label combination."""
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def time(self, *labels):
+        """Get a context manager that observes the duration of its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        """Yield (suffix, label string, value) tuples with cumulative buckets."""
+        for labels, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield '_bucket', _format_labels(self.labelnames, labels, ('le', _format_value(float(bound)))), cumulative
+            yield '_bucket', _format_labels(self.labelnames, labels, ('le', '+Inf')), state[-1]
+            yield '_sum', _format_labels(self.labelnames, labels), state[-2]
+            yield '_count', _format_labels(self.labelnames, labels), state[-1]
+
+
+class _Timer:
+    """Context manager timing a block into a histogram."""
+
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Holds all metrics and renders them in the Prometheus text format."""
+
+    def __init__(self, prefix='jabberbot'):
+        """Initialize an empty registry."""
+        self.prefix = prefix
+        self.metrics = {}
+
+    def _register(self, metric):
+        """Add a metric, returning the existing one if the name is taken."""
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Create or get a counter."""
+        return self._register(Counter(f'{self.prefix}_{name}', documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        """Create or get a gauge."""
+        return self._register(Gauge(f'{self.prefix}_{name}', documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Create or get a histogram."""
+        return self._register(Histogram(f'{self.prefix}_{name}', documentation, labelnames, buckets))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _log_records_dropped():
+    """Sum the drop counters of queue logging handlers on the root logger."""
+    return sum(getattr(handler, 'dropped', 0) for handler in logging.getLogger().handlers)
+
+
+class BotMetrics:
+    """The metrics collected by the bot and its components."""
+
+    def __init__(self, bot):
+        """Create the bot's metrics."""
+        self.bot = bot
+        self.registry = registry = MetricsRegistry()
+
+        self.stanzas_in = registry.counter(
+            'stanzas_in', 'Stanzas received by kind and type', ('kind', 'type'))
+        self.stanzas_out = registry.counter(
+            'stanzas_out', 'Stanzas sent by kind and type', ('kind', 'type'))
+        self.command_latency = registry.histogram(
+            'command_duration_seconds', 'Command handling time by command', ('command',))
+        self.greeting_fanout = registry.histogram(
+            'greeting_fanout_seconds', 'Time to queue a coalesced greeting')
+        self.announcement_fanout = registry.histogram(
+            'announcement_fanout_seconds', 'Time to queue an announcement to all rooms')
+        self.outbound_wait = registry.histogram(
+            'outbound_wait_seconds', 'Time stanzas spend in the outbound queue', ('priority',),
+            buckets=DEFAULT_BUCKETS + (60.0, 120.0, 300.0))
+        self.join_latency = registry.histogram(
+            'join_duration_seconds', 'Time from join request to self-presence')
+        self.caps_lookups = registry.counter(
+            'caps_lookups', 'Capability lookups: cache hit, miss, or plain disco query', ('result',))
+        self.connect_phases = registry.histogram(
+            'connect_phase_seconds', 'Connection setup time by phase, and in total', ('phase',))
+        self.dns_lookups = registry.counter(
+            'dns_lookups', 'Server lookups answered from the cache, from DNS, or from an expired entry',
+            ('source',))
+        self.tls_handshakes = registry.counter(
+            'tls_handshakes', 'TLS handshakes by whether the previous session was resumed', ('session',))
+        self.loop_lag = registry.histogram(
+            'event_loop_lag_seconds', 'Event loop scheduling delay seen by the watchdog')
+        self.loop_lag_last = registry.gauge(
+            'event_loop_lag_last_seconds', 'Most recent event loop lag sample')
+        registry.gauge('outbound_queue_depth', 'Stanzas waiting in the outbound queue',
+                       callback=lambda: bot.outbound.depth())
+        registry.gauge('rooms', 'Rooms currently joined',
+                       callback=lambda: bot.occupants.room_count())
+        registry.gauge('occupants', 'Occupants tracked across all rooms',
+                       callback=lambda: bot.occupants.count())
+        registry.gauge('outbound_dropped', 'Outbound stanzas dropped since startup',
+                       callback=lambda: bot.outbound.counters['dropped'])
+        registry.gauge('caps_cache_entries', 'Verification strings in the capabilities cache',
+                       callback=lambda: len(bot.caps.store))
+        registry.gauge('log_records_dropped', 'Log records dropped because the log queue was full',
+                       callback=_log_records_dropped)
+
+    def count_in(self, stanza):
+        """Incoming stanza filter counting stanzas by kind and type."""
+        name = getattr(stanza, 'name', None)
+        if name in ('message', 'presence', 'iq'):
+            self.stanzas_in.inc(name, stanza['type'] or 'normal')
+        return stanza
+
+    def count_out(self, stanza):
+        """Outgoing stanza filter counting stanzas by kind and type."""
+        name = getattr(stanza, 'name', None)
+        if name in ('message', 'presence', 'iq'):
+            self.stanzas_out.inc(name, stanza['type'] or 'normal')
+        return stanza
+
+
+class LoopLagMonitor:
+    """Watchdog task measuring how late the event loop wakes it up."""
+
+    def __init__(self, metrics, interval=0.5):
+        """Initialize the watchdog with the bot metrics and a sampling interval."""
+        self.metrics = metrics
+        self.interval = interval
+        self.logger = logging.getLogger(__name__)
+        self._task = None
+
+    def start(self):
+        """Start sampling."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop sampling."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        """Sleep for the interval and record how much longer it actually took."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.metrics.loop_lag.observe(lag)
+            self.metrics.loop_lag_last.set(lag)
+            if lag > 1.0:
+                self.logger.warning("Event loop lagged %.2fs", lag)
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing the registry at /metrics."""
+
+    def __init__(self, registry, host='127.0.0.1', port=9100):
+        """Initialize the server for a registry and listen address."""
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger(__name__)
+        self._server = None
+
+    async def start(self):
+        """Start listening."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.logger.info("Metrics endpoint listening on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self):
+        """Stop listening."""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        """Answer one HTTP request."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; we do not need any of them
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status = '200 OK'
+                body = self.registry.render().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status = '404 Not Found'
+                body = b'Not found\n'
+                content_type = 'text/plain'
+
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
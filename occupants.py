@@ -0,0 +1,325 @@
+"""
+Occupant tracking for the Jabber bot.
+"""
+
+import bisect
+import sys
+
+
+class Occupant:
+    """A user present in a conference room."""
+
+    __slots__ = ('nick', 'jid', 'role', 'affiliation')
+
+    def __init__(self, nick, jid=None, role=None, affiliation=None):
+        self.nick = nick
+        self.jid = jid
+        self.role = role
+        self.affiliation = affiliation
+
+
+def _intern(value):
+    """Intern a string so repeated nicks and JIDs share one object."""
+    return sys.intern(value) if value else None
+
+
+class SortedIndex:
+    """
+    Strings kept in case-insensitive order as they are added and removed.
+
+    A parallel list of casefolded keys is searched with bisect, so a page of
+    entries, optionally limited to a prefix, costs a binary search and a
+    slice rather than a sort. Keys equal to their value share its object.
+    """
+
+    __slots__ = ('keys', 'values')
+
+    def __init__(self):
+        self.keys = []
+        self.values = []
+
+    @staticmethod
+    def _key(value):
+        key = value.casefold()
+        return value if key == value else key
+
+    def add(self, value):
+        """Insert a value at its sorted position."""
+        key = self._key(value)
+        index = bisect.bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.values.insert(index, value)
+
+    def remove(self, value):
+        """Remove a value, returning False if it is not present."""
+        key = self._key(value)
+        index = bisect.bisect_left(self.keys, key)
+        # Values differing only in case share a key; find the exact one
+        while index < len(self.keys) and self.keys[index] == key:
+            if self.values[index] == value:
+                del self.keys[index]
+                del self.values[index]
+                return True
+            index += 1
+        return False
+
+    def clear(self):
+        """Remove all values."""
+        self.keys.clear()
+        self.values.clear()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def page(self, offset, limit, prefix=None):
+        """
+        Get (number of matching values, values[offset:offset + limit]).
+
+        With a prefix, only values starting with it, ignoring case, match.
+        """
+        if prefix:
+            prefix = prefix.casefold()
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + '\U0010ffff', start)
+        else:
+            start, end = 0, len(self.keys)
+        first = min(start + offset, end)
+        return end - start, self.values[first:min(first + limit, end)]
+
+
+class OccupantStore:
+    """
+    Tracks who is in which room.
+
+    Keeps a forward index (room -> nick -> Occupant) and reverse indexes from
+    nick and from real JID to the set of rooms, so both "who is in this room"
+    and "which rooms is this user in" are dictionary lookups. Rooms and the
+    nicks of each room are also kept in sorted order, so listings are served
+    a page at a time without sorting. Nicks, JIDs, roles and affiliations are
+    interned since the same values repeat across thousands of occupants.
+    """
+
+    def __init__(self):
+        """Initialize an empty occupant store."""
+        self._rooms = {}
+        self._sorted_rooms = SortedIndex()
+        self._sorted_nicks = {}  # room -> SortedIndex of its nicks
+        self._nick_rooms = {}
+        self._jid_rooms = {}
+        self._total = 0
+        self._changed = set()  # rooms changed since the last take_changed()
+
+    def add_room(self, room):
+        """Start tracking a room."""
+        room = _intern(room)
+        if room not in self._rooms:
+            self._rooms[room] = {}
+            self._sorted_rooms.add(room)
+            self._sorted_nicks[room] = SortedIndex()
+            self._changed.add(room)
+
+    def remove_room(self, room):
+        """Stop tracking a room and forget its occupants."""
+        occupants = self._rooms.pop(room, None)
+        if occupants is None:
+            return False
+        self._sorted_rooms.remove(room)
+        del self._sorted_nicks[room]
+        for occupant in occupants.values():
+            self._unindex(room, occupant)
+        self._total -= len(occupants)
+        self._changed.add(room)
+        return True
+
+    def has_room(self, room):
+        """Check whether a room is tracked."""
+        return room in self._rooms
+
+    def rooms(self):
+        """Get a list of tracked rooms."""
+        return list(self._rooms)
+
+    def room_count(self):
+        """Get the number of tracked rooms."""
+        return len(self._rooms)
+
+    def add(self, room, nick, jid=None, role=None, affiliation=None):
+        """
+        Record an occupant, creating the room if needed.
+
+        Returns True if the nick was not already in the room.
+        """
+        room = _intern(room)
+        nick = _intern(nick)
+        occupants = self._rooms.get(room)
+        if occupants is None:
+            self.add_room(room)
+            occupants = self._rooms[room]
+        self._changed.add(room)
+
+        occupant = occupants.get(nick)
+        if occupant is not None:
+            self.update(room, nick, jid=jid, role=role, affiliation=affiliation)
+            return False
+
+        jid = _intern(jid)
+        occupants[nick] = Occupant(nick, jid, _intern(role), _intern(affiliation))
+        self._sorted_nicks[room].add(nick)
+        self._nick_rooms.setdefault(nick, set()).add(room)
+        if jid:
+            self._jid_rooms.setdefault(jid, set()).add(room)
+        self._total += 1
+        return True
+
+    def update(self, room, nick, jid=None, role=None, affiliation=None):
+        """Update the details of a known occupant, returning False if unknown."""
+        occupant = self._rooms.get(room, {}).get(nick)
+        if occupant is None:
+            return False
+        self._changed.add(room)
+        if jid and jid != occupant.jid:
+            self._unindex_jid(room, occupant.jid)
+            occupant.jid = _intern(jid)
+            self._jid_rooms.setdefault(occupant.jid, set()).add(room)
+        if role:
+            occupant.role = _intern(role)
+        if affiliation:
+            occupant.affiliation = _intern(affiliation)
+        return True
+
+    def remove(self, room, nick):
+        """Forget an occupant, returning False if it was not tracked."""
+        occupants = self._rooms.get(room)
+        if not occupants or nick not in occupants:
+            return False
+        occupant = occupants.pop(nick)
+        self._sorted_nicks[room].remove(nick)
+        self._unindex(room, occupant)
+        self._total -= 1
+        self._changed.add(room)
+        return True
+
+    def _unindex(self, room, occupant):
+        """Remove an occupant from the reverse indexes."""
+        rooms = self._nick_rooms.get(occupant.nick)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self._nick_rooms[occupant.nick]
+        self._unindex_jid(room, occupant.jid)
+
+    def _unindex_jid(self, room, jid):
+        """Remove a room from a real JID's reverse index entry."""
+        if not jid:
+            return
+        rooms = self._jid_rooms.get(jid)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self._jid_rooms[jid]
+
+    def get(self, room, nick):
+        """Get an occupant, or None if not present."""
+        return self._rooms.get(room, {}).get(nick)
+
+    def contains(self, room, nick):
+        """Check whether a nick is in a room."""
+        return nick in self._rooms.get(room, ())
+
+    def nicks(self, room):
+        """Get the nicks present in a room."""
+        return list(self._rooms.get(room, ()))
+
+    def sorted_nicks(self, room):
+        """Get the SortedIndex of a room's nicks, or None if the room is not tracked."""
+        return self._sorted_nicks.get(room)
+
+    def nick_page(self, room, offset, limit, prefix=None):
+        """Get (number of matching nicks, one page of them) in case-insensitive order."""
+        index = self._sorted_nicks.get(room)
+        if index is None:
+            return 0, []
+        return index.page(offset, limit, prefix)
+
+    def room_page(self, offset, limit, prefix=None):
+        """Get (number of matching rooms, one page of them) in case-insensitive order."""
+        return self._sorted_rooms.page(offset, limit, prefix)
+
+    def occupants(self, room):
+        """Get the occupants present in a room."""
+        return list(self._rooms.get(room, {}).values())
+
+    def count(self, room=None):
+        """Get the number of occupants in a room, or in all rooms."""
+        if room is None:
+            return self._total
+        return len(self._rooms.get(room, ()))
+
+    def rooms_for_nick(self, nick):
+        """Get the rooms where a nick is present."""
+        return set(self._nick_rooms.get(nick, ()))
+
+    def rooms_for_jid(self, jid):
+        """Get the rooms where a real bare JID is present."""
+        return set(self._jid_rooms.get(jid, ()))
+
+    def clear(self):
+        """Forget all rooms and occupants."""
+        self._changed.update(self._rooms)
+        self._rooms.clear()
+        self._sorted_rooms.clear()
+        self._sorted_nicks.clear()
+        self._nick_rooms.clear()
+        self._jid_rooms.clear()
+        self._total = 0
+
+    def take_changed(self):
+        """Get the rooms whose occupants changed since the last call."""
+        changed, self._changed = self._changed, set()
+        return changed
+
+    def memory_usage(self):
+        """
+        Estimate the memory held by the store.
+
+        Walks every container once, counting each distinct string a single
+        time since nicks and JIDs are interned. Intended for diagnostics, not
+        for hot paths.
+        """
+        seen = set()
+        size = 0
+
+        def account(obj):
+            nonlocal size
+            if obj is not None and id(obj) not in seen:
+                seen.add(id(obj))
+                size += sys.getsizeof(obj)
+
+        for index in (self._rooms, self._nick_rooms, self._jid_rooms):
+            account(index)
+            for key, value in index.items():
+                account(key)
+                account(value)
+        for index in [self._sorted_rooms] + list(self._sorted_nicks.values()):
+            account(index)
+            account(index.keys)
+            account(index.values)
+            for key in index.keys:
+                account(key)
+        for occupants in self._rooms.values():
+            for nick, occupant in occupants.items():
+                account(occupant)
+                account(occupant.jid)
+                account(occupant.role)
+                account(occupant.affiliation)
+
+        per_10k = size * 10000 / self._total if self._total else 0
+        return {
+            'rooms': len(self._rooms),
+            'occupants': self._total,
+            'bytes': size,
+            'bytes_per_10k_occupants': int(per_10k),
+        }
@@ -0,0 +1,223 @@
+"""
+Rate-limited outbound stanza queue for the Jabber bot.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from ratelimit import TokenBucket
+
+
+# Priority classes, lower values are sent first
+PRIORITY_REPLY = 0
+PRIORITY_GREETING = 1
+PRIORITY_ANNOUNCEMENT = 2
+PRIORITIES = (PRIORITY_REPLY, PRIORITY_GREETING, PRIORITY_ANNOUNCEMENT)
+
+
+class OutboundQueue:
+    """
+    Central queue for all outgoing messages.
+
+    Stanzas are held per destination and per priority class, and released by a
+    single drain task that honours a global and a per-destination token bucket.
+    Destinations with pending stanzas are served round-robin so a busy room
+    cannot starve the others.
+    """
+
+    def __init__(self, bot):
+        """Initialize the outbound queue with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        # Configuration
+        self.global_rate = self.bot.config.getfloat('outbound', 'global_rate', fallback=20.0)
+        self.global_burst = self.bot.config.getfloat('outbound', 'global_burst', fallback=40.0)
+        self.room_rate = self.bot.config.getfloat('outbound', 'room_rate', fallback=1.0)
+        self.room_burst = self.bot.config.getfloat('outbound', 'room_burst', fallback=5.0)
+        self.max_pending_per_room = self.bot.config.getint(
+            'outbound', 'max_pending_per_room', fallback=100
+        )
+
+        # Queue state
+        self._pending = {}  # destination -> one deque of (stanza, enqueue time) per priority
+        self._rings = [deque() for _ in PRIORITIES]  # round-robin order per priority
+        self._in_ring = [set() for _ in PRIORITIES]
+        self._buckets = {}
+        self._global_bucket = TokenBucket(self.global_rate, self.global_burst)
+        self._size = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._last_prune = time.monotonic()
+
+        # Counters
+        self.counters = {'queued': 0, 'dropped': 0, 'sent': 0}
+
+    def start(self):
+        """Start the drain task."""
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._drain_loop())
+        self.logger.info("Outbound queue started")
+
+    async def stop(self):
+        """Stop the drain task, leaving pending stanzas in the queue."""
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.logger.info("Outbound queue stopped with %d stanzas pending", self._size)
+
+    def enqueue(self, mto, mbody, mtype='groupchat', priority=PRIORITY_ANNOUNCEMENT):
+        """Queue a message for sending, returning False if it was dropped."""
+        stanza = self.bot.make_message(mto=mto, mbody=mbody, mtype=mtype)
+        return self.enqueue_stanza(stanza, priority)
+
+    def enqueue_stanza(self, stanza, priority=PRIORITY_REPLY):
+        """Queue a prepared stanza for sending, returning False if it was dropped."""
+        destination = stanza['to'].bare
+        queues = self._pending.get(destination)
+        if queues is None:
+            queues = self._pending[destination] = [deque() for _ in PRIORITIES]
+
+        if sum(len(q) for q in queues) >= self.max_pending_per_room:
+            if not self._drop_lowest(destination, queues, priority):
+                self.counters['dropped'] += 1
+                self.logger.debug("Dropped outbound stanza to %s: queue full", destination)
+                return False
+
+        queues[priority].append((stanza, time.monotonic()))
+        self._size += 1
+        self.counters['queued'] += 1
+        if destination not in self._in_ring[priority]:
+            self._in_ring[priority].add(destination)
+            self._rings[priority].append(destination)
+        self._wakeup.set()
+        return True
+
+    def _drop_lowest(self, destination, queues, priority):
+        """Make room by dropping the oldest stanza of a less urgent class."""
+        for lower in reversed(PRIORITIES):
+            if lower <= priority:
+                break
+            if queues[lower]:
+                queues[lower].popleft()
+                self._size -= 1
+                self.counters['dropped'] += 1
+                self.logger.debug("Dropped queued stanza to %s to make room", destination)
+                return True
+        return False
+
+    def _bucket(self, destination):
+        """Get or create the token bucket for a destination."""
+        bucket = self._buckets.get(destination)
+        if bucket is None:
+            bucket = self._buckets[destination] = TokenBucket(self.room_rate, self.room_burst)
+        return bucket
+
+    def _dispatch(self, now):
+        """
+        Send every stanza the buckets currently allow.
+
+        Returns a tuple of (sent count, seconds until the next send is possible).
+        """
+        sent = 0
+        wait = None
+
+        for priority in PRIORITIES:
+            ring = self._rings[priority]
+            in_ring = self._in_ring[priority]
+            for _ in range(len(ring)):
+                global_wait = self._global_bucket.wait_time(now)
+                if global_wait > 0:
+                    return sent, global_wait
+
+                destination = ring.popleft()
+                queues = self._pending.get(destination)
+                queue = queues[priority] if queues else None
+                if not queue:
+                    in_ring.discard(destination)
+                    continue
+
+                bucket = self._bucket(destination)
+                if not bucket.consume(now):
+                    room_wait = bucket.wait_time(now)
+                    wait = room_wait if wait is None else min(wait, room_wait)
+                    ring.append(destination)
+                    continue
+
+                self._global_bucket.consume(now)
+                stanza, enqueued = queue.popleft()
+                self._size -= 1
+                try:
+                    stanza.send()
+                    self.counters['sent'] += 1
+                    sent += 1
+                    self.bot.metrics.outbound_wait.observe(now - enqueued, priority)
+                except Exception as e:
+                    self.counters['dropped'] += 1
+                    self.logger.error("Failed to send stanza to %s: %s", destination, e)
+
+                if queue:
+                    ring.append(destination)
+                else:
+                    in_ring.discard(destination)
+
+        return sent, wait
+
+    def _prune(self, now):
+        """Forget idle destinations whose buckets have refilled."""
+        for destination in list(self._buckets):
+            queues = self._pending.get(destination)
+            if queues and any(queues):
+                continue
+            if self._buckets[destination].is_full(now):
+                del self._buckets[destination]
+                self._pending.pop(destination, None)
+        self._last_prune = now
+
+    async def _drain_loop(self):
+        """Main loop releasing queued stanzas as the rate limits allow."""
+        while True:
+            if not self._size:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            try:
+                now = time.monotonic()
+                sent, wait = self._dispatch(now)
+                if now - self._last_prune > 60:
+                    self._prune(now)
+            except Exception as e:
+                # Keep draining; a stopped loop would leave the queue filling up unnoticed
+                self.logger.error("Error in outbound drain loop: %s", e, exc_info=True)
+                sent, wait = 0, 1.0
+
+            if sent:
+                # Yield to other handlers between bursts
+                await asyncio.sleep(0)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait or 0.05)
+            except asyncio.TimeoutError:
+                pass
+
+    def depth(self):
+        """Get the number of stanzas waiting to be sent."""
+        return self._size
+
+    def get_stats(self):
+        """Get queue counters and current depth."""
+        stats = dict(self.counters)
+        stats['depth'] = self._size
+        stats['destinations'] = sum(1 for queues in self._pending.values() if any(queues))
+        return stats
@@ -0,0 +1,241 @@
+"""
+On-demand profiling of the running bot.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+
+MAX_STACK_DEPTH = 64
+MIN_DURATION = 1.0  # seconds
+
+
+def _describe(code):
+    """Name a code object as 'function (file:line)'."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(stack):
+    """Check whether a sampled loop stack is the loop waiting for I/O."""
+    leaf = stack[-1]
+    return leaf.co_name == 'select' and leaf.co_filename.endswith('selectors.py')
+
+
+class Profiler:
+    """
+    Collects a profile of the bot for a set duration.
+
+    While a profile runs, a sampler thread records the event loop thread's
+    stack every sample_interval seconds, tracemalloc traces allocations, and
+    the bot's event handlers report their wall time. At the end the results
+    are written to timestamped files in output_dir and summarized.
+
+    Handlers are wrapped once, when they are registered; outside a profile
+    the wrapper only checks a flag.
+    """
+
+    def __init__(self, bot):
+        """Initialize the profiler with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        config = self.bot.config
+        admins = config.get('debug', 'admins', fallback='')
+        self.admins = {jid.strip().lower() for jid in admins.split(',') if jid.strip()}
+        self.output_dir = config.get('debug', 'output_dir', fallback='profiles')
+        self.default_duration = config.getfloat('debug', 'duration', fallback=30.0)
+        self.max_duration = config.getfloat('debug', 'max_duration', fallback=300.0)
+        self.sample_interval = config.getfloat('debug', 'sample_interval', fallback=0.01)
+        self.tracemalloc_frames = config.getint('debug', 'tracemalloc_frames', fallback=1)
+        self.top = config.getint('debug', 'top', fallback=15)
+
+        self.running = False
+        self._task = None
+        self._samples = Counter()  # stack of code objects, root first -> sample count
+        self._handler_times = {}   # handler name -> [calls, total seconds, max seconds]
+
+    def is_admin(self, jid):
+        """Check whether a real bare JID may run profiles."""
+        return bool(jid) and jid.lower() in self.admins
+
+    def timed(self, handler):
+        """Wrap an event handler so its wall time is recorded during a profile."""
+        name = handler.__name__
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def wrapper(*args):
+                if not self.running:
+                    return await handler(*args)
+                started = time.perf_counter()
+                try:
+                    return await handler(*args)
+                finally:
+                    self._record(name, time.perf_counter() - started)
+        else:
+            @functools.wraps(handler)
+            def wrapper(*args):
+                if not self.running:
+                    return handler(*args)
+                started = time.perf_counter()
+                try:
+                    return handler(*args)
+                finally:
+                    self._record(name, time.perf_counter() - started)
+        return wrapper
+
+    def _record(self, name, elapsed):
+        """Add one handler call to the profile."""
+        stats = self._handler_times.get(name)
+        if stats is None:
+            self._handler_times[name] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+    def trigger(self, duration=None, on_done=None):
+        """
+        Start a profile in the background.
+
+        on_done is called with the summary text when it finishes. Returns the
+        duration used, or None if a profile is already running.
+        """
+        if self.running:
+            self.logger.warning("A profile is already running")
+            return None
+        if duration is None or not math.isfinite(duration):
+            duration = self.default_duration
+        duration = min(self.max_duration, max(MIN_DURATION, duration))
+        self.running = True
+        self._task = asyncio.create_task(self.run(duration))
+        self._task.add_done_callback(lambda task: self._finished(task, on_done))
+        return duration
+
+    def _finished(self, task, on_done):
+        """Hand the summary of a finished profile to its requester."""
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.logger.error("Profile failed", exc_info=task.exception())
+            return
+        if on_done is not None:
+            on_done(task.result())
+
+    async def run(self, duration):
+        """Profile the bot for duration seconds and return the summary."""
+        self.running = True
+        self._samples = Counter()
+        self._handler_times = {}
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(threading.get_ident(), stop),
+                                   name='profiler-sampler', daemon=True)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self.tracemalloc_frames)
+        before = tracemalloc.take_snapshot()
+        started = datetime.now(self.bot.timezone)
+        self.logger.info("Profiling for %.0fs", duration)
+        sampler.start()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            stop.set()
+            self.running = False
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+        await asyncio.get_running_loop().run_in_executor(None, sampler.join)
+
+        allocations = after.compare_to(before, 'lineno')
+        allocations = [stat for stat in allocations if stat.size_diff > 0]
+        allocations.sort(key=lambda stat: stat.size_diff, reverse=True)
+        handlers = sorted(self._handler_times.items(), key=lambda item: item[1][1], reverse=True)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._write, started, duration, self._samples, allocations, handlers
+        )
+
+    def _sample(self, thread_id, stop):
+        """Record the stack of the loop thread until stopped; runs in the sampler thread."""
+        samples = self._samples
+        while not stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                samples[tuple(stack)] += 1
+
+    def _write(self, started, duration, samples, allocations, handlers):
+        """Write the profile files and return the summary; runs in a worker thread."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"profile-{started.strftime('%Y%m%d-%H%M%S')}")
+
+        total = sum(samples.values())
+        busy = {stack: count for stack, count in samples.items() if not _is_idle(stack)}
+        busy_total = sum(busy.values())
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in busy.items():
+            own[stack[-1]] += count
+            for code in set(stack):
+                inclusive[code] += count
+
+        # Collapsed stacks, the input format of flame graph tools
+        with open(f'{base}-cpu.folded', 'w', encoding='utf-8') as handle:
+            for stack, count in sorted(samples.items(), key=lambda item: -item[1]):
+                handle.write(';'.join(_describe(code) for code in stack) + f' {count}\n')
+        with open(f'{base}-cpu.txt', 'w', encoding='utf-8') as handle:
+            handle.write(f"{total} samples every {self.sample_interval * 1000:.0f} ms, "
+                         f"{busy_total} busy ({100 * busy_total / max(total, 1):.1f}%)\n\n")
+            handle.write("Own samples (busy):\n")
+            for code, count in own.most_common(self.top * 4):
+                handle.write(f"{count:8d} {100 * count / max(busy_total, 1):5.1f}%  {_describe(code)}\n")
+            handle.write("\nInclusive samples (busy):\n")
+            for code, count in inclusive.most_common(self.top * 4):
+                handle.write(f"{count:8d} {100 * count / max(busy_total, 1):5.1f}%  {_describe(code)}\n")
+        with open(f'{base}-alloc.txt', 'w', encoding='utf-8') as handle:
+            handle.write(f"Allocations grown during the profile ({self.tracemalloc_frames} frames)\n\n")
+            for stat in allocations[:self.top * 4]:
+                handle.write(f"{stat.size_diff / 1024:10.1f} KiB {stat.count_diff:+8d} blocks  "
+                             f"{stat.traceback}\n")
+        with open(f'{base}-handlers.txt', 'w', encoding='utf-8') as handle:
+            handle.write(f"{'handler':32} {'calls':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}\n")
+            for name, (calls, spent, longest) in handlers:
+                handle.write(f"{name:32} {calls:8d} {spent:10.3f} {spent / calls * 1000:10.3f} "
+                             f"{longest * 1000:10.3f}\n")
+
+        lines = [f"Profile of {duration:.0f}s written to {base}-*",
+                 f"Event loop busy {100 * busy_total / max(total, 1):.1f}% of {total} samples"]
+        if own:
+            lines.append("Top functions: " + ", ".join(
+                f"{code.co_name} {100 * count / busy_total:.0f}%" for code, count in own.most_common(3)))
+        if allocations:
+            lines.append("Top allocations: " + ", ".join(
+                f"{stat.traceback[0].filename.rsplit(os.sep, 1)[-1]}:{stat.traceback[0].lineno} "
+                f"+{stat.size_diff / 1024:.0f} KiB" for stat in allocations[:3]))
+        if handlers:
+            lines.append("Slowest handlers: " + ", ".join(
+                f"{name} {spent:.2f}s/{calls}" for name, (calls, spent, _) in handlers[:3]))
+        summary = "\n".join(lines)
+        with open(f'{base}-summary.txt', 'w', encoding='utf-8') as handle:
+            handle.write(summary + '\n')
+        self.logger.info("Profile written to %s-*", base)
+        return summary
+
+    def cancel(self):
+        """Abandon a running profile."""
+        if self._task and not self._task.done():
+            self._task.cancel()
@@ -0,0 +1,136 @@
+"""
+Rate limiting primitives for the Jabber bot.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at a fixed rate."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        """Create a full bucket holding up to capacity tokens."""
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        """Add the tokens accumulated since the last update."""
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def consume(self, now=None, amount=1):
+        """Take tokens from the bucket, returning False if not enough are available."""
+        if now is None:
+            now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, now=None, amount=1):
+        """Get the number of seconds until the requested tokens are available."""
+        if now is None:
+            now = time.monotonic()
+        self._refill(now)
+        missing = amount - self.tokens
+        if missing <= 0:
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return missing / self.rate
+
+    def is_full(self, now=None):
+        """Check whether the bucket has refilled to capacity."""
+        if now is None:
+            now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class SlidingWindowLimiter:
+    """
+    Per-key sliding window rate limiter.
+
+    Uses the sliding window counter approximation: each key keeps the count of
+    the current and the previous fixed window, and the previous count is
+    weighted by how much of it still overlaps the sliding window. Every check
+    is O(1), and keys that stay idle for two windows are evicted so memory only
+    grows with the number of recently active keys.
+    """
+
+    def __init__(self, limit, window, max_keys=100000):
+        """Allow up to limit hits per key in any window of the given seconds."""
+        self.limit = limit
+        self.window = float(window)
+        self.max_keys = max_keys
+        # key -> [window start, previous count, current count, notified]
+        self._entries = OrderedDict()
+
+    def hit(self, key, now=None):
+        """
+        Record a hit for a key.
+
+        Returns True if the hit is allowed, or False if it exceeds the limit.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [now, 0, 0, False]
+        else:
+            self._entries.move_to_end(key)
+            self._roll(entry, now)
+        self._evict(now)
+
+        overlap = 1.0 - (now - entry[0]) / self.window
+        estimate = entry[1] * overlap + entry[2]
+        if estimate >= self.limit:
+            return False
+
+        entry[2] += 1
+        return True
+
+    def should_notify(self, key):
+        """Check whether a limited key has not been told to slow down yet in this window."""
+        entry = self._entries.get(key)
+        if entry is None or entry[3]:
+            return False
+        entry[3] = True
+        return True
+
+    def _roll(self, entry, now):
+        """Advance a key's fixed windows to the one containing now."""
+        elapsed = now - entry[0]
+        if elapsed < self.window:
+            return
+        if elapsed < 2 * self.window:
+            entry[0] += self.window
+            entry[1] = entry[2]
+        else:
+            entry[0] = now
+            entry[1] = 0
+        entry[2] = 0
+        entry[3] = False
+
+    def _evict(self, now):
+        """Drop keys that have been idle for two windows, oldest first."""
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            # The window start trails the last hit by at most one window
+            if len(entries) <= self.max_keys and now - entry[0] < 3 * self.window:
+                break
+            del entries[key]
+
+    def __len__(self):
+        """Get the number of tracked keys."""
+        return len(self._entries)
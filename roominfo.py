@@ -0,0 +1,152 @@
+"""
+Cached room metadata: configuration, subject and disco#info.
+"""
+
+import asyncio
+import logging
+import time
+
+from slixmpp.exceptions import IqError, IqTimeout
+
+
+# MUC status codes announcing a room configuration change (XEP-0045 section 10.2.1)
+CONFIG_STATUS_CODES = {104, 170, 171, 172, 173, 174}
+
+KINDS = ('config', 'disco')
+
+
+class RoomInfoCache:
+    """
+    Per-room cache of owner configuration and disco#info results.
+
+    Each entry lives for its kind's TTL. An entry older than refresh_after
+    of its TTL is still answered from the cache, but triggers a background
+    refresh, so callers rarely wait on the server. Concurrent misses for the
+    same room and kind share one in-flight query. Config-change status codes
+    from the room drop its entries; the subject is kept from the room's own
+    subject messages and needs no query at all.
+    """
+
+    def __init__(self, bot):
+        """Initialize the cache with bot instance."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        config = self.bot.config
+        self.ttls = {
+            'config': config.getfloat('roominfo', 'config_ttl', fallback=3600.0),
+            'disco': config.getfloat('roominfo', 'disco_ttl', fallback=3600.0),
+        }
+        self.error_ttl = config.getfloat('roominfo', 'error_ttl', fallback=300.0)
+        self.refresh_after = config.getfloat('roominfo', 'refresh_after', fallback=0.75)
+        self.timeout = config.getfloat('roominfo', 'timeout', fallback=10.0)
+
+        self.entries = {}    # (room, kind) -> (value, fetched, expires)
+        self.subjects = {}   # room -> subject
+        self._inflight = {}  # (room, kind) -> task fetching it
+        self._generations = {}  # room -> count of invalidations, to discard stale answers
+        self.stats = {'hits': 0, 'misses': 0, 'queries': 0, 'refreshes': 0, 'coalesced': 0}
+
+        self.bot.add_event_handler('groupchat_subject', self._subject)
+        self.bot.add_event_handler('groupchat_config_status', self._config_status)
+
+    def _subject(self, msg):
+        """Remember a room's subject as the room announces it."""
+        self.subjects[msg['from'].bare] = msg['subject']
+
+    def _config_status(self, msg):
+        """Drop cached metadata of a room whose configuration changed."""
+        codes = msg['muc']['status_codes']
+        if codes & CONFIG_STATUS_CODES:
+            room = msg['from'].bare
+            self.logger.debug("Configuration of %s changed (%s)", room, sorted(codes))
+            self.invalidate(room)
+
+    def invalidate(self, room_jid, kind=None):
+        """Drop one kind of cached metadata of a room, or all of it."""
+        for key in ([(room_jid, kind)] if kind else [(room_jid, k) for k in KINDS]):
+            self.entries.pop(key, None)
+            # Later callers must not join a query that started before the change
+            self._inflight.pop(key, None)
+        self._generations[room_jid] = self._generations.get(room_jid, 0) + 1
+
+    def forget(self, room_jid):
+        """Drop everything known about a room the bot left."""
+        self.invalidate(room_jid)
+        self.subjects.pop(room_jid, None)
+        self._generations.pop(room_jid, None)
+
+    def subject(self, room_jid):
+        """Get the subject of a room, if it announced one."""
+        return self.subjects.get(room_jid)
+
+    async def get(self, room_jid, kind, refresh=False):
+        """
+        Get cached metadata of a room, querying the server only on a miss.
+
+        Returns None if the server refused or did not answer; that result is
+        cached for error_ttl so unanswerable rooms are not queried repeatedly.
+        """
+        key = (room_jid, kind)
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry is not None and not refresh:
+            value, fetched, expires = entry
+            if expires > now:
+                self.stats['hits'] += 1
+                # Refresh ahead of expiry so later callers keep hitting the cache
+                if now - fetched > (expires - fetched) * self.refresh_after and key not in self._inflight:
+                    self.stats['refreshes'] += 1
+                    self._fetch(key)
+                return value
+        self.stats['misses'] += 1
+        if key in self._inflight:
+            self.stats['coalesced'] += 1
+        return await asyncio.shield(self._fetch(key))
+
+    def _fetch(self, key):
+        """Start a query for a room's metadata, or join the one already running."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._query(*key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        return task
+
+    def _done(self, key, task):
+        """Stop tracking a finished query, unless a newer one replaced it."""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Background refreshes have no caller to see their errors
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error("Querying %s of %s failed", key[1], key[0], exc_info=task.exception())
+
+    async def _query(self, room_jid, kind):
+        """Query the server and store the result."""
+        self.stats['queries'] += 1
+        generation = self._generations.get(room_jid, 0)
+        ttl = self.ttls[kind]
+        try:
+            if kind == 'config':
+                form = await self.bot.plugin['xep_0045'].get_room_config(
+                    room_jid, timeout=self.timeout)
+                value = form.get_values()
+            else:
+                iq = await self.bot.plugin['xep_0030'].get_info(
+                    jid=room_jid, cached=False, timeout=self.timeout)
+                info = iq['disco_info']
+                form = info.get_plugin('form', check=True)
+                value = {
+                    'identities': [identity[3] for identity in info['identities'] if identity[3]],
+                    'features': sorted(info['features']),
+                    'roominfo': form.get_values() if form is not None else {},
+                }
+        except (IqError, IqTimeout, ValueError) as e:
+            self.logger.debug(f"Could not get {kind} of {room_jid}: {e}")
+            value = None
+            ttl = self.error_ttl
+        # An answer that raced an invalidation may already be out of date
+        if self._generations.get(room_jid, 0) == generation:
+            now = time.monotonic()
+            self.entries[room_jid, kind] = (value, now, now + ttl)
+        return value
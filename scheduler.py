@@ -3,99 +3,600 @@ Task scheduling module for the Jabber bot.
 """
 
 import asyncio
+import heapq
+import inspect
+import itertools
 import logging
+import time
 from datetime import datetime, timedelta
 import pytz
 
+from outbound import PRIORITY_ANNOUNCEMENT
+from jobstore import JobStore
+
+
+# Longest the dispatcher sleeps in one go, so wall clock jumps are noticed
+MAX_SLEEP = 60.0
+
+# What to do with a persistent job that came due while the bot was down
+MISFIRE_POLICIES = ('run_once', 'skip', 'catch_up')
+
+
+class CronSchedule:
+    """
+    A five-field cron expression: minute, hour, day of month, month, day of week.
+
+    Fields accept '*', numbers, ranges ('1-5'), lists ('1,15') and steps
+    ('*/15', '0-30/10'). Day of week runs from 0 (Sunday) to 6, and 7 is also
+    accepted for Sunday.
+    """
+
+    FIELDS = (
+        ('minute', 0, 59),
+        ('hour', 0, 23),
+        ('day', 1, 31),
+        ('month', 1, 12),
+        ('weekday', 0, 7),
+    )
+
+    def __init__(self, expression):
+        """Parse a cron expression, raising ValueError if it is malformed."""
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+
+        self.expression = expression
+        values = []
+        for part, (name, low, high) in zip(parts, self.FIELDS):
+            values.append(self._parse_field(part, name, low, high))
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = frozenset(7 if day == 0 else day for day in weekdays)
+
+        # Standard cron: if both day fields are restricted, either may match
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse_field(field, name, low, high):
+        """Expand one cron field into a sorted tuple of allowed values."""
+        allowed = set()
+        for item in field.split(','):
+            step = 1
+            if '/' in item:
+                item, step_str = item.split('/', 1)
+                step = int(step_str)
+                if step <= 0:
+                    raise ValueError(f"Invalid step in cron {name} field: {field!r}")
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start_str, end_str = item.split('-', 1)
+                start, end = int(start_str), int(end_str)
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError(f"Cron {name} field out of range: {field!r}")
+            allowed.update(range(start, end + 1, step))
+        return tuple(sorted(allowed))
+
+    def _day_matches(self, day):
+        """Check the day of month, month and day of week fields for a date."""
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        # isoweekday() is 1 (Monday) to 7 (Sunday), which matches our weekdays
+        in_weekdays = day.isoweekday() in self.weekdays
+        if self.any_day and self.any_weekday:
+            return True
+        if self.any_day:
+            return in_weekdays
+        if self.any_weekday:
+            return in_days
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        """Get the first matching time strictly after a timezone-aware datetime."""
+        tz = moment.tzinfo
+        start = moment.replace(second=0, microsecond=0, tzinfo=None) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+
+        # Walk day by day; within a matching day pick the first allowed time
+        for _ in range(366 * 8):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return _localize(tz, candidate)
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+def _localize(tz, naive):
+    """Attach a timezone to a naive datetime, using pytz rules when available."""
+    if hasattr(tz, 'localize'):
+        return tz.normalize(tz.localize(naive))
+    return naive.replace(tzinfo=tz)
+
+
+class Job:
+    """A scheduled job tracked by the TaskScheduler."""
+
+    __slots__ = ('id', 'name', 'func', 'args', 'kind', 'next_run',
+                 'interval', 'hour', 'minute', 'cron', 'cancelled',
+                 'persistent', 'misfire')
+
+    def __init__(self, job_id, func, args, kind, next_run, name=None):
+        self.id = job_id
+        self.name = name or getattr(func, '__name__', kind)
+        self.func = func
+        self.args = args
+        self.kind = kind
+        self.next_run = next_run
+        self.interval = None
+        self.hour = None
+        self.minute = None
+        self.cron = None
+        self.cancelled = False
+        self.persistent = False
+        self.misfire = 'run_once'
+
+    def to_row(self):
+        """Get the job store row for a persistent job."""
+        return {
+            'id': self.id,
+            'job_type': self.name,
+            'args': list(self.args),
+            'kind': self.kind,
+            'next_run': self.next_run,
+            'interval': self.interval,
+            'hour': self.hour,
+            'minute': self.minute,
+            'cron': self.cron.expression if self.cron else None,
+            'misfire': self.misfire,
+        }
+
+    def describe(self):
+        """Get a dict describing the job."""
+        info = {
+            'id': self.id,
+            'name': self.name,
+            'kind': self.kind,
+            'next_run': datetime.fromtimestamp(self.next_run, pytz.utc).isoformat(),
+            'persistent': self.persistent,
+        }
+        if self.kind == 'interval':
+            info['interval'] = self.interval
+        elif self.kind == 'daily':
+            info['at'] = f"{self.hour:02d}:{self.minute:02d}"
+        elif self.kind == 'cron':
+            info['cron'] = self.cron.expression
+        return info
+
 
 class TaskScheduler:
-    """Handles scheduled tasks for the bot."""
-    
+    """
+    Handles scheduled tasks for the bot.
+
+    All jobs live in a single heap ordered by next run time and are released by
+    one dispatcher task, so the cost of an idle job is one heap entry rather
+    than a sleeping asyncio task.
+    """
+
     def __init__(self, bot):
         """Initialize task scheduler with bot instance."""
         self.bot = bot
         self.logger = logging.getLogger(__name__)
-        
-        # Task management
+
+        # Job management
         self.running = False
-        self.tasks = []
-        self.hourly_task = None
-        
+        self.jobs = {}
+        self._heap = []  # (next run timestamp, sequence, job)
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._stale = 0  # cancelled or rescheduled entries still in the heap
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self._running_tasks = set()
+        self._flusher = None
+        self.hourly_job = None
+
+        # Named job functions that persistent jobs refer to
+        self.job_types = {}
+
+        # Counters
+        self.stats = {'wakeups': 0, 'runs': 0, 'errors': 0, 'misfires': 0}
+
         # Configuration
-        self.hourly_announcements = self.bot.config.getboolean(
+        config = self.bot.config
+        self.hourly_announcements = config.getboolean(
             'scheduler', 'hourly_announcements', fallback=True
         )
-        
+        self.load_horizon = config.getfloat('scheduler', 'load_horizon', fallback=3600.0)
+        self.misfire_grace = config.getfloat('scheduler', 'misfire_grace', fallback=60.0)
+        self.default_misfire = config.get('scheduler', 'misfire', fallback='run_once')
+        self.max_catch_up = config.getint('scheduler', 'max_catch_up', fallback=100)
+        self.flush_interval = config.getfloat('scheduler', 'flush_interval', fallback=1.0)
+
+        # Persistent job store
+        self.store = None
+        self._loaded_until = None
+        store_path = config.get('scheduler', 'jobstore', fallback='')
+        if store_path:
+            self.store = JobStore(store_path)
+            self._ids = itertools.count(self.store.max_id() + 1)
+
     async def start(self):
         """Start the task scheduler."""
         if self.running:
             self.logger.warning("Scheduler is already running")
             return
-        
+
         self.running = True
         self.logger.info("Starting task scheduler")
-        
+
         # Start hourly announcements if enabled
-        if self.hourly_announcements:
-            self.hourly_task = asyncio.create_task(self._hourly_announcement_loop())
-            self.hourly_task.add_done_callback(self._task_done_callback)
-            self.tasks.append(self.hourly_task)
-    
+        if self.hourly_announcements and self.hourly_job is None:
+            self.hourly_job = self.schedule_cron(
+                self._send_hourly_announcement, '0 * * * *', name='hourly_announcement'
+            )
+
+        # Load persistent jobs due soon; later ones are loaded as they approach
+        if self.store and self._loaded_until is None:
+            await self._load_persistent()
+
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        self._dispatcher.add_done_callback(self._task_done_callback)
+        if self.store:
+            self._flusher = asyncio.create_task(self._flush_loop())
+            self._flusher.add_done_callback(self._task_done_callback)
+
     async def stop(self):
-        """Stop the task scheduler."""
+        """Stop the task scheduler, keeping scheduled jobs for the next start."""
         if not self.running:
             return
-        
+
         self.running = False
         self.logger.info("Stopping task scheduler")
-        
-        # Cancel all running tasks
-        for task in self.tasks:
-            if not task.done():
+
+        # Cancel the dispatcher and any jobs that are still running
+        tasks = [self._dispatcher, self._flusher] + list(self._running_tasks)
+        for task in tasks:
+            if task and not task.done():
                 task.cancel()
                 try:
                     await task
                 except asyncio.CancelledError:
                     pass
-        
-        self.tasks.clear()
-        self.hourly_task = None
-    
-    async def _hourly_announcement_loop(self):
-        """Main loop for hourly time announcements."""
+
+        self._running_tasks.clear()
+        self._dispatcher = None
+        self._flusher = None
+
+        # Write out any buffered job changes
+        if self.store:
+            await asyncio.get_running_loop().run_in_executor(None, self.store.flush)
+
+    async def _dispatch_loop(self):
+        """Single loop that runs every job when it comes due."""
         try:
             while self.running:
-                # Calculate next hour boundary
-                now = datetime.now(self.bot.timezone)
-                next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
-                sleep_seconds = (next_hour - now).total_seconds()
-                
-                self.logger.debug(f"Sleeping {sleep_seconds:.1f} seconds until next hour")
-                
-                # Sleep until the next hour
-                await asyncio.sleep(sleep_seconds)
-                
-                if self.running:
-                    # Send hourly announcement
-                    self._send_hourly_announcement()
-                    
+                now = time.time()
+                self._run_due(now)
+
+                if self.store and now + self.load_horizon / 2 > self._loaded_until:
+                    await self._load_persistent()
+
+                if self._heap:
+                    delay = min(self._heap[0][0] - time.time(), MAX_SLEEP)
+                else:
+                    delay = MAX_SLEEP
+
+                self._wakeup.clear()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(0)
+                self.stats['wakeups'] += 1
+
         except asyncio.CancelledError:
-            self.logger.info("Hourly announcement task cancelled")
+            self.logger.info("Scheduler dispatcher cancelled")
+            raise
+
+    async def _flush_loop(self):
+        """Periodically write buffered job changes to the store."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self.store.has_pending():
+                try:
+                    await loop.run_in_executor(None, self.store.flush)
+                except Exception as e:
+                    self.logger.error(f"Failed to write scheduled jobs: {e}", exc_info=True)
+
+    async def _load_persistent(self):
+        """Load stored jobs due before the load horizon, handling misfires."""
+        now = time.time()
+        until = now + self.load_horizon
+        rows = await asyncio.get_running_loop().run_in_executor(
+            None, self.store.load_between, self._loaded_until, until
+        )
+        first_load = self._loaded_until is None
+        self._loaded_until = until
+
+        loaded = 0
+        for row in rows:
+            if row['id'] in self.jobs:
+                continue
+            func = self.job_types.get(row['job_type'])
+            if func is None:
+                self.logger.error(f"Unknown job type {row['job_type']!r} for stored job {row['id']}")
+                continue
+
+            job = Job(row['id'], func, tuple(row['args']), row['kind'], row['next_run'], row['job_type'])
+            job.interval = row['interval']
+            job.hour = row['hour']
+            job.minute = row['minute']
+            job.cron = CronSchedule(row['cron']) if row['cron'] else None
+            job.persistent = True
+            job.misfire = row['misfire']
+            self.jobs[job.id] = job
+            loaded += 1
+
+            if job.next_run < now - self.misfire_grace:
+                self._handle_misfire(job, now)
+            else:
+                self._push(job)
+
+        if loaded or first_load:
+            self.logger.info(f"Loaded {loaded} stored jobs due in the next {self.load_horizon:.0f}s")
+
+    def _handle_misfire(self, job, now):
+        """Apply a job's misfire policy after it came due while the bot was down."""
+        self.stats['misfires'] += 1
+
+        # Count the missed runs and find the first run after now
+        missed = 0
+        next_run = job.next_run
+        while next_run <= now:
+            missed += 1
+            if job.kind == 'once':
+                next_run = None
+                break
+            if job.kind == 'interval':
+                next_run += job.interval
+                if missed >= self.max_catch_up:
+                    # Jump straight past now instead of counting every interval
+                    skipped = int((now - next_run) // job.interval) + 1
+                    next_run += max(skipped, 0) * job.interval
+                    break
+            else:
+                next_run = self._next_calendar_run(job, next_run)
+                if missed >= self.max_catch_up:
+                    next_run = self._next_calendar_run(job, now)
+                    break
+
+        if job.misfire == 'skip':
+            runs = 0
+        elif job.misfire == 'catch_up':
+            runs = min(missed, self.max_catch_up)
+        else:
+            runs = 1
+        self.logger.info(f"Job {job.name} ({job.id}) missed {missed} runs, "
+                         f"policy {job.misfire}: running {runs}")
+
+        for _ in range(runs):
+            self._run_job(job)
+
+        if next_run is None:
+            self.jobs.pop(job.id, None)
+            self.store.delete(job.id)
+        else:
+            job.next_run = next_run
+            self.store.save(job.to_row())
+            self._push(job)
+
+    def _run_due(self, now):
+        """Pop and run every job whose time has come."""
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            when, _, job = heapq.heappop(heap)
+            if job.cancelled or job.next_run != when:
+                self._stale -= 1
+                continue
+
+            self._reschedule(job, now)
+            self._run_job(job)
+
+    def _run_job(self, job):
+        """Run a job, spawning a task if it returns an awaitable."""
+        self.stats['runs'] += 1
+        try:
+            result = job.func(*job.args)
         except Exception as e:
-            self.logger.error(f"Error in hourly announcement loop: {e}", exc_info=True)
-    
+            self.stats['errors'] += 1
+            self.logger.error(f"Scheduled job {job.name} ({job.id}) error: {e}", exc_info=True)
+            return
+
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(self._await_job(job, result))
+            self._running_tasks.add(task)
+            task.add_done_callback(self._running_tasks.discard)
+
+    async def _await_job(self, job, awaitable):
+        """Await a job's coroutine and log failures."""
+        try:
+            await awaitable
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.logger.error(f"Scheduled job {job.name} ({job.id}) error: {e}", exc_info=True)
+
+    def _reschedule(self, job, now):
+        """Compute a job's next run after it fires, or drop it if it was one-shot."""
+        if job.kind == 'once':
+            self.jobs.pop(job.id, None)
+            if job.persistent:
+                self.store.delete(job.id)
+            return
+
+        if job.kind == 'interval':
+            job.next_run += job.interval
+            if job.next_run <= now:
+                # Fell behind; skip the missed runs rather than bursting
+                job.next_run = now + job.interval
+        else:
+            job.next_run = self._next_calendar_run(job, now)
+        if job.persistent:
+            self.store.save(job.to_row())
+        self._push(job)
+
+    def _next_calendar_run(self, job, now):
+        """Get the next run time for a daily or cron job after a timestamp."""
+        moment = datetime.fromtimestamp(now, self.bot.timezone)
+        if job.kind == 'daily':
+            target = _localize(
+                self.bot.timezone,
+                moment.replace(hour=job.hour, minute=job.minute, second=0,
+                               microsecond=0, tzinfo=None)
+            )
+            if target <= moment:
+                target = _localize(
+                    self.bot.timezone,
+                    (target.replace(tzinfo=None) + timedelta(days=1))
+                )
+            return target.timestamp()
+        return job.cron.next_after(moment).timestamp()
+
+    def _push(self, job):
+        """Put a job on the heap and wake the dispatcher if it is now first."""
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+        if self._heap[0][2] is job:
+            self._wakeup.set()
+
+    def register_job_type(self, name, func):
+        """Register a callable under a name so persistent jobs can refer to it."""
+        self.job_types[name] = func
+
+    def _add(self, func, args, kind, next_run, name=None, persist=False, misfire=None, **fields):
+        """Create, register and queue a job."""
+        if persist:
+            if not self.store:
+                raise ValueError("Persistent jobs need [scheduler] jobstore to be configured")
+            if not isinstance(func, str):
+                raise TypeError("Persistent jobs must name a registered job type")
+        if isinstance(func, str):
+            if func not in self.job_types:
+                raise ValueError(f"Unknown job type: {func!r}")
+            name = func
+            func = self.job_types[func]
+        if misfire is None:
+            misfire = self.default_misfire
+        if misfire not in MISFIRE_POLICIES:
+            raise ValueError(f"Unknown misfire policy: {misfire!r}")
+
+        if inspect.iscoroutine(func):
+            if kind != 'once':
+                func.close()
+                raise TypeError(
+                    "Recurring jobs need a coroutine function or factory, "
+                    "not a coroutine object that can only be awaited once"
+                )
+            coro = func
+            func = lambda: coro
+            name = name or coro.__qualname__
+
+        job = Job(next(self._ids), func, args, kind, next_run, name)
+        for field, value in fields.items():
+            setattr(job, field, value)
+        job.persistent = persist
+        job.misfire = misfire
+        self.jobs[job.id] = job
+        if kind in ('daily', 'cron'):
+            job.next_run = self._next_calendar_run(job, time.time())
+        if persist:
+            self.store.save(job.to_row())
+        self._push(job)
+        return job.id
+
+    def schedule_once(self, func, delay_seconds, *args, name=None, persist=False, misfire=None):
+        """Schedule a callable or coroutine function to run once after a delay."""
+        return self._add(func, args, 'once', time.time() + delay_seconds, name, persist, misfire)
+
+    def schedule_at(self, func, when, *args, name=None, persist=False, misfire=None):
+        """Schedule a callable to run once at a datetime or timestamp."""
+        timestamp = when.timestamp() if isinstance(when, datetime) else float(when)
+        return self._add(func, args, 'once', timestamp, name, persist, misfire)
+
+    def schedule_interval(self, func, seconds, *args, name=None, start_delay=None,
+                          persist=False, misfire=None):
+        """Schedule a callable to run every given number of seconds."""
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        first = time.time() + (seconds if start_delay is None else start_delay)
+        return self._add(func, args, 'interval', first, name, persist, misfire, interval=seconds)
+
+    def schedule_daily(self, func, hour, minute=0, *args, name=None, persist=False, misfire=None):
+        """Schedule a callable to run every day at a time in the bot timezone."""
+        return self._add(func, args, 'daily', 0, name, persist, misfire, hour=hour, minute=minute)
+
+    def schedule_cron(self, func, expression, *args, name=None, persist=False, misfire=None):
+        """Schedule a callable on a cron expression in the bot timezone."""
+        return self._add(func, args, 'cron', 0, name, persist, misfire,
+                         cron=CronSchedule(expression))
+
+    def cancel(self, job_id):
+        """Cancel a scheduled job by id, returning False if it does not exist."""
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            # Persistent jobs beyond the load horizon only exist in the store
+            if self.store and self.store.exists(job_id):
+                self.store.delete(job_id)
+                return True
+            return False
+        job.cancelled = True
+        self._stale += 1
+        if job.persistent:
+            self.store.delete(job.id)
+        if job_id == self.hourly_job:
+            self.hourly_job = None
+        self._compact()
+        return True
+
+    def _compact(self):
+        """Rebuild the heap once most of it is cancelled entries."""
+        if self._stale > 1024 and self._stale > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap
+                          if not entry[2].cancelled and entry[2].next_run == entry[0]]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def get_job(self, job_id):
+        """Get a description of a job, or None if it does not exist."""
+        job = self.jobs.get(job_id)
+        return job.describe() if job else None
+
+    def list_jobs(self):
+        """Get descriptions of all scheduled jobs ordered by next run."""
+        return [job.describe() for job in sorted(self.jobs.values(), key=lambda j: j.next_run)]
+
     def _send_hourly_announcement(self):
         """Send hourly time announcement to all rooms."""
         try:
             now = datetime.now(self.bot.timezone)
-            
+
             # Format time message
             time_str = now.strftime("%H:%M")
             day_str = now.strftime("%A")
-            
+
             # Create announcement message
             message = f"🕐 {time_str} on {day_str}"
-            
+
             # Add special messages for certain hours
             hour = now.hour
             if hour == 0:
@@ -112,65 +613,29 @@ class TaskScheduler:
                 message += " - Good evening! 🌆"
             elif hour >= 22 or hour < 6:
                 message += " - Good night! 🌃"
-            
+
             # Send to all connected rooms
             sent_count = 0
-            for room_jid in self.bot.room_users.keys():
-                try:
-                    self.bot.send_message(mto=room_jid, mbody=message, mtype='groupchat')
-                    sent_count += 1
-                except Exception as e:
-                    self.logger.error(f"Failed to send hourly announcement to {room_jid}: {e}")
-            
-            self.logger.info(f"Sent hourly announcement to {sent_count} rooms: {message}")
-            
+            with self.bot.metrics.announcement_fanout.time():
+                for room_jid in self.bot.occupants.rooms():
+                    if self.bot.outbound.enqueue(room_jid, message, priority=PRIORITY_ANNOUNCEMENT):
+                        sent_count += 1
+                    else:
+                        self.logger.error("Failed to queue hourly announcement to %s", room_jid)
+
+            self.logger.info(f"Queued hourly announcement to {sent_count} rooms: {message}")
+
         except Exception as e:
             self.logger.error(f"Error sending hourly announcement: {e}", exc_info=True)
-    
+
     async def schedule_task(self, coro, delay_seconds):
-        """Schedule a one-time task."""
-        async def delayed_task():
-            try:
-                await asyncio.sleep(delay_seconds)
-                await coro
-            except Exception as e:
-                self.logger.error(f"Scheduled task error: {e}", exc_info=True)
-        
-        task = asyncio.create_task(delayed_task())
-        task.add_done_callback(self._task_done_callback)
-        self.tasks.append(task)
-        return task
-    
-    async def schedule_daily_task(self, coro, hour, minute=0):
-        """Schedule a daily recurring task."""
-        async def daily_task():
-            try:
-                while self.running:
-                    now = datetime.now(self.bot.timezone)
-                    target_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                    
-                    # If target time has passed today, schedule for tomorrow
-                    if target_time <= now:
-                        target_time += timedelta(days=1)
-                    
-                    sleep_seconds = (target_time - now).total_seconds()
-                    await asyncio.sleep(sleep_seconds)
-                    
-                    if self.running:
-                        try:
-                            await coro
-                        except Exception as e:
-                            self.logger.error(f"Daily task execution error: {e}", exc_info=True)
-            except asyncio.CancelledError:
-                self.logger.info("Daily task cancelled")
-            except Exception as e:
-                self.logger.error(f"Daily task loop error: {e}", exc_info=True)
-        
-        task = asyncio.create_task(daily_task())
-        task.add_done_callback(self._task_done_callback)
-        self.tasks.append(task)
-        return task
-    
+        """Schedule a one-time task from a coroutine, coroutine function or callable."""
+        return self.schedule_once(coro, delay_seconds)
+
+    async def schedule_daily_task(self, coro_factory, hour, minute=0):
+        """Schedule a daily recurring task from a coroutine function or callable."""
+        return self.schedule_daily(coro_factory, hour, minute)
+
     def _task_done_callback(self, task):
         """Callback for when a task is done to handle exceptions."""
         try:
@@ -179,13 +644,13 @@ class TaskScheduler:
             self.logger.debug("Task was cancelled")
         except Exception as e:
             self.logger.error(f"Task exception: {e}", exc_info=True)
-    
+
     def get_next_hourly_announcement(self):
         """Get the time of the next hourly announcement."""
         now = datetime.now(self.bot.timezone)
         next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
         return next_hour
-    
+
     def is_running(self):
         """Check if the scheduler is running."""
         return self.running
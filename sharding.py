@@ -0,0 +1,589 @@
+"""
+Running the bot as several XMPP connections in separate worker processes.
+"""
+
+import asyncio
+import bisect
+import configparser
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+
+def _hash(key):
+    """Map a key to a point on the ring."""
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring assigning rooms to shards.
+
+    Each shard is placed on the ring at several virtual points so rooms spread
+    evenly, and removing a shard only moves the rooms that shard owned.
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        """Initialize the ring with the given nodes."""
+        self.replicas = replicas
+        self._points = []
+        self._owners = []
+        self.nodes = set()
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        """Place a node on the ring."""
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = _hash(f'{node}#{replica}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node):
+        """Take a node off the ring."""
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        keep = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in keep]
+        self._owners = [owner for _, owner in keep]
+
+    def get_node(self, key):
+        """Get the node owning a key, or None if the ring is empty."""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+    def assign(self, keys):
+        """Group keys by owning node."""
+        assignment = {node: [] for node in self.nodes}
+        for key in keys:
+            node = self.get_node(key)
+            if node is not None:
+                assignment[node].append(key)
+        return assignment
+
+
+def shard_account(config, shard_id):
+    """
+    Get the (jid, password) a shard connects with.
+
+    [sharding] jids lists separate accounts used round-robin; without it every
+    shard uses the bot account with its own resource.
+    """
+    password = config.get('bot', 'password', fallback=os.getenv('XMPP_PASSWORD', 'password'))
+    jids = [jid.strip() for jid in config.get('sharding', 'jids', fallback='').split(',') if jid.strip()]
+    if jids:
+        passwords = [p.strip() for p in config.get('sharding', 'passwords', fallback='').split(',')]
+        index = shard_id % len(jids)
+        if index < len(passwords) and passwords[index]:
+            password = passwords[index]
+        return jids[index], password
+
+    jid = config.get('bot', 'jid', fallback=os.getenv('XMPP_JID', 'bot@example.com'))
+    prefix = config.get('sharding', 'resource_prefix', fallback='shard')
+    return f"{jid.split('/', 1)[0]}/{prefix}{shard_id}", password
+
+
+def shard_config(config_file, shard_id, rooms):
+    """Build the configuration of one shard from the main configuration file."""
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    for section in ('bot', 'logging', 'scheduler', 'metrics', 'caps', 'snapshot', 'debug', 'server',
+                    'archive', 'history'):
+        if not config.has_section(section):
+            config.add_section(section)
+
+    jid, password = shard_account(config, shard_id)
+    config.set('bot', 'jid', jid)
+    config.set('bot', 'password', password)
+    config.set('bot', 'auto_join_rooms', ','.join(rooms))
+
+    # Per-shard log file and metrics port so processes do not collide
+    root, ext = os.path.splitext(config.get('logging', 'file', fallback='jabberbot.log'))
+    config.set('logging', 'file', f'{root}-shard{shard_id}{ext or ".log"}')
+    port = config.getint('metrics', 'port', fallback=9100)
+    config.set('metrics', 'port', str(port + shard_id))
+    caps_file = config.get('caps', 'cache_file', fallback='caps_cache.json')
+    if caps_file:
+        root, ext = os.path.splitext(caps_file)
+        config.set('caps', 'cache_file', f'{root}-shard{shard_id}{ext}')
+    snapshot_file = config.get('snapshot', 'file', fallback='')
+    if snapshot_file:
+        root, ext = os.path.splitext(snapshot_file)
+        config.set('snapshot', 'file', f'{root}-shard{shard_id}{ext}')
+    cache_file = config.get('server', 'cache_file', fallback='dns_cache.json')
+    if cache_file:
+        root, ext = os.path.splitext(cache_file)
+        config.set('server', 'cache_file', f'{root}-shard{shard_id}{ext}')
+    # The archive hands out message ids per process, so shards cannot share its database
+    archive_path = config.get('archive', 'path', fallback='archive')
+    config.set('archive', 'path', os.path.join(archive_path, f'shard{shard_id}'))
+    last_seen_file = config.get('history', 'last_seen_file', fallback='')
+    if last_seen_file:
+        root, ext = os.path.splitext(last_seen_file)
+        config.set('history', 'last_seen_file', f'{root}-shard{shard_id}{ext}')
+    output_dir = config.get('debug', 'output_dir', fallback='profiles')
+    config.set('debug', 'output_dir', os.path.join(output_dir, f'shard{shard_id}'))
+
+    # Only the first shard runs persistent jobs; their messages are routed to the owning shard
+    if shard_id != 0:
+        config.set('scheduler', 'jobstore', '')
+    return config
+
+
+def run_shard(config_file, shard_id, rooms, conn, debug=False):
+    """Process entry point of a shard worker."""
+    asyncio.run(_shard_main(config_file, shard_id, rooms, conn, debug))
+
+
+async def _shard_main(config_file, shard_id, rooms, conn, debug):
+    """Run one bot connection until the coordinator stops it."""
+    # Imported here so the coordinator process does not load the bot
+    from jabberbot import JabberBot
+    from main import setup_logging
+
+    config = shard_config(config_file, shard_id, rooms)
+    log_listener = setup_logging(debug, config)
+    logger = logging.getLogger(__name__)
+
+    bot = JabberBot(config)
+    client = ShardClient(bot, conn, shard_id)
+    bot.shard = client
+    client.start()
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGUSR1, lambda: bot.profiler.trigger(on_done=logger.info)
+    )
+
+    metrics_server = None
+    if config.getboolean('metrics', 'enabled', fallback=False):
+        from metrics import MetricsServer
+        metrics_server = MetricsServer(bot.metrics.registry,
+                                       config.get('metrics', 'host', fallback='127.0.0.1'),
+                                       config.getint('metrics', 'port'))
+        await metrics_server.start()
+
+    logger.info("Shard %d starting as %s with %d rooms", shard_id, bot.requested_jid, len(rooms))
+    bot.connect(*bot.connection.address())
+    try:
+        await client.stopped.wait()
+    finally:
+        await bot.scheduler.stop()
+        await bot.dispatcher.stop()
+        await bot.outbound.stop()
+        await bot.archive.stop()
+        bot.close()
+        await client.stop()
+        if metrics_server:
+            await metrics_server.stop()
+        logger.info("Shard %d stopped", shard_id)
+        if log_listener:
+            log_listener.stop()
+
+
+class ShardClient:
+    """
+    The shard side of the coordinator link.
+
+    Carries out joins, leaves and broadcasts sent by the coordinator, answers
+    its stats requests, and lets the bot ask for cluster-wide stats and send
+    messages to rooms owned by other shards.
+    """
+
+    def __init__(self, bot, conn, shard_id):
+        """Initialize the link over a multiprocessing pipe end."""
+        self.bot = bot
+        self.conn = conn
+        self.shard_id = shard_id
+        self.logger = logging.getLogger(__name__)
+        self.heartbeat_interval = bot.config.getfloat('sharding', 'heartbeat_interval', fallback=5.0)
+        self.stopped = asyncio.Event()
+        self._requests = {}
+        self._request_ids = itertools.count()
+        self._heartbeat = None
+        self._tasks = set()
+
+    def start(self):
+        """Start reading from the pipe and sending heartbeats."""
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.conn.fileno(), self._on_readable)
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        self.bot.add_event_handler('session_start', self._session_started)
+
+    async def stop(self):
+        """Stop reading from the pipe."""
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self.conn.fileno())
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def _send(self, *message):
+        """Send a message to the coordinator, stopping the shard if it is gone."""
+        try:
+            self.conn.send(message)
+        except (BrokenPipeError, EOFError, OSError):
+            self.logger.error("Lost the coordinator, shutting down shard %d", self.shard_id)
+            self.stopped.set()
+
+    async def _heartbeat_loop(self):
+        """Tell the coordinator we are alive."""
+        while True:
+            self._send('heartbeat', self.local_stats())
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _session_started(self, event):
+        """Report that the connection is up."""
+        self._send('ready')
+
+    def _spawn(self, coro):
+        """Run a coroutine in the background, keeping a reference to it."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _on_readable(self):
+        """Handle every message waiting on the pipe."""
+        try:
+            while self.conn.poll():
+                self._handle(self.conn.recv())
+        except (EOFError, OSError):
+            self.logger.error("Coordinator pipe closed, shutting down shard %d", self.shard_id)
+            asyncio.get_running_loop().remove_reader(self.conn.fileno())
+            self.stopped.set()
+
+    def _handle(self, message):
+        """Carry out one coordinator message."""
+        kind = message[0]
+        conference = self.bot.conference_manager
+        if kind == 'join':
+            self._spawn(conference.join_room(message[1]))
+        elif kind == 'leave':
+            self._spawn(conference.leave_room(message[1]))
+        elif kind == 'broadcast':
+            conference.broadcast_message(message[1])
+        elif kind == 'send':
+            conference.send_room_message(message[1], message[2], reroute=False)
+        elif kind == 'stats':
+            self._send('stats', message[1], self.local_stats())
+        elif kind == 'profile':
+            self.bot.profiler.trigger(on_done=self.logger.info)
+        elif kind == 'reply':
+            future = self._requests.pop(message[1], None)
+            if future and not future.done():
+                future.set_result(message[2])
+        elif kind == 'stop':
+            self.stopped.set()
+
+    def local_stats(self):
+        """Get this shard's share of the status."""
+        return {
+            'shard': self.shard_id,
+            'jid': str(self.bot.boundjid),
+            'rooms': self.bot.occupants.rooms(),
+            'users': self.bot.occupants.count(),
+            'outbound_depth': self.bot.outbound.depth(),
+        }
+
+    async def cluster_stats(self, timeout=5.0):
+        """Get the stats of every live shard, falling back to our own on timeout."""
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = future
+        self._send('cluster_stats', request_id)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._requests.pop(request_id, None)
+            self.logger.warning("Timed out waiting for cluster stats")
+            return [self.local_stats()]
+
+    def route(self, room_jid, message):
+        """Ask the coordinator to deliver a message to a room owned by another shard."""
+        self._send('route', room_jid, message)
+
+    def broadcast(self, message):
+        """Ask the coordinator to broadcast a message through every shard."""
+        self._send('broadcast', message)
+
+
+class ShardWorker:
+    """Coordinator-side state of one shard process."""
+
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.process = None
+        self.conn = None
+        self.last_seen = 0.0
+        self.ready = False
+        self.stats = None
+        self.restart_at = None
+
+    @property
+    def alive(self):
+        """Check whether the process is running."""
+        return self.process is not None and self.process.is_alive()
+
+
+class ShardCoordinator:
+    """
+    Runs the bot as several connections in worker processes.
+
+    Rooms from auto_join_rooms are assigned to shards with a consistent hash
+    ring. When a shard dies its rooms move to the surviving shards; when it
+    is restarted the rooms that hash to it move back. Broadcasts are routed to
+    every shard and status requests are answered across all of them.
+    """
+
+    def __init__(self, config_file, shard_count, debug=False):
+        """Initialize the coordinator for a configuration file and shard count."""
+        self.config_file = config_file
+        self.debug = debug
+        self.logger = logging.getLogger(__name__)
+
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        self.config = config
+        self.shard_count = shard_count
+        self.heartbeat_timeout = config.getfloat('sharding', 'heartbeat_timeout', fallback=30.0)
+        self.restart_delay = config.getfloat('sharding', 'restart_delay', fallback=10.0)
+        self.stats_timeout = config.getfloat('sharding', 'stats_timeout', fallback=5.0)
+
+        rooms = config.get('bot', 'auto_join_rooms', fallback='')
+        self.rooms = [room.strip() for room in rooms.split(',') if room.strip()]
+
+        self.ring = HashRing(range(shard_count), config.getint('sharding', 'replicas', fallback=100))
+        self.workers = {shard_id: ShardWorker(shard_id) for shard_id in range(shard_count)}
+        self.owner = {}  # room -> shard id currently told to be in it
+        self._context = multiprocessing.get_context('spawn')
+        self._monitor = None
+        self._pending = {}
+        self._request_ids = itertools.count()
+
+    async def start(self):
+        """Start every shard with its share of the rooms."""
+        assignment = self.ring.assign(self.rooms)
+        for shard_id, worker in self.workers.items():
+            rooms = assignment.get(shard_id, [])
+            for room in rooms:
+                self.owner[room] = shard_id
+            self._spawn(worker, rooms)
+        self.logger.info("Started %d shards for %d rooms", self.shard_count, len(self.rooms))
+        self._monitor = asyncio.create_task(self._monitor_loop())
+
+    async def stop(self):
+        """Ask every shard to stop and wait for the processes to exit."""
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        for worker in self.workers.values():
+            if worker.alive:
+                self._send(worker, 'stop')
+        for worker in self.workers.values():
+            if worker.process is not None:
+                await asyncio.get_running_loop().run_in_executor(None, worker.process.join, 15)
+                if worker.process.is_alive():
+                    self.logger.warning("Shard %d did not stop, terminating it", worker.shard_id)
+                    worker.process.terminate()
+            self._close(worker)
+
+    def _spawn(self, worker, rooms):
+        """Start a shard process."""
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=run_shard,
+            args=(self.config_file, worker.shard_id, rooms, child_conn, self.debug),
+            name=f'jabberbot-shard{worker.shard_id}',
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker.process = process
+        worker.conn = parent_conn
+        worker.last_seen = time.monotonic()
+        worker.ready = False
+        worker.restart_at = None
+        asyncio.get_running_loop().add_reader(parent_conn.fileno(), self._on_readable, worker)
+        self.logger.info("Shard %d started (pid %d) with %d rooms",
+                         worker.shard_id, process.pid, len(rooms))
+
+    def _close(self, worker):
+        """Forget a shard's pipe."""
+        if worker.conn is not None:
+            asyncio.get_running_loop().remove_reader(worker.conn.fileno())
+            worker.conn.close()
+            worker.conn = None
+
+    def _send(self, worker, *message):
+        """Send a message to a shard, returning False if it cannot be reached."""
+        if worker.conn is None:
+            return False
+        try:
+            worker.conn.send(message)
+            return True
+        except (BrokenPipeError, EOFError, OSError):
+            return False
+
+    def _on_readable(self, worker):
+        """Handle every message waiting from a shard."""
+        try:
+            while worker.conn is not None and worker.conn.poll():
+                self._handle(worker, worker.conn.recv())
+        except (EOFError, OSError):
+            self._close(worker)
+
+    def _handle(self, worker, message):
+        """Handle one message from a shard."""
+        worker.last_seen = time.monotonic()
+        kind = message[0]
+        if kind == 'heartbeat':
+            worker.stats = message[1]
+        elif kind == 'ready':
+            worker.ready = True
+            self.logger.info("Shard %d connected", worker.shard_id)
+        elif kind == 'stats':
+            future = self._pending.pop(message[1], None)
+            if future and not future.done():
+                future.set_result(message[2])
+        elif kind == 'cluster_stats':
+            asyncio.create_task(self._answer_cluster_stats(worker, message[1]))
+        elif kind == 'route':
+            self.send_room_message(message[1], message[2])
+        elif kind == 'broadcast':
+            self.broadcast(message[1])
+
+    async def _answer_cluster_stats(self, worker, request_id):
+        """Answer a shard's request for the stats of all shards."""
+        stats = await self.cluster_stats()
+        self._send(worker, 'reply', request_id, stats)
+
+    async def cluster_stats(self):
+        """Collect fresh stats from every live shard, using the last heartbeat on timeout."""
+        loop = asyncio.get_running_loop()
+        requests = {}
+        for shard_id, worker in self.workers.items():
+            if worker.alive:
+                request_id = next(self._request_ids)
+                future = self._pending[request_id] = loop.create_future()
+                if self._send(worker, 'stats', request_id):
+                    requests[shard_id] = (request_id, future)
+                else:
+                    del self._pending[request_id]
+
+        if requests:
+            await asyncio.wait([future for _, future in requests.values()], timeout=self.stats_timeout)
+        stats = []
+        for shard_id, (request_id, future) in sorted(requests.items()):
+            self._pending.pop(request_id, None)
+            if future.done():
+                stats.append(future.result())
+            elif self.workers[shard_id].stats:
+                stats.append(self.workers[shard_id].stats)
+        return stats
+
+    def broadcast(self, message):
+        """Broadcast a message to every room through every live shard."""
+        sent = 0
+        for worker in self.workers.values():
+            if worker.alive and self._send(worker, 'broadcast', message):
+                sent += 1
+        self.logger.info("Broadcast routed to %d shards", sent)
+        return sent
+
+    def profile(self):
+        """Ask every live shard to run a profile."""
+        for worker in self.workers.values():
+            if worker.alive:
+                self._send(worker, 'profile')
+
+    def send_room_message(self, room_jid, message):
+        """Deliver a message to a room through the shard that owns it."""
+        shard_id = self.owner.get(room_jid)
+        worker = self.workers.get(shard_id)
+        if worker is None or not self._send(worker, 'send', room_jid, message):
+            self.logger.warning("No live shard owns %s, dropped message", room_jid)
+            return False
+        return True
+
+    def join_room(self, room_jid):
+        """Add a room and join it through the shard it hashes to."""
+        if room_jid not in self.rooms:
+            self.rooms.append(room_jid)
+        shard_id = self.ring.get_node(room_jid)
+        if shard_id is None:
+            return False
+        self.owner[room_jid] = shard_id
+        return self._send(self.workers[shard_id], 'join', room_jid)
+
+    def leave_room(self, room_jid):
+        """Remove a room and leave it."""
+        if room_jid in self.rooms:
+            self.rooms.remove(room_jid)
+        shard_id = self.owner.pop(room_jid, None)
+        if shard_id is None:
+            return False
+        return self._send(self.workers[shard_id], 'leave', room_jid)
+
+    def _rebalance(self):
+        """Move rooms to the shards the ring now assigns them to."""
+        moved = 0
+        for room in self.rooms:
+            shard_id = self.ring.get_node(room)
+            current = self.owner.get(room)
+            if shard_id == current:
+                continue
+            if current is not None and self.workers[current].alive:
+                self._send(self.workers[current], 'leave', room)
+            if shard_id is None:
+                self.owner.pop(room, None)
+                continue
+            self.owner[room] = shard_id
+            self._send(self.workers[shard_id], 'join', room)
+            moved += 1
+        if moved:
+            self.logger.info("Rebalanced %d rooms across shards %s", moved, sorted(self.ring.nodes))
+
+    async def _monitor_loop(self):
+        """Detect dead or hung shards, move their rooms, and restart them."""
+        while True:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            for worker in self.workers.values():
+                if worker.restart_at is not None:
+                    if now >= worker.restart_at:
+                        self._restart(worker)
+                    continue
+
+                hung = worker.alive and now - worker.last_seen > self.heartbeat_timeout
+                if worker.alive and not hung:
+                    continue
+                if hung:
+                    self.logger.error("Shard %d missed heartbeats, killing it", worker.shard_id)
+                    worker.process.kill()
+                else:
+                    self.logger.error("Shard %d exited with code %s",
+                                      worker.shard_id, worker.process.exitcode)
+                self._close(worker)
+                self.ring.remove_node(worker.shard_id)
+                self._rebalance()
+                worker.restart_at = now + self.restart_delay
+
+    def _restart(self, worker):
+        """Bring a dead shard back and move its rooms back to it."""
+        self.ring.add_node(worker.shard_id)
+        rooms = [room for room in self.rooms if self.ring.get_node(room) == worker.shard_id]
+        for room in rooms:
+            current = self.owner.get(room)
+            if current is not None and current != worker.shard_id and self.workers[current].alive:
+                self._send(self.workers[current], 'leave', room)
+            self.owner[room] = worker.shard_id
+        self._spawn(worker, rooms)
@@ -0,0 +1,351 @@
+"""
+Warm-restart snapshots of rooms, occupants and room settings.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+BASE_MAGIC = b'JBSNAP'
+JOURNAL_MAGIC = b'JBJRNL'
+VERSION = 1
+HEADER = struct.Struct('<6sBQ')    # magic, version, generation
+FRAME = struct.Struct('<II')       # payload length, CRC-32 of the payload
+RECORD = struct.Struct('<BdI')     # flags, stamp, occupant count
+SHORT = struct.Struct('<H')
+LONG = struct.Struct('<I')
+
+# Record flags
+JOINED = 1     # the bot was in the room
+REMOVED = 2    # the room is gone; drops earlier records of it
+
+# Roles and affiliations are stored as one byte; index 0 is unknown
+ROLES = (None, 'moderator', 'participant', 'visitor', 'none')
+AFFILIATIONS = (None, 'owner', 'admin', 'member', 'outcast', 'none')
+_ROLE_CODES = {value: code for code, value in enumerate(ROLES)}
+_AFFILIATION_CODES = {value: code for code, value in enumerate(AFFILIATIONS)}
+
+
+def _pack_str(value, length=SHORT):
+    """Encode an optional string with a length prefix; None and '' are both empty."""
+    data = value.encode('utf-8') if value else b''
+    return length.pack(len(data)) + data
+
+
+def _unpack_str(data, offset, length=SHORT):
+    """Decode a length-prefixed string, returning it and the next offset."""
+    (size,) = length.unpack_from(data, offset)
+    offset += length.size
+    end = offset + size
+    if end > len(data):
+        raise ValueError("String runs past the end of the record")
+    return data[offset:end].decode('utf-8') or None, end
+
+
+def encode_room(room, flags, stamp, settings=None, occupants=()):
+    """Encode one room as a framed record."""
+    parts = [RECORD.pack(flags, stamp, len(occupants)), _pack_str(room)]
+    parts.append(_pack_str(json.dumps(settings, separators=(',', ':')) if settings else None, LONG))
+    for occupant in occupants:
+        parts.append(_pack_str(occupant.nick))
+        parts.append(_pack_str(occupant.jid))
+        parts.append(bytes((_ROLE_CODES.get(occupant.role, 0),
+                            _AFFILIATION_CODES.get(occupant.affiliation, 0))))
+    payload = b''.join(parts)
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_room(payload):
+    """Decode a record payload into (room, flags, stamp, settings, [(nick, jid, role, affiliation)])."""
+    flags, stamp, count = RECORD.unpack_from(payload, 0)
+    room, offset = _unpack_str(payload, RECORD.size)
+    settings, offset = _unpack_str(payload, offset, LONG)
+    occupants = []
+    for _ in range(count):
+        nick, offset = _unpack_str(payload, offset)
+        jid, offset = _unpack_str(payload, offset)
+        role, affiliation = payload[offset], payload[offset + 1]
+        offset += 2
+        occupants.append((nick, jid, ROLES[role] if role < len(ROLES) else None,
+                          AFFILIATIONS[affiliation] if affiliation < len(AFFILIATIONS) else None))
+    return room, flags, stamp, json.loads(settings) if settings else {}, occupants
+
+
+def record_key(payload):
+    """Get the room and stamp of a record payload without decoding the rest."""
+    stamp = RECORD.unpack_from(payload, 0)[1]
+    return _unpack_str(payload, RECORD.size)[0], stamp
+
+
+def read_records(path, magic):
+    """
+    Read a snapshot file.
+
+    Returns (generation, [(raw record, payload)], end of the last good record);
+    the generation is None if the file is missing or not a snapshot file.
+    Reading stops at the first truncated or corrupt record.
+    """
+    try:
+        with open(path, 'rb') as handle:
+            data = handle.read()
+    except FileNotFoundError:
+        return None, [], 0
+    if len(data) < HEADER.size:
+        return None, [], 0
+    file_magic, version, generation = HEADER.unpack_from(data, 0)
+    if file_magic != magic or version != VERSION:
+        return None, [], 0
+    records = []
+    offset = HEADER.size
+    while offset + FRAME.size <= len(data):
+        length, crc = FRAME.unpack_from(data, offset)
+        start = offset + FRAME.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append((data[offset:start + length], payload))
+        offset = start + length
+    return generation, records, offset
+
+
+class StateSnapshot:
+    """
+    Keeps room, occupant and room settings state on disk across restarts.
+
+    The state lives in a base file and a journal next to it. Both are
+    sequences of framed binary records, one per room, each carrying a
+    CRC-32; the newest record of a room replaces older ones. Every
+    flush_interval only the rooms that changed since the last flush are
+    encoded on the event loop and appended to the journal in a worker thread.
+    Once the journal outgrows the base, the base is rewritten from the
+    encoded records already kept in memory and swapped in with a rename,
+    and the journal restarts. The journal names the base generation it
+    belongs to, so a crash between those two steps never replays records
+    older than the base, and a record torn by a crash is simply dropped.
+
+    On startup the saved room settings are restored and the rooms are
+    rejoined. The saved occupant list of each room is only used while its
+    fresh occupant list arrives: nicks that were already there are not
+    greeted again, and nicks that joined while the bot was away are.
+    """
+
+    def __init__(self, bot):
+        """Initialize snapshots with bot instance and load the saved state."""
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+
+        config = self.bot.config
+        self.path = config.get('snapshot', 'file', fallback='')
+        self.journal_path = f'{self.path}.journal'
+        self.flush_interval = config.getfloat('snapshot', 'flush_interval', fallback=30.0)
+        self.max_age = config.getfloat('snapshot', 'max_age', fallback=86400.0)
+        self.compact_min = config.getint('snapshot', 'compact_min', fallback=2**20)
+        self.fsync = config.getboolean('snapshot', 'fsync', fallback=True)
+
+        self.records = {}   # room -> its latest encoded record
+        self.restored = {}  # room -> nicks present before the restart, until the rejoin completes
+        self._rejoin = []   # rooms the bot was in before the restart
+        self._changed = set()  # rooms whose settings changed since the last flush
+        self._generation = 0
+        self._base_size = 0
+        self._journal_size = 0
+        self._lock = asyncio.Lock()
+        self._write_lock = threading.Lock()
+        self.flush_job = None
+        self.stats = {'flushes': 0, 'records': 0, 'bytes': 0, 'compactions': 0}
+
+        if self.path:
+            self._load()
+
+    def _load(self):
+        """Restore room settings and remember who was where."""
+        generation, base, base_end = read_records(self.path, BASE_MAGIC)
+        journal_generation, journal, journal_end = read_records(self.journal_path, JOURNAL_MAGIC)
+        if generation is None:
+            generation = 0
+            base = []
+        # A journal of another generation predates the current base
+        if journal_generation != generation:
+            journal = []
+            journal_end = 0
+        self._generation = generation
+        self._base_size = base_end
+        self._journal_size = journal_end
+
+        # The newest record of each room wins
+        rooms = {}
+        for raw, payload in base + journal:
+            try:
+                room, stamp = record_key(payload)
+            except (ValueError, struct.error, UnicodeDecodeError):
+                continue
+            if room not in rooms or stamp >= rooms[room][0]:
+                rooms[room] = (stamp, raw, payload)
+
+        now = time.time()
+        occupant_count = 0
+        settings = self.bot.conference_manager.room_settings
+        for room, (_, raw, payload) in rooms.items():
+            try:
+                room, flags, stamp, room_settings, occupants = decode_room(payload)
+            except (ValueError, IndexError, struct.error, UnicodeDecodeError) as e:
+                self.logger.warning(f"Skipping unreadable snapshot record of {room}: {e}")
+                continue
+            if flags & REMOVED:
+                continue
+            self.records[room] = raw
+            if room_settings:
+                settings.setdefault(room, {}).update(room_settings)
+            if flags & JOINED:
+                self._rejoin.append(room)
+                if now - stamp <= self.max_age:
+                    self.restored[room] = frozenset(occupant[0] for occupant in occupants)
+                    occupant_count += len(occupants)
+        if self.records:
+            self.logger.info("Restored %d rooms and %d occupants from %s",
+                             len(self.records), occupant_count, self.path)
+
+    def start(self):
+        """Schedule periodic flushes."""
+        if self.path and self.flush_job is None:
+            self.flush_job = self.bot.scheduler.schedule_interval(
+                self.flush, self.flush_interval, name='snapshot_flush'
+            )
+
+    def rejoin_rooms(self):
+        """Get the rooms to rejoin after a restart, once."""
+        rooms, self._rejoin = self._rejoin, []
+        # A shard's rooms are assigned by the coordinator
+        return [] if self.bot.shard else rooms
+
+    def room_changed(self, room_jid):
+        """Mark a room's settings as changed."""
+        if self.path:
+            self._changed.add(room_jid)
+
+    def was_present(self, room_jid, nick):
+        """
+        Check whether a nick was in a room before the restart.
+
+        Returns None while there is no saved occupant list for the room.
+        """
+        nicks = self.restored.get(room_jid)
+        return None if nicks is None else nick in nicks
+
+    def room_joined(self, room_jid):
+        """Finish reconciling a room once its fresh occupant list is complete."""
+        nicks = self.restored.pop(room_jid, None)
+        if nicks is None:
+            return
+        present = set(self.bot.occupants.nicks(room_jid))
+        self.logger.info("Rejoined %s: %d occupants still present, %d new, %d gone",
+                         room_jid, len(present & nicks), len(present - nicks), len(nicks - present))
+
+    def _collect(self):
+        """Encode every room that changed since the last flush."""
+        changed = self.bot.occupants.take_changed() | self._changed
+        self._changed = set()
+        occupants = self.bot.occupants
+        settings = self.bot.conference_manager.room_settings
+        now = time.time()
+        records = []
+        for room in changed:
+            joined = occupants.has_room(room)
+            room_settings = settings.get(room)
+            if not joined and not room_settings:
+                if self.records.pop(room, None) is None:
+                    continue
+                record = encode_room(room, REMOVED, now)
+            else:
+                try:
+                    record = encode_room(room, JOINED if joined else 0, now, room_settings,
+                                         occupants.occupants(room) if joined else ())
+                except (TypeError, ValueError) as e:
+                    self.logger.warning(f"Not saving settings of {room}: {e}")
+                    record = encode_room(room, JOINED if joined else 0, now, None,
+                                         occupants.occupants(room) if joined else ())
+                self.records[room] = record
+            records.append(record)
+        return records
+
+    async def flush(self):
+        """Append changed rooms to the journal in a worker thread."""
+        if not self.path:
+            return
+        async with self._lock:
+            records = self._collect()
+            if not records:
+                return
+            await asyncio.get_running_loop().run_in_executor(None, self._write, records)
+
+    def _write(self, records):
+        """Append records to the journal, or fold everything into a new base once it is large."""
+        with self._write_lock:
+            try:
+                if self._journal_size > max(self.compact_min, self._base_size):
+                    # Taken under the lock so no record collected before it is lost;
+                    # copying the dict values happens in one step under the GIL
+                    self._compact(list(self.records.values()))
+                else:
+                    self._append(records)
+            except OSError as e:
+                self.logger.error(f"Could not write snapshot to {self.path}: {e}")
+
+    def _append(self, records):
+        """Append records to the journal, starting it if needed."""
+        if self._journal_size == 0:
+            self._replace(self.journal_path, JOURNAL_MAGIC, self._generation, [])
+            self._journal_size = HEADER.size
+        data = b''.join(records)
+        with open(self.journal_path, 'r+b') as handle:
+            # Anything past the last good record is a torn write; overwrite it
+            handle.seek(self._journal_size)
+            handle.write(data)
+            handle.truncate()
+            handle.flush()
+            if self.fsync:
+                os.fsync(handle.fileno())
+        self._journal_size += len(data)
+        self.stats['flushes'] += 1
+        self.stats['records'] += len(records)
+        self.stats['bytes'] += len(data)
+        self.logger.debug("Snapshot: appended %d rooms (%d bytes)", len(records), len(data))
+
+    def _compact(self, records):
+        """Replace the base with the given records and start a new, empty journal."""
+        generation = self._generation + 1
+        self._base_size = self._replace(self.path, BASE_MAGIC, generation, records)
+        # From here on the old journal no longer matches the base and is ignored
+        self._generation = generation
+        self._replace(self.journal_path, JOURNAL_MAGIC, generation, [])
+        self._journal_size = HEADER.size
+        self.stats['compactions'] += 1
+        self.logger.info("Snapshot compacted: %d rooms, %d bytes", len(records), self._base_size)
+
+    def _replace(self, path, magic, generation, records):
+        """Atomically replace a snapshot file, returning its size."""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as handle:
+            handle.write(HEADER.pack(magic, VERSION, generation))
+            for record in records:
+                handle.write(record)
+            size = handle.tell()
+            handle.flush()
+            if self.fsync:
+                os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+        return size
+
+    def close(self):
+        """Write out remaining changes synchronously."""
+        if not self.path:
+            return
+        records = self._collect()
+        if records:
+            self._write(records)